@@ -0,0 +1,101 @@
+"""Measures `Leaderboard` with a million synthetic players.
+
+Uses a local Redis (the database is flushed, so pick a spare one):
+
+    python -m benchmarks.bench_leaderboard --url redis://localhost:6379/15
+
+Without Redis the benchmark can run against fakeredis with fewer players,
+which shows the complexity but not the real latency:
+
+    python -m benchmarks.bench_leaderboard --fake --players 100000
+
+"""
+
+import argparse
+import asyncio
+import time
+from random import Random
+from typing import AsyncIterator, Awaitable, Callable, List, Tuple
+
+from redis.asyncio import Redis
+from redis.exceptions import ResponseError
+
+from benchmarks.common import setup_env
+
+setup_env()
+
+from game.leaderboard import Leaderboard  # noqa: E402
+
+
+NUMBER = 2000
+
+
+async def synthetic_scores(players: int, rng: Random) -> AsyncIterator[Tuple[int, int]]:
+    for player_id in range(1, players + 1):
+        yield player_id, rng.randint(-50, 5000)
+
+
+async def measure(func: Callable[[], Awaitable[object]], number: int) -> Tuple[float, float]:
+    """Returns p50 and p99 latency of `func` calls in microseconds."""
+    latencies: List[float] = []
+    for _ in range(number):
+        start = time.perf_counter()
+        await func()
+        latencies.append((time.perf_counter() - start) * 1_000_000)
+
+    latencies.sort()
+    return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+
+async def run(redis: Redis, players: int) -> None:
+    rng = Random(42)
+    leaderboard = Leaderboard(redis)
+    await redis.flushdb()
+
+    start = time.perf_counter()
+    ranked = await leaderboard.rebuild(synthetic_scores(players, rng))
+    elapsed = time.perf_counter() - start
+    print(f"rebuild: {ranked} players in {elapsed:.2f}s ({ranked / elapsed:.0f} players/s)")
+    try:
+        memory = await redis.memory_usage(leaderboard.key)
+        print(f"sorted set size: {memory / 1024 / 1024:.1f} MiB")
+    except ResponseError:
+        # fakeredis doesn't support MEMORY USAGE.
+        pass
+
+    scores = [score async for _, score in synthetic_scores(players, Random(42))]
+    start = time.perf_counter()
+    sorted(range(players), key=scores.__getitem__, reverse=True)[:10]
+    print(f"baseline, sorting all scores in process: {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    print(f"{'operation':>10} {'p50, us':>10} {'p99, us':>10}")
+    for name, func in (
+        ("update", lambda: leaderboard.update(rng.randint(1, players), rng.randint(-50, 5000))),
+        ("top 10", lambda: leaderboard.top(10)),
+        ("rank", lambda: leaderboard.rank(rng.randint(1, players))),
+    ):
+        p50, p99 = await measure(func, NUMBER)
+        print(f"{name:>10} {p50:>10.0f} {p99:>10.0f}")
+
+    await redis.flushdb()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="redis://localhost:6379/15")
+    parser.add_argument("--players", type=int, default=1_000_000)
+    parser.add_argument("--fake", action="store_true", help="use fakeredis instead of a Redis server")
+    args = parser.parse_args()
+
+    if args.fake:
+        from fakeredis.aioredis import FakeRedis
+
+        redis = FakeRedis()
+    else:
+        redis = Redis.from_url(args.url)
+
+    asyncio.run(run(redis, args.players))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Compares cold-start time and peak memory of loading the films catalogue.
+
+    python -m benchmarks.bench_loader
+
+"""
+
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Tuple
+
+from benchmarks.common import setup_env
+
+setup_env()
+
+from database.loader import load_films_file  # noqa: E402
+from database.models import Film  # noqa: E402
+
+
+CATALOGUE_SIZES = (10_000, 100_000)
+
+
+def json_load(path: str) -> list:
+    """The loading method used before the streaming loader."""
+    with open(path, "r") as json_file:
+        films = json.load(json_file)
+    return [Film(**film) for film in films]
+
+
+def measure(load: Callable[[], list]) -> Tuple[float, float]:
+    """Returns time in seconds and peak memory in megabytes of a call."""
+    start = time.perf_counter()
+    load()
+    elapsed = time.perf_counter() - start
+
+    # Tracing slows the call down, so memory is measured by a separate run.
+    tracemalloc.start()
+    load()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1024 / 1024
+
+
+def main() -> None:
+    print(f"{'films':>8} {'method':>10} {'time, s':>9} {'peak, MB':>10}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        for size in CATALOGUE_SIZES:
+            path = os.path.join(directory, f"films_{size}.json")
+            snapshot_path = os.path.join(directory, f"films_{size}.pickle")
+            with open(path, "w") as films_file:
+                json.dump(
+                    [
+                        {
+                            "_id": i,
+                            "name": f"Film {i}",
+                            "year": 2000,
+                            "genre": "Drama",
+                            "description": "A long description of the film. " * 10,
+                            "image_path": "res/images/1.jpg",
+                        }
+                        for i in range(size)
+                    ],
+                    films_file,
+                )
+
+            methods = {
+                "json.load": lambda: json_load(path),
+                "stream": lambda: load_films_file(path),
+                # The first call writes the snapshot.
+                "snapshot": lambda: load_films_file(path, snapshot_path),
+            }
+            load_films_file(path, snapshot_path)
+
+            for name, load in methods.items():
+                elapsed, peak = measure(load)
+                print(f"{size:>8} {name:>10} {elapsed:>9.2f} {peak:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
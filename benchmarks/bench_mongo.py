@@ -0,0 +1,161 @@
+"""Measures MongoDB client settings on saves of players and on a ranking query.
+
+Needs a spare local mongod, the benchmark database is dropped. The
+`majority` write concern is meaningful on a replica set, e.g. one node:
+
+    docker run --rm -p 27017:27017 mongo:7 --replSet rs0
+    docker exec <container> mongosh --eval "rs.initiate()"
+    python -m benchmarks.bench_mongo --uri "mongodb://localhost:27017/?directConnection=true"
+
+For every setting players are saved like the write-behind flusher does:
+chunks of changes written by concurrent bulk writes. Then the best players
+by score are queried without and with the indexes from `database.database`.
+
+"""
+
+import argparse
+import asyncio
+import time
+from random import Random
+from typing import Any, Dict, List, Tuple
+
+from benchmarks.common import setup_env
+
+setup_env()
+
+from pymongo import AsyncMongoClient, DESCENDING  # noqa: E402
+
+from database.dao import PlayerDao  # noqa: E402
+from database.database import INDEXES, available_compressors  # noqa: E402
+from database.models import Player, PlayerChanges  # noqa: E402
+
+
+DATABASE = "guessfilm_benchmark"
+
+SETTINGS: List[Tuple[str, Dict[str, Any]]] = [
+    ("w=1", {"w": 1}),
+    ("w=majority", {"w": "majority"}),
+    ("w=1, zlib", {"w": 1, "compressors": "zlib"}),
+    ("w=1, zstd", {"w": 1, "compressors": "zstd"}),
+    ("w=1, pool 1", {"w": 1, "maxPoolSize": 1}),
+    ("w=1, pool 4", {"w": 1, "maxPoolSize": 4}),
+    ("w=1, pool 20", {"w": 1, "maxPoolSize": 20}),
+]
+
+
+def synthetic_changes(players: int, count: int, rng: Random) -> List[PlayerChanges]:
+    """Returns changes of random players like the ones made by rounds."""
+    return [
+        PlayerChanges(
+            player_id=rng.randint(1, players),
+            score_delta=rng.choice((-5, 7, 9, 11)),
+            fields={"current_film": None, "attempts": rng.randint(0, 3)},
+            guessed_added=[rng.randint(1, 5000)],
+        )
+        for _ in range(count)
+    ]
+
+
+async def seed(dao: PlayerDao, players: int, rng: Random, chunk_size: int = 10_000) -> None:
+    for start in range(1, players + 1, chunk_size):
+        await dao.save_many(
+            Player(_id=player_id, score=rng.randint(-50, 5000))
+            for player_id in range(start, min(start + chunk_size, players + 1))
+        )
+
+
+async def measure_saves(
+    dao: PlayerDao, changes: List[PlayerChanges], chunk_size: int, concurrency: int
+) -> Tuple[float, float, float]:
+    """Returns players saved per second and p50 and p99 latency of a chunk in milliseconds."""
+    chunks = [changes[start:start + chunk_size] for start in range(0, len(changes), chunk_size)]
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+
+    async def save(chunk: List[PlayerChanges]) -> None:
+        async with semaphore:
+            chunk_start = time.perf_counter()
+            await dao.save_changes(chunk)
+            latencies.append((time.perf_counter() - chunk_start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(save(chunk) for chunk in chunks))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return len(changes) / elapsed, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+
+async def measure_top(client: AsyncMongoClient, number: int) -> Tuple[float, int]:
+    """Returns p50 latency of the top 10 query in milliseconds and number of examined documents."""
+    database = client[DATABASE]
+    collection = database[PlayerDao.collection_name]
+
+    latencies: List[float] = []
+    for _ in range(number):
+        start = time.perf_counter()
+        await collection.find({}, {"score": True}).sort("score", DESCENDING).limit(10).to_list()
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    explain = await database.command(
+        {
+            "explain": {"find": collection.name, "sort": {"score": -1}, "limit": 10},
+            "verbosity": "executionStats",
+        }
+    )
+    latencies.sort()
+    return latencies[len(latencies) // 2], explain["executionStats"]["totalDocsExamined"]
+
+
+async def run(uri: str, players: int, saves: int, chunk_size: int, concurrency: int) -> None:
+    client: AsyncMongoClient = AsyncMongoClient(uri)
+    await client.drop_database(DATABASE)
+    rng = Random(42)
+
+    start = time.perf_counter()
+    await seed(PlayerDao(client[DATABASE]), players, rng)
+    print(f"seeded {players} players in {time.perf_counter() - start:.1f}s\n")
+
+    print(f"{'setting':<16} {'players/s':>10} {'chunk p50, ms':>14} {'chunk p99, ms':>14}")
+    for name, options in SETTINGS:
+        compressors = options.get("compressors")
+        if compressors and not available_compressors([compressors]):
+            continue
+
+        setting_client: AsyncMongoClient = AsyncMongoClient(uri, **options)
+        dao = PlayerDao(setting_client[DATABASE])
+        # Opens the connections, so the first chunks don't pay for handshakes.
+        await measure_saves(dao, synthetic_changes(players, chunk_size * concurrency, rng), chunk_size, concurrency)
+
+        rate, p50, p99 = await measure_saves(dao, synthetic_changes(players, saves, rng), chunk_size, concurrency)
+        print(f"{name:<16} {rate:>10.0f} {p50:>14.1f} {p99:>14.1f}")
+        await setting_client.close()
+
+    collection = client[DATABASE][PlayerDao.collection_name]
+    print(f"\n{'top 10 by score':<16} {'p50, ms':>10} {'docs examined':>14}")
+    await collection.drop_indexes()
+    p50, examined = await measure_top(client, 20)
+    print(f"{'without index':<16} {p50:>10.1f} {examined:>14}")
+
+    await collection.create_indexes(INDEXES[PlayerDao.collection_name])
+    p50, examined = await measure_top(client, 200)
+    print(f"{'with index':<16} {p50:>10.1f} {examined:>14}")
+
+    await client.drop_database(DATABASE)
+    await client.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default="mongodb://localhost:27017/?directConnection=true")
+    parser.add_argument("--players", type=int, default=200_000)
+    parser.add_argument("--saves", type=int, default=50_000, help="number of saved players changes per setting")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    asyncio.run(run(args.uri, args.players, args.saves, args.chunk_size, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
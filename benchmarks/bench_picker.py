@@ -0,0 +1,55 @@
+"""Compares the shuffle-and-scan film picking with `FilmPicker`, uniform and by weights.
+
+    python -m benchmarks.bench_picker
+
+"""
+
+from random import Random, shuffle
+from typing import List
+
+from benchmarks.common import setup_env, timeit
+
+setup_env()
+
+from database.models import Film, GuessedFilms  # noqa: E402
+from game.picker import AliasTable, FilmPicker  # noqa: E402
+
+
+CATALOGUE_SIZES = (1_000, 10_000, 50_000)
+GUESSED_RATIOS = (0.0, 0.5, 0.9, 0.99)
+NUMBER = 200
+
+
+def shuffle_and_scan(films: List[Film], guessed_films: List[int]) -> Film:
+    """The picking method used before `FilmPicker`."""
+    films = list(films)
+    shuffle(films)
+
+    for film in films:
+        if film._id not in guessed_films:
+            return film
+
+
+def main() -> None:
+    rng = Random(42)
+    print(f"{'films':>8} {'guessed':>8} {'shuffle, us':>14} {'picker, us':>12} {'weighted, us':>14}")
+
+    for size in CATALOGUE_SIZES:
+        films = [Film(_id=i, name=f"Film {i}", year=2000, genre="Drama") for i in range(size)]
+        picker = FilmPicker(films, rng=rng)
+        table = AliasTable([rng.random() + 0.05 for _ in range(size)])
+
+        for ratio in GUESSED_RATIOS:
+            guessed_list: List[int] = rng.sample(range(size), int(size * ratio))
+            guessed = GuessedFilms(guessed_list)
+
+            # The old method is O(N*G), keep it affordable on big inputs.
+            number = NUMBER if size * ratio < 10_000 else 3
+            old = timeit(lambda: shuffle_and_scan(films, guessed_list), number)
+            new = timeit(lambda: picker.pick(guessed), NUMBER)
+            weighted = timeit(lambda: picker.pick(guessed, table), NUMBER)
+            print(f"{size:>8} {ratio:>8.0%} {old:>14.1f} {new:>12.2f} {weighted:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Measures memory used by one cached player before and after compact `Player`.
+
+Players are kept in a dict for both representations, the last column adds
+the overhead of `PlayerCache` entries.
+
+    python -m benchmarks.bench_player_memory
+
+"""
+
+import tracemalloc
+from dataclasses import dataclass, field
+from random import Random
+from typing import Callable, List, Optional
+
+from benchmarks.common import setup_env
+
+setup_env()
+
+from database.models import Player  # noqa: E402
+from game.cache import PlayerCache  # noqa: E402
+
+
+PLAYERS = 20_000
+GUESSED_FILMS = (0, 10, 100, 1_000)
+CATALOGUE_SIZE = 50_000
+
+
+@dataclass
+class ListPlayer:
+    """The player representation used before: a regular dataclass with a list."""
+
+    _id: int
+    current_film: Optional[int] = None
+    attempts: int = 0
+    guessed_films: List[int] = field(default_factory=list)
+    score: int = 0
+
+
+def bytes_per_player(build: Callable[[], object]) -> float:
+    tracemalloc.start()
+    players = build()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del players
+    return current / PLAYERS
+
+
+def main() -> None:
+    rng = Random(42)
+    print(f"{'guessed':>8} {'list, B':>10} {'compact, B':>11} {'compact in cache, B':>20}")
+
+    for guessed in GUESSED_FILMS:
+        guessed_films = [rng.sample(range(CATALOGUE_SIZE), guessed) for _ in range(PLAYERS)]
+
+        def build_list_players() -> dict:
+            return {i: ListPlayer(_id=i, guessed_films=list(films)) for i, films in enumerate(guessed_films)}
+
+        def build_compact_players() -> dict:
+            return {i: Player(_id=i, guessed_films=films) for i, films in enumerate(guessed_films)}
+
+        def build_cached_players() -> PlayerCache:
+            cache = PlayerCache(PLAYERS, 3600)
+            for i, films in enumerate(guessed_films):
+                cache.put(Player(_id=i, guessed_films=films))
+            return cache
+
+        before = bytes_per_player(build_list_players)
+        after = bytes_per_player(build_compact_players)
+        cached = bytes_per_player(build_cached_players)
+        print(f"{guessed:>8} {before:>10.0f} {after:>11.0f} {cached:>20.0f}")
+
+
+if __name__ == "__main__":
+    main()
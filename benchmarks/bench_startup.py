@@ -0,0 +1,161 @@
+"""Profiles the startup of the bot process.
+
+Imports `main` in fresh interpreters with `-X importtime` and reports the
+median import time and the modules which take most of it. Then starts the
+dispatcher in fresh interpreters with fakeredis, mongomock and a fake Bot
+API and reports when updates are accepted and when the game is ready.
+
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --runs 10 --top 30 --connect-delay 2
+
+`--connect-delay` simulates a slow MongoDB connection (e.g. DNS SRV
+resolution of a `mongodb+srv://` URI). Byte code is compiled before the
+runs, so the results don't include compilation.
+
+"""
+
+import argparse
+import compileall
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+from benchmarks.common import BENCHMARK_ENV
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)$")
+
+
+def child_env(**extra: str) -> Dict[str, str]:
+    env = {**os.environ, **BENCHMARK_ENV, **extra}
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    return env
+
+
+def profile_imports() -> Dict[str, Tuple[int, int]]:
+    """Imports `main` in a fresh interpreter and returns self and cumulative microseconds by module."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=ROOT,
+        env=child_env(),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    modules = {}
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            modules[match.group(4)] = (int(match.group(1)), int(match.group(2)))
+    return modules
+
+
+def report_imports(runs: int, top: int) -> None:
+    profiles = [profile_imports() for _ in range(runs)]
+    total = statistics.median(profile["main"][1] for profile in profiles) / 1000
+    print(f"import main: {total:.0f} ms (median of {runs} runs)\n")
+
+    packages: Dict[str, List[int]] = defaultdict(list)
+    modules: Dict[str, List[int]] = defaultdict(list)
+    for profile in profiles:
+        by_package: Dict[str, int] = defaultdict(int)
+        for name, (self_time, _) in profile.items():
+            modules[name].append(self_time)
+            by_package[name.split(".")[0]] += self_time
+        for name, self_time in by_package.items():
+            packages[name].append(self_time)
+
+    for title, times in (("package", packages), ("module", modules)):
+        medians = sorted(((statistics.median(values) / 1000, name) for name, values in times.items()), reverse=True)
+        print(f"{title:<50} {'self, ms':>9}")
+        for milliseconds, name in medians[:top]:
+            print(f"{name:<50} {milliseconds:>9.1f}")
+        print()
+
+
+def run_child(connect_delay: float) -> None:
+    """Starts the dispatcher and prints seconds since the interpreter started."""
+    import asyncio
+
+    started_at = float(os.environ["BENCH_STARTED_AT"])
+
+    async def start() -> None:
+        from aiogram import Bot
+        from fakeredis.aioredis import FakeRedis
+        from mongomock_motor import AsyncMongoMockClient
+
+        from services.dispatcher import create_dispatcher
+        from tools.fake_telegram import FakeTelegramSession
+
+        imported = time.time() - started_at
+
+        def connect_database():
+            time.sleep(connect_delay)
+            return AsyncMongoMockClient()["guessfilm_benchmark"]
+
+        bot = Bot(token="123456:benchmark", session=FakeTelegramSession())
+        dp = await create_dispatcher(FakeRedis(), connect_database, bot)
+        await dp.emit_startup(bot=bot, dispatcher=dp, bots=[bot], **dp.workflow_data)
+        accepting = time.time() - started_at
+
+        await dp.workflow_data["readiness"].wait()
+        ready = time.time() - started_at
+        await dp.emit_shutdown(bot=bot, dispatcher=dp, bots=[bot], **dp.workflow_data)
+        print(imported, accepting, ready)
+
+    asyncio.run(start())
+
+
+def report_startup(runs: int, connect_delay: float) -> None:
+    print(f"{'mode':<12} {'imported, s':>12} {'accepting, s':>13} {'ready, s':>9}")
+    for fast_start in ("true", "false"):
+        results = []
+        for _ in range(runs):
+            env = child_env(
+                FAST_START=fast_start,
+                BENCH_STARTED_AT=str(time.time()),
+                METRICS_PORT="0",
+                FILMS_WATCH_INTERVAL="0",
+                PLAYERS_CHECKPOINT_PATH="",
+                IMAGE_VARIANTS_PATH="",
+            )
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_startup", "--child", "--connect-delay", str(connect_delay)],
+                cwd=ROOT,
+                env=env,
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+            results.append([float(value) for value in output.split()[-3:]])
+
+        imported, accepting, ready = (statistics.median(column) for column in zip(*results))
+        mode = "fast start" if fast_start == "true" else "blocking"
+        print(f"{mode:<12} {imported:>12.2f} {accepting:>13.2f} {ready:>9.2f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=20, help="number of the slowest packages and modules to show")
+    parser.add_argument("--connect-delay", type=float, default=1.0, help="seconds connecting to MongoDB takes")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.connect_delay)
+        return
+
+    compileall.compile_dir(ROOT, quiet=1)
+    report_imports(args.runs, args.top)
+    report_startup(args.runs, args.connect_delay)
+
+
+if __name__ == "__main__":
+    main()
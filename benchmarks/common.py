@@ -0,0 +1,36 @@
+"""Helpers shared by benchmark scripts.
+
+Benchmarks are run from the repository root as modules, e.g.:
+
+    python -m benchmarks.bench_picker
+
+"""
+
+import os
+import time
+from typing import Callable
+
+
+BENCHMARK_ENV = {
+    "BOT_TOKEN": "123456:benchmark",
+    "MONGO_HOST": "localhost",
+    "MONGO_INITDB_ROOT_USERNAME": "benchmark",
+    "MONGO_INITDB_ROOT_PASSWORD": "benchmark",
+    "MONGO_INITDB_DATABASE": "guessfilm_benchmark",
+    "FILMS_FILE_PATH": "films.json",
+    "NUMBER_OF_ATTEMPTS": "3",
+}
+
+
+def setup_env() -> None:
+    """Fills required settings so project modules can be imported without `.env`."""
+    for name, value in BENCHMARK_ENV.items():
+        os.environ.setdefault(name, value)
+
+
+def timeit(func: Callable[[], object], number: int) -> float:
+    """Returns the average time of one `func` call in microseconds."""
+    start = time.perf_counter()
+    for _ in range(number):
+        func()
+    return (time.perf_counter() - start) / number * 1_000_000
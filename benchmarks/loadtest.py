@@ -0,0 +1,223 @@
+"""End-to-end load test of the bot with synthetic players.
+
+Runs the real `Dispatcher` with all routers, middlewares and the real
+`GuessFilm`; Telegram is replaced by `FakeTelegramSession`, MongoDB by
+mongomock and Redis by fakeredis unless their URLs are given. Every player
+sends /start and plays rounds: /play, a few wrong guesses, then the right
+answer or /surrender, waiting for the bot's reply after each message.
+
+    python -m benchmarks.loadtest --players 2000 --concurrency 200
+    python -m benchmarks.loadtest --save baseline.json
+    python -m benchmarks.loadtest --baseline baseline.json
+
+Reported latencies: `handle` is the time of processing an update by the
+dispatcher, `reply` is the time until the bot sends the reply to the chat.
+Throttling and Telegram rate limits are disabled unless `--throttle` and
+`--telegram-limits` are given, so the bot itself is measured.
+
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import resource
+import time
+from random import Random
+from typing import Dict, List, Optional
+
+from benchmarks.common import setup_env
+
+
+def percentile(values: List[float], ratio: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * ratio))]
+
+
+def peak_rss_mib() -> float:
+    # ru_maxrss is in KiB on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Simulation:
+    """Plays synthetic players against a dispatcher and records latencies."""
+
+    def __init__(self, dp, bot, game, reply_timeout: float) -> None:
+        self.dp = dp
+        self.bot = bot
+        self.game = game
+        self.reply_timeout = reply_timeout
+        self.handle_latencies: List[float] = []
+        self.reply_latencies: List[float] = []
+        self.timeouts = 0
+        self._update_ids = itertools.count(1)
+        self._replies: Dict[int, asyncio.Future] = {}
+
+    def on_request(self, method) -> None:
+        """Resolves the reply waited by the chat the method is sent to."""
+        future = self._replies.pop(getattr(method, "chat_id", None), None)
+        if future is not None and not future.done():
+            future.set_result(time.perf_counter())
+
+    async def send(self, user_id: int, text: str) -> None:
+        from aiogram.types import Update
+
+        from tools.fake_telegram import make_update
+
+        future = asyncio.get_running_loop().create_future()
+        self._replies[user_id] = future
+        update = Update.model_validate(make_update(next(self._update_ids), user_id, text), context={"bot": self.bot})
+
+        start = time.perf_counter()
+        await self.dp.feed_update(self.bot, update)
+        self.handle_latencies.append(time.perf_counter() - start)
+
+        try:
+            replied_at = await asyncio.wait_for(future, self.reply_timeout)
+        except asyncio.TimeoutError:
+            self._replies.pop(user_id, None)
+            self.timeouts += 1
+            return
+        self.reply_latencies.append(replied_at - start)
+
+    async def play(self, user_id: int, rounds: int, win_rate: float, attempts: int, rng: Random) -> None:
+        await self.send(user_id, "/start")
+
+        for _ in range(rounds):
+            await self.send(user_id, "/play")
+            for _ in range(rng.randint(0, attempts - 1)):
+                await self.send(user_id, f"wrong answer {rng.randint(0, 10 ** 6)}")
+
+            player = await self.game.get_player(user_id)
+            film = self.game.catalogue.get(player.current_film) if player.current_film is not None else None
+            if film is not None and rng.random() < win_rate:
+                await self.send(user_id, film.name)
+            else:
+                await self.send(user_id, "/surrender")
+
+
+async def run(args: argparse.Namespace) -> Dict[str, float]:
+    # Project modules read settings on import, so they are imported after the environment is set.
+    from aiogram import Bot
+    from redis.asyncio import Redis
+
+    from config.config import NUMBER_OF_ATTEMPTS
+    from services.dispatcher import create_dispatcher
+    from tools.fake_telegram import FakeTelegramSession
+
+    if args.redis_url:
+        redis = Redis.from_url(args.redis_url)
+    else:
+        from fakeredis.aioredis import FakeRedis
+
+        redis = FakeRedis()
+    await redis.flushdb()
+
+    if args.mongo_uri:
+        from pymongo import AsyncMongoClient
+
+        database = AsyncMongoClient(args.mongo_uri)["guessfilm_loadtest"]
+        await database["Players"].drop()
+    else:
+        from mongomock_motor import AsyncMongoMockClient
+
+        database = AsyncMongoMockClient()["guessfilm_loadtest"]
+
+    session = FakeTelegramSession(latency=args.api_latency)
+    bot = Bot(token="123456:loadtest", session=session)
+    dp = await create_dispatcher(redis, lambda: database, bot)
+    await dp.emit_startup(bot=bot, dispatcher=dp, bots=[bot], **dp.workflow_data)
+    game = (await dp.workflow_data["readiness"].wait())["game"]
+
+    simulation = Simulation(dp, bot, game, args.reply_timeout)
+    session.on_request = simulation.on_request
+
+    rss_before = peak_rss_mib()
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def play(user_id: int) -> None:
+        async with semaphore:
+            await simulation.play(user_id, args.rounds, args.win_rate, NUMBER_OF_ATTEMPTS, Random(user_id))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(play(user_id) for user_id in range(1, args.players + 1)))
+    elapsed = time.perf_counter() - start
+
+    shutdown_start = time.perf_counter()
+    await dp.emit_shutdown(bot=bot, dispatcher=dp, bots=[bot], **dp.workflow_data)
+    shutdown = time.perf_counter() - shutdown_start
+
+    updates = len(simulation.handle_latencies)
+    return {
+        "players": args.players,
+        "updates": updates,
+        "seconds": elapsed,
+        "updates_per_second": updates / elapsed,
+        "handle_p50_ms": percentile(simulation.handle_latencies, 0.5) * 1000,
+        "handle_p99_ms": percentile(simulation.handle_latencies, 0.99) * 1000,
+        "reply_p50_ms": percentile(simulation.reply_latencies, 0.5) * 1000,
+        "reply_p99_ms": percentile(simulation.reply_latencies, 0.99) * 1000,
+        "reply_timeouts": simulation.timeouts,
+        "shutdown_seconds": shutdown,
+        "peak_rss_mib": peak_rss_mib(),
+        "rss_growth_mib": peak_rss_mib() - rss_before,
+        "saved_players": await database["Players"].count_documents({}),
+    }
+
+
+def report(results: Dict[str, float], baseline: Optional[Dict[str, float]]) -> None:
+    for name, value in results.items():
+        line = f"{name:>20}: {value:>12.2f}"
+        if baseline and baseline.get(name):
+            line += f"  ({(value - baseline[name]) / baseline[name] * 100:+.1f}% vs baseline {baseline[name]:.2f})"
+        print(line)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--players", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=100, help="number of players playing at once")
+    parser.add_argument("--rounds", type=int, default=3, help="rounds played by every player")
+    parser.add_argument("--win-rate", type=float, default=0.5)
+    parser.add_argument("--store", choices=("memory", "redis"), default="memory")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="seconds every Bot API request takes")
+    parser.add_argument("--reply-timeout", type=float, default=10.0)
+    parser.add_argument("--redis-url", default=None, help="use a Redis server instead of fakeredis")
+    parser.add_argument("--mongo-uri", default=None, help="use a MongoDB server instead of mongomock")
+    parser.add_argument("--throttle", action="store_true", help="keep the default throttling of users")
+    parser.add_argument("--telegram-limits", action="store_true", help="keep the default outbox rate limits")
+    parser.add_argument("--save", default=None, help="save results to a JSON file")
+    parser.add_argument("--baseline", default=None, help="compare results with a saved JSON file")
+    args = parser.parse_args()
+
+    setup_env()
+    os.environ["PLAYERS_STORE"] = args.store
+    os.environ.setdefault("FILMS_WATCH_INTERVAL", "0")
+    os.environ.setdefault("METRICS_PORT", "0")
+    # Every run starts with an empty database, so nothing is replayed.
+    os.environ.setdefault("PLAYERS_CHECKPOINT_PATH", "")
+    if not args.throttle:
+        for name in ("THROTTLE_IN_GAME", "THROTTLE_NOT_IN_GAME", "THROTTLE_OTHER", "THROTTLE_GLOBAL"):
+            os.environ[name] = "0,0"
+    if not args.telegram_limits:
+        os.environ["OUTBOX_GLOBAL_RATE"] = "1000000"
+        os.environ["OUTBOX_CHAT_INTERVAL"] = "0"
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    results = asyncio.run(run(args))
+    report(results, baseline)
+
+    if args.save:
+        with open(args.save, "w") as results_file:
+            json.dump(results, results_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 import os
 from pathlib import Path
+from typing import List, Optional, Tuple, Union
 from dotenv import load_dotenv
 
 
@@ -15,41 +16,173 @@ class ImproperlyConfigured(Exception):
         super().__init__(self.message, *args, **kwargs)
 
 
-def get_env_variable(var_name: str, cast=str) -> str:
+_NOT_SET = object()
+
+
+def get_env_variable(var_name: str, cast=str, default=_NOT_SET) -> str:
     """Get an environment variable or raise an exception.
 
     Args:
         var_name: a name of a environment variable.
+        cast: a callable to convert the value.
+        default: a value to return if the environment variable is not set.
 
     Returns:
         A value of the environment variable.
 
     Raises:
-        ImproperlyConfigured: if the environment variable is not set.
+        ImproperlyConfigured: if the environment variable is not set and
+                              there is no default.
     """
 
     try:
         return cast(os.environ[var_name])
     except KeyError:
+        if default is not _NOT_SET:
+            return default
         raise ImproperlyConfigured(var_name)
     except TypeError:
         raise TypeError(f"Variable {var_name} must be type {cast}.")
 
 
+def parse_bool(value: str) -> bool:
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def parse_list(value: str) -> List[str]:
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def parse_write_concern(value: str) -> Union[int, str]:
+    """Parses the `w` option of a write concern: a number of nodes or a tag like "majority"."""
+    return int(value) if value.isdigit() else value
+
+
+def parse_rate_limit(value: str) -> Optional[Tuple[float, int]]:
+    """Parses a "RATE,BURST" limit, e.g. "1,3"; a non positive rate means no limit."""
+    rate, burst = value.split(",")
+    return (float(rate), int(burst)) if float(rate) > 0 else None
+
+
 BASE_PATH: str = Path(__file__).resolve().parent.parent
 RESOURCES_PATH: str = os.path.join(BASE_PATH, "res/")
 
 BOT_TOKEN: str = get_env_variable("BOT_TOKEN")
+# Comma separated ids of Telegram users allowed to run admin commands.
+ADMIN_IDS: List[int] = get_env_variable("ADMIN_IDS", lambda ids: [int(i) for i in ids.split(",") if i.strip()], [])
+# Base URL of a Bot API server, e.g. a local one; the official server is used if not set.
+TELEGRAM_API_SERVER: Optional[str] = get_env_variable("TELEGRAM_API_SERVER", str, None)
 
 """ Mongo settings """
 MONGO_HOST: str = get_env_variable("MONGO_HOST")
 MONGO_USERNAME: str = get_env_variable("MONGO_INITDB_ROOT_USERNAME")
 MONGO_PASSWORD: str = get_env_variable("MONGO_INITDB_ROOT_PASSWORD")
 MONGO_DATABASE: str = get_env_variable("MONGO_INITDB_DATABASE")
-MONGO_CONNECTION_URI: str = (
-    f"mongodb+srv://{MONGO_USERNAME}:{MONGO_PASSWORD}@{MONGO_HOST}/?retryWrites=true&w=majority&appName=Cluster0"
+# Overrides the Atlas URI built from the settings above, e.g. mongodb://localhost:27017 for a local mongod.
+MONGO_CONNECTION_URI: str = get_env_variable("MONGO_URI", str, None) or (
+    f"mongodb+srv://{MONGO_USERNAME}:{MONGO_PASSWORD}@{MONGO_HOST}/?retryWrites=true&appName=Cluster0"
+)
+# Connections of one bot process; the flusher saves up to 4 chunks at once.
+MONGO_MAX_POOL_SIZE: int = get_env_variable("MONGO_MAX_POOL_SIZE", int, 20)
+# Connections kept open while idle, so the next flush doesn't wait for a TLS handshake.
+MONGO_MIN_POOL_SIZE: int = get_env_variable("MONGO_MIN_POOL_SIZE", int, 2)
+MONGO_MAX_IDLE_TIME: float = get_env_variable("MONGO_MAX_IDLE_TIME", float, 300.0)
+MONGO_CONNECT_TIMEOUT: float = get_env_variable("MONGO_CONNECT_TIMEOUT", float, 5.0)
+MONGO_SERVER_SELECTION_TIMEOUT: float = get_env_variable("MONGO_SERVER_SELECTION_TIMEOUT", float, 10.0)
+# Wire compression in order of preference; compressors whose modules are not installed are skipped.
+MONGO_COMPRESSORS: List[str] = get_env_variable("MONGO_COMPRESSORS", parse_list, ["zstd", "zlib"])
+MONGO_READ_PREFERENCE: str = get_env_variable("MONGO_READ_PREFERENCE", str, "primary")
+# Write concern of saves made while the bot runs; losing the last ones on a failover is acceptable.
+MONGO_WRITE_CONCERN: Union[int, str] = get_env_variable("MONGO_WRITE_CONCERN", parse_write_concern, 1)
+# Write concern of the final flush and of players replayed from the checkpoint, which is deleted then.
+MONGO_DURABLE_WRITE_CONCERN: Union[int, str] = get_env_variable(
+    "MONGO_DURABLE_WRITE_CONCERN", parse_write_concern, "majority"
 )
 
 FILMS_FILE_PATH: str = os.path.join(RESOURCES_PATH, get_env_variable("FILMS_FILE_PATH"))
+# "file" loads films from FILMS_FILE_PATH, "mongo" from the Films collection.
+FILMS_SOURCE: str = get_env_variable("FILMS_SOURCE", str, "file")
+# Parsed films are cached here until the films file changes; empty value disables the cache.
+FILMS_SNAPSHOT_PATH: str = get_env_variable("FILMS_SNAPSHOT_PATH", str, os.path.join(BASE_PATH, ".cache", "films.pickle"))
+# Number of seconds between checks of the films file for changes; 0 disables watching.
+FILMS_WATCH_INTERVAL: float = get_env_variable("FILMS_WATCH_INTERVAL", float, 10.0)
 
 NUMBER_OF_ATTEMPTS: int = get_env_variable("NUMBER_OF_ATTEMPTS", int)
+# Number of seconds members of a group chat have for guessing a film.
+GROUP_ROUND_DURATION: float = get_env_variable("GROUP_ROUND_DURATION", float, 60.0)
+# Results of rounds are added to the shared statistics of films every this number of seconds.
+FILM_STATS_FLUSH_INTERVAL: float = get_env_variable("FILM_STATS_FLUSH_INTERVAL", float, 10.0)
+# Number of seconds between rebuilds of the film sampler by skill; 0 picks films uniformly.
+FILM_STATS_REBUILD_INTERVAL: float = get_env_variable("FILM_STATS_REBUILD_INTERVAL", float, 300.0)
+# Number of skill levels of players, each one gets films of its own difficulty.
+DIFFICULTY_LEVELS: int = get_env_variable("DIFFICULTY_LEVELS", int, 5)
+
+""" Redis settings """
+REDIS_HOST: str = get_env_variable("REDIS_HOST", str, "redis")
+REDIS_PORT: int = get_env_variable("REDIS_PORT", int, 6379)
+
+""" Players storage settings """
+# "memory" keeps players in the process, "redis" shares them between workers.
+PLAYERS_STORE: str = get_env_variable("PLAYERS_STORE", str, "memory")
+PLAYERS_CACHE_SIZE: int = get_env_variable("PLAYERS_CACHE_SIZE", int, 10_000)
+PLAYERS_CACHE_TTL: float = get_env_variable("PLAYERS_CACHE_TTL", float, 3600.0)
+PLAYERS_FLUSH_INTERVAL: float = get_env_variable("PLAYERS_FLUSH_INTERVAL", float, 5.0)
+PLAYERS_FLUSH_THRESHOLD: int = get_env_variable("PLAYERS_FLUSH_THRESHOLD", int, 500)
+# Players of the redis store saved with one bulk write.
+PLAYERS_REDIS_BATCH_SIZE: int = get_env_variable("PLAYERS_REDIS_BATCH_SIZE", int, 500)
+# Seconds a player is kept in Redis after its last access, it's loaded from MongoDB again afterwards.
+PLAYERS_REDIS_TTL: float = get_env_variable("PLAYERS_REDIS_TTL", float, 86400.0)
+# Not saved players of the memory store are checkpointed here; empty value disables the checkpoint.
+PLAYERS_CHECKPOINT_PATH: str = get_env_variable(
+    "PLAYERS_CHECKPOINT_PATH", str, os.path.join(BASE_PATH, "data", "players.checkpoint")
+)
+PLAYERS_CHECKPOINT_INTERVAL: float = get_env_variable("PLAYERS_CHECKPOINT_INTERVAL", float, 1.0)
+# Number of seconds the final flush may take, the rest is left in the checkpoint.
+PLAYERS_SHUTDOWN_TIMEOUT: float = get_env_variable("PLAYERS_SHUTDOWN_TIMEOUT", float, 15.0)
+
+""" Images settings """
+# A service chat for uploading film images at startup; warm-up is disabled if not set.
+IMAGES_WARMUP_CHAT_ID: Optional[int] = get_env_variable("IMAGES_WARMUP_CHAT_ID", int, None)
+# Seconds between checks of image files for replaced images; 0 disables the checks.
+IMAGES_CHECK_INTERVAL: float = get_env_variable("IMAGES_CHECK_INTERVAL", float, 60.0)
+# Blurred variants of images for hints are cached here; an empty value disables them.
+IMAGE_VARIANTS_PATH: str = get_env_variable(
+    "IMAGE_VARIANTS_PATH", str, os.path.join(BASE_PATH, ".cache", "image_variants")
+)
+IMAGE_VARIANTS_WORKERS: int = get_env_variable("IMAGE_VARIANTS_WORKERS", int, 2)
+
+""" Outbox settings """
+# Limits of outgoing messages of one bot worker.
+OUTBOX_GLOBAL_RATE: float = get_env_variable("OUTBOX_GLOBAL_RATE", float, 30.0)
+OUTBOX_CHAT_INTERVAL: float = get_env_variable("OUTBOX_CHAT_INTERVAL", float, 1.0)
+
+""" Throttling settings """
+# Limits of incoming updates as "RATE,BURST": RATE updates per second on average
+# and up to BURST updates at once. Per user limits are set for each router.
+THROTTLE_IN_GAME: Optional[Tuple[float, int]] = get_env_variable("THROTTLE_IN_GAME", parse_rate_limit, (1.0, 3))
+THROTTLE_NOT_IN_GAME: Optional[Tuple[float, int]] = get_env_variable("THROTTLE_NOT_IN_GAME", parse_rate_limit, (0.5, 5))
+THROTTLE_OTHER: Optional[Tuple[float, int]] = get_env_variable("THROTTLE_OTHER", parse_rate_limit, (0.5, 3))
+THROTTLE_GROUP: Optional[Tuple[float, int]] = get_env_variable("THROTTLE_GROUP", parse_rate_limit, (1.0, 3))
+# Limit of updates from all users together, shared by all bot workers; not set by default.
+THROTTLE_GLOBAL: Optional[Tuple[float, int]] = get_env_variable("THROTTLE_GLOBAL", parse_rate_limit, None)
+
+""" Metrics settings """
+# Prometheus metrics are served on METRICS_HOST:METRICS_PORT/metrics; 0 disables them.
+METRICS_HOST: str = get_env_variable("METRICS_HOST", str, "0.0.0.0")
+METRICS_PORT: int = get_env_variable("METRICS_PORT", int, 9100)
+
+""" Run mode settings """
+# "polling" or "webhook"
+RUN_MODE: str = get_env_variable("RUN_MODE", str, "polling")
+WEBHOOK_BASE_URL: Optional[str] = get_env_variable("WEBHOOK_BASE_URL", str, None)
+WEBHOOK_PATH: str = get_env_variable("WEBHOOK_PATH", str, "/webhook")
+WEBHOOK_SECRET: Optional[str] = get_env_variable("WEBHOOK_SECRET", str, None)
+WEBHOOK_HOST: str = get_env_variable("WEBHOOK_HOST", str, "0.0.0.0")
+WEBHOOK_PORT: int = get_env_variable("WEBHOOK_PORT", int, 8080)
+WEBHOOK_MAX_CONNECTIONS: int = get_env_variable("WEBHOOK_MAX_CONNECTIONS", int, 100)
+# Receive updates while MongoDB is connected and films are loaded; game updates wait until they are ready.
+FAST_START: bool = get_env_variable("FAST_START", parse_bool, True)
+# Number of seconds an update waits for the game to be ready before the user is asked to retry.
+STARTUP_WAIT_TIMEOUT: float = get_env_variable("STARTUP_WAIT_TIMEOUT", float, 30.0)
+# Number of worker processes; with more than one, updates are sharded between them by user id.
+WORKERS: int = get_env_variable("WORKERS", int, 1)
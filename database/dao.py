@@ -1,11 +1,16 @@
-import json
-import os
-from typing import List, Tuple, Optional, Dict
-from pymongo import ReplaceOne
-from pymongo.database import Database
+import asyncio
+from typing import TYPE_CHECKING, Any, AsyncIterator, Iterable, List, Tuple, Optional, Dict
 
-from config.config import FILMS_FILE_PATH
-from database.models import Film, Player
+from config.config import FILMS_FILE_PATH, FILMS_SNAPSHOT_PATH, FILMS_SOURCE, MONGO_DURABLE_WRITE_CONCERN
+from database.loader import OPTIONAL_FIELDS, REQUIRED_FIELDS, load_films_file, parse_films
+from database.models import Film, Player, PlayerChanges
+from services.metrics import MONGO_LATENCY
+
+if TYPE_CHECKING:
+    # pymongo is imported only when the database is used, so the bot starts faster.
+    from pymongo import UpdateOne
+    from pymongo.asynchronous.collection import AsyncCollection
+    from pymongo.asynchronous.database import AsyncDatabase
 
 
 class ObjectDoesNotExist(Exception):
@@ -14,58 +19,84 @@ class ObjectDoesNotExist(Exception):
     pass
 
 
+class PlayersNotSaved(Exception):
+    """Raises when a part of players changes was not written to the database.
+
+    Properties:
+        changes: Changes which were not saved.
+
+    """
+
+    changes: List[PlayerChanges]
+
+    def __init__(self, changes: List[PlayerChanges]) -> None:
+        super().__init__(f"{len(changes)} players changes were not saved.")
+        self.changes = changes
+
+
 class PlayerDao:
     """Class for data access of `Player` records from the Database.
 
+    Saves use the write concern of the client unless they are durable, e.g.
+    the final flush, which waits for `MONGO_DURABLE_WRITE_CONCERN`.
+
     Properties:
-        data_source: The Database object.
+        data_source: The async Database object.
         collection_name: The name of the collection in the MongoDB to access
                          `Player` records.
 
     """
 
-    data_source: Database
+    data_source: "AsyncDatabase"
     collection_name: str = "Players"
 
-    def __init__(self, data_source: Database) -> None:
+    def __init__(self, data_source: "AsyncDatabase") -> None:
         self.data_source = data_source[self.collection_name]
+        self._durable_source: Optional["AsyncCollection"] = None
 
-    def create(self, player: Player) -> Tuple[Player, bool]:
-        player_db: Optional[Dict] = self.data_source.find_one({"_id": player._id})
+    async def create(self, player: Player) -> Tuple[Player, bool]:
+        with MONGO_LATENCY.labels(self.collection_name, "find_one").time():
+            player_db: Optional[Dict] = await self.data_source.find_one({"_id": player._id})
         created = player_db is None
 
         if player_db:
             player = Player(**player_db)
         else:
-            self.data_source.insert_one(
-                {
-                    "_id": player._id,
-                    "current_film": player.current_film,
-                    "guessed_films": player.guessed_films,
-                    "attempts": player.attempts,
-                    "score": player.score,
-                }
-            )
+            with MONGO_LATENCY.labels(self.collection_name, "insert_one").time():
+                await self.data_source.insert_one(
+                    {
+                        "_id": player._id,
+                        "current_film": player.current_film,
+                        "guessed_films": player.guessed_films.to_list(),
+                        "attempts": player.attempts,
+                        "score": player.score,
+                    }
+                )
         return player, created
 
-    def get(self, player_id: int) -> Player:
-        player = self.data_source.find_one({"_id": player_id})
+    async def get(self, player_id: int) -> Player:
+        with MONGO_LATENCY.labels(self.collection_name, "find_one").time():
+            player = await self.data_source.find_one({"_id": player_id})
 
         if not player:
             raise ObjectDoesNotExist(f"Player with id {player_id} does not exist.")
 
         return Player(**player)
 
-    def save_many(self, players: List[Player]) -> None:
-        if not players:
-            return
+    async def iter_scores(self, batch_size: int = 10000) -> AsyncIterator[Tuple[int, int]]:
+        """Yields pairs of player id and score of all players."""
+        async for player in self.data_source.find({}, {"score": True}, batch_size=batch_size):
+            yield player["_id"], player.get("score", 0)
+
+    async def save_many(self, players: Iterable[Player], durable: bool = False) -> None:
+        from pymongo import ReplaceOne
 
         update_objects = [
             ReplaceOne(
                 {"_id": player._id},
                 {
                     "current_film": player.current_film,
-                    "guessed_films": player.guessed_films,
+                    "guessed_films": player.guessed_films.to_list(),
                     "attempts": player.attempts,
                     "score": player.score,
                 },
@@ -74,44 +105,111 @@ class PlayerDao:
             for player in players
         ]
 
-        self.data_source.bulk_write(update_objects)
+        if update_objects:
+            with MONGO_LATENCY.labels(self.collection_name, "bulk_write").time():
+                await self._collection(durable).bulk_write(update_objects)
+
+    async def save_changes(self, changes: List[PlayerChanges], durable: bool = False) -> None:
+        """Applies changes of players to their documents.
+
+        Only changed fields are written: the score is incremented, new
+        guessed films are added to the array and scalar fields are set.
+
+        Args:
+            changes: Changes of players.
+            durable: Whether to wait for the durable write concern.
+
+        Raises:
+            PlayersNotSaved: if some of the changes were rejected by the
+                             database; the preceding ones are applied.
+            PyMongoError: if it's unknown which changes were applied.
+        """
+        if not changes:
+            return
+
+        from pymongo.errors import BulkWriteError
+
+        try:
+            # Ordered writes stop at the first error, so it's known what is applied.
+            with MONGO_LATENCY.labels(self.collection_name, "bulk_write").time():
+                await self._collection(durable).bulk_write(
+                    [self._to_update(change) for change in changes], ordered=True
+                )
+        except BulkWriteError as e:
+            write_errors = e.details.get("writeErrors")
+            if not write_errors:
+                raise
+            raise PlayersNotSaved(changes[write_errors[0]["index"]:]) from e
+
+    def _collection(self, durable: bool) -> "AsyncCollection":
+        if not durable:
+            return self.data_source
+
+        if self._durable_source is None:
+            from pymongo import WriteConcern
+
+            self._durable_source = self.data_source.database.get_collection(
+                self.collection_name, write_concern=WriteConcern(w=MONGO_DURABLE_WRITE_CONCERN)
+            )
+        return self._durable_source
+
+    @staticmethod
+    def _to_update(changes: PlayerChanges) -> "UpdateOne":
+        from pymongo import UpdateOne
+
+        update: Dict[str, Dict[str, Any]] = {}
+        fields = dict(changes.fields)
+
+        if changes.guessed_reset:
+            fields["guessed_films"] = sorted(set(changes.guessed_added))
+        elif changes.guessed_added:
+            update["$addToSet"] = {"guessed_films": {"$each": changes.guessed_added}}
+
+        if fields:
+            update["$set"] = fields
+        if changes.score_delta:
+            update["$inc"] = {"score": changes.score_delta}
+
+        return UpdateOne({"_id": changes.player_id}, update, upsert=True)
 
 
 class FilmDao:
     """Class for data access of `Film` records from the Database.
 
     Properties:
-        data_source: The Database object.
+        data_source: The async Database object, `None` if films are loaded
+                     from the films file only.
         collection_name: The name of the collection in the MongoDB to access
                          `Film` records.
 
     """
 
-    data_source: Database
+    data_source: Optional["AsyncDatabase"]
     collection_name: str = "Films"
 
-    def __init__(self, data_source: Database) -> None:
-        self.data_source = data_source[self.collection_name]
+    def __init__(self, data_source: Optional["AsyncDatabase"]) -> None:
+        self.data_source = data_source[self.collection_name] if data_source is not None else None
 
-    def all(self) -> List[Film]:
+    async def all(self) -> List[Film]:
         """Retrieve all films from the database.
 
+        Films are loaded from the films file (in a worker thread to keep the
+        event loop free) or from the `Films` collection, depending on
+        `FILMS_SOURCE`. Invalid films are skipped.
+
         Returns:
             A list of `Film` objects.
 
         """
 
-        if not os.path.isfile(FILMS_FILE_PATH):
-            raise FileNotFoundError(f"The file with films is missing by path: {FILMS_FILE_PATH}")
+        if FILMS_SOURCE == "mongo":
+            return await self._load_from_collection()
 
-        try:
-            with open(FILMS_FILE_PATH, "r") as json_file:
-                films = json.load(json_file)
-        except json.decoder.JSONDecodeError as e:
-            raise json.decoder.JSONDecodeError(
-                msg=f"The films file ({FILMS_FILE_PATH}) has bad format (not valid JSON).",
-                doc=e.doc,
-                pos=e.pos,
-            )
+        return await asyncio.to_thread(load_films_file, FILMS_FILE_PATH, FILMS_SNAPSHOT_PATH or None)
 
-        return [Film(**film) for film in films]
+    async def _load_from_collection(self) -> List[Film]:
+        projection = dict.fromkeys(REQUIRED_FIELDS | OPTIONAL_FIELDS, True)
+        with MONGO_LATENCY.labels(self.collection_name, "find").time():
+            records = [record async for record in self.data_source.find({}, projection)]
+        # Validation checks image files on disk.
+        return await asyncio.to_thread(parse_films, iter(records), self.collection_name)
@@ -1,10 +1,77 @@
-from pymongo import MongoClient
-from pymongo.database import Database
+import importlib.util
+import logging
+from typing import Any, Dict, List
 
-from config.config import MONGO_CONNECTION_URI, MONGO_DATABASE
+from pymongo import ASCENDING, DESCENDING, AsyncMongoClient, IndexModel
+from pymongo.asynchronous.database import AsyncDatabase
 
+from config.config import (
+    MONGO_COMPRESSORS,
+    MONGO_CONNECT_TIMEOUT,
+    MONGO_CONNECTION_URI,
+    MONGO_DATABASE,
+    MONGO_MAX_IDLE_TIME,
+    MONGO_MAX_POOL_SIZE,
+    MONGO_MIN_POOL_SIZE,
+    MONGO_READ_PREFERENCE,
+    MONGO_SERVER_SELECTION_TIMEOUT,
+    MONGO_WRITE_CONCERN,
+)
 
-def get_database() -> Database:
-    """Creates a connection to the database and returns it."""
-    client: MongoClient = MongoClient(MONGO_CONNECTION_URI)
+logger = logging.getLogger(__name__)
+
+# Modules pymongo needs for wire compressors.
+COMPRESSOR_MODULES: Dict[str, str] = {"zstd": "zstandard", "snappy": "snappy", "zlib": "zlib"}
+
+# Indexes of collections by name, created at startup. Indexes are matched
+# by name, so changing the keys of an index requires a new name.
+INDEXES: Dict[str, List[IndexModel]] = {
+    "Players": [
+        # Ranking and analytics queries by score, e.g. the best players.
+        IndexModel([("score", DESCENDING), ("_id", ASCENDING)], name="score_desc"),
+    ],
+}
+
+
+def available_compressors(names: List[str]) -> List[str]:
+    """Returns the compressors whose modules are installed, keeping their order."""
+    available = [name for name in names if importlib.util.find_spec(COMPRESSOR_MODULES.get(name, name)) is not None]
+    if len(available) < len(names):
+        logger.warning("MongoDB compressors %s are not installed", ", ".join(sorted(set(names) - set(available))))
+    return available
+
+
+def client_options() -> Dict[str, Any]:
+    """Returns options of the MongoDB client from the settings."""
+    options: Dict[str, Any] = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": int(MONGO_MAX_IDLE_TIME * 1000),
+        "connectTimeoutMS": int(MONGO_CONNECT_TIMEOUT * 1000),
+        "serverSelectionTimeoutMS": int(MONGO_SERVER_SELECTION_TIMEOUT * 1000),
+        "readPreference": MONGO_READ_PREFERENCE,
+        "w": MONGO_WRITE_CONCERN,
+    }
+
+    compressors = available_compressors(MONGO_COMPRESSORS)
+    if compressors:
+        # The server picks the first compressor it supports.
+        options["compressors"] = ",".join(compressors)
+    return options
+
+
+def get_database() -> AsyncDatabase:
+    """Creates an async connection to the database and returns it.
+
+    Resolving a `mongodb+srv://` URI blocks on DNS queries, so async code
+    should call it in a worker thread.
+    """
+    client: AsyncMongoClient = AsyncMongoClient(MONGO_CONNECTION_URI, **client_options())
     return client[MONGO_DATABASE]
+
+
+async def ensure_indexes(database: AsyncDatabase) -> None:
+    """Creates missing indexes declared in `INDEXES`, existing ones are kept."""
+    for collection_name, indexes in INDEXES.items():
+        created = await database[collection_name].create_indexes(indexes)
+        logger.info("Indexes of %s: %s", collection_name, ", ".join(created))
@@ -0,0 +1,233 @@
+import dataclasses
+import json
+import logging
+import os
+import pickle
+from typing import Any, Dict, Iterator, List, Optional, TextIO, Tuple
+
+from database.models import Film
+
+logger = logging.getLogger(__name__)
+
+
+# Increase when the snapshot format or the `Film` class changes.
+SNAPSHOT_VERSION = 1
+
+REQUIRED_FIELDS: Dict[str, type] = {"_id": int, "name": str, "year": int, "genre": str}
+OPTIONAL_FIELDS: Dict[str, type] = {"description": str, "image_path": str, "aliases": list}
+
+
+class InvalidFilm(ValueError):
+    """Raises when a film record has wrong format."""
+
+    pass
+
+
+def iter_json_array(file: TextIO, chunk_size: int = 64 * 1024) -> Iterator[Any]:
+    """Parses a JSON array from a file item by item.
+
+    Only one item and a chunk of the file are kept in memory at a time.
+
+    Args:
+        file: A text file containing a JSON array.
+        chunk_size: Number of characters read from the file at once.
+
+    Yields:
+        Items of the array.
+
+    Raises:
+        JSONDecodeError: if the file is not a valid JSON array.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    eof = False
+    expect_start = True
+
+    def fill() -> bool:
+        nonlocal buffer, position, eof
+        chunk = file.read(chunk_size)
+        buffer = buffer[position:] + chunk
+        position = 0
+        eof = not chunk
+        return bool(chunk)
+
+    while True:
+        while position < len(buffer) and (buffer[position].isspace() or (not expect_start and buffer[position] == ",")):
+            position += 1
+
+        if position == len(buffer):
+            if not fill():
+                raise json.JSONDecodeError("Unexpected end of a JSON array", buffer, position)
+            continue
+
+        if expect_start:
+            if buffer[position] != "[":
+                raise json.JSONDecodeError("Expecting a JSON array", buffer, position)
+            position += 1
+            expect_start = False
+            continue
+
+        if buffer[position] == "]":
+            return
+
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # The item may be cut by the end of the chunk.
+            if eof or not fill():
+                raise
+            continue
+
+        position = end
+        yield item
+
+
+def iter_json_lines(file: TextIO) -> Iterator[Any]:
+    """Parses a JSON Lines file line by line, skipping empty lines."""
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
+
+
+def validate_film(record: Any) -> Film:
+    """Builds a `Film` from a raw record checking its fields and image.
+
+    Args:
+        record: A dictionary with film fields.
+
+    Returns:
+        The film.
+
+    Raises:
+        InvalidFilm: if a field is missing or has a wrong type, or the image
+                     file of the film does not exist.
+    """
+    if not isinstance(record, dict):
+        raise InvalidFilm(f"Film record must be an object, got {type(record).__name__}.")
+
+    fields = {}
+    for name, field_type in (REQUIRED_FIELDS | OPTIONAL_FIELDS).items():
+        value = record.get(name)
+        if value is None:
+            if name in REQUIRED_FIELDS:
+                raise InvalidFilm(f"Film {record.get('_id')} has no {name} field.")
+            continue
+        if not isinstance(value, field_type) or (field_type is int and isinstance(value, bool)):
+            raise InvalidFilm(f"Film {record.get('_id')} has {name} of a wrong type.")
+        fields[name] = value
+
+    if fields["_id"] < 0:
+        raise InvalidFilm(f"Film {fields['_id']} has a negative id.")
+
+    if not all(isinstance(alias, str) for alias in fields.get("aliases", ())):
+        raise InvalidFilm(f"Film {record.get('_id')} has aliases of a wrong type.")
+
+    film = Film(**fields)
+    if film.get_image_path() is None:
+        raise InvalidFilm(f"Film {film._id} has no image file: {film.image_path}.")
+
+    return film
+
+
+def parse_films(records: Iterator[Any], source: str) -> List[Film]:
+    """Validates film records skipping invalid ones and duplicated ids."""
+    films: Dict[int, Film] = {}
+
+    for record in records:
+        try:
+            film = validate_film(record)
+        except InvalidFilm as e:
+            logger.warning("Skipping a film from %s: %s", source, e)
+            continue
+
+        if film._id in films:
+            logger.warning("Skipping a film from %s: duplicated id %s.", source, film._id)
+            continue
+        films[film._id] = film
+
+    return list(films.values())
+
+
+def _snapshot_key(path: str) -> Tuple[int, str, int, int]:
+    stat = os.stat(path)
+    return SNAPSHOT_VERSION, os.path.abspath(path), stat.st_mtime_ns, stat.st_size
+
+
+def read_snapshot(path: str, snapshot_path: str) -> Optional[List[Film]]:
+    """Returns films from the snapshot if it was made from the current version of the file."""
+    try:
+        with open(snapshot_path, "rb") as snapshot_file:
+            key, rows = pickle.load(snapshot_file)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        logger.warning("Films snapshot %s is broken, ignoring it", snapshot_path, exc_info=True)
+        return None
+
+    if key != _snapshot_key(path):
+        return None
+
+    return [Film(*row) for row in rows]
+
+
+def write_snapshot(path: str, snapshot_path: str, films: List[Film]) -> None:
+    """Saves parsed films next to a key of the source file, so restarts skip parsing.
+
+    Films are stored as tuples of field values, which are smaller and faster
+    to unpickle than the objects.
+    """
+    names = [field.name for field in dataclasses.fields(Film)]
+    rows = [tuple(getattr(film, name) for name in names) for film in films]
+
+    try:
+        os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+        temporary_path = f"{snapshot_path}.tmp"
+        with open(temporary_path, "wb") as snapshot_file:
+            pickle.dump((_snapshot_key(path), rows), snapshot_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, snapshot_path)
+    except OSError:
+        logger.warning("Can't write films snapshot %s", snapshot_path, exc_info=True)
+
+
+def load_films_file(path: str, snapshot_path: Optional[str] = None) -> List[Film]:
+    """Loads films from a JSON array or a JSON Lines (`.jsonl`) file.
+
+    The file is parsed as a stream and every film is validated. If
+    `snapshot_path` is given, parsed films are cached there and reused
+    until the file changes.
+
+    Args:
+        path: Path to the films file.
+        snapshot_path: Path to the snapshot of parsed films.
+
+    Returns:
+        A list of valid films.
+
+    Raises:
+        FileNotFoundError: if the films file does not exist.
+        JSONDecodeError: if the films file is not valid JSON.
+    """
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"The file with films is missing by path: {path}")
+
+    if snapshot_path and (films := read_snapshot(path, snapshot_path)) is not None:
+        logger.info("Loaded %d films from snapshot %s", len(films), snapshot_path)
+        return films
+
+    try:
+        with open(path, "r", encoding="utf-8") as films_file:
+            records = iter_json_lines(films_file) if path.endswith(".jsonl") else iter_json_array(films_file)
+            films = parse_films(records, path)
+    except json.decoder.JSONDecodeError as e:
+        raise json.decoder.JSONDecodeError(
+            msg=f"The films file ({path}) has bad format (not valid JSON): {e.msg}",
+            doc=e.doc,
+            pos=e.pos,
+        )
+
+    if snapshot_path:
+        write_snapshot(path, snapshot_path, films)
+
+    logger.info("Loaded %d films from %s", len(films), path)
+    return films
@@ -1,21 +1,116 @@
+from array import array
+from bisect import bisect_left
+from collections.abc import Set
 from dataclasses import dataclass, field
 import os
-from typing import List, Optional
+from typing import Any, Dict, Iterable, Iterator, List, Optional
 
 from aiogram.types import FSInputFile
 
 from config.config import BASE_PATH
 
 
-@dataclass
+class GuessedFilms(Set):
+    """Compact set of ids of films guessed by a player.
+
+    Ids are kept sorted in an `array('I')`, 4 bytes per film instead of
+    a boxed int in a list or a set, membership is checked by binary search.
+    Players without guessed films share an empty tuple instead of an array.
+
+    """
+
+    __slots__ = ("_ids",)
+
+    def __init__(self, film_ids: Iterable[int] = ()) -> None:
+        ids = sorted(set(film_ids))
+        self._ids = array("I", ids) if ids else ()
+
+    def __contains__(self, film_id: object) -> bool:
+        ids = self._ids
+        i = bisect_left(ids, film_id)
+        return i < len(ids) and ids[i] == film_id
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._ids)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __repr__(self) -> str:
+        return f"GuessedFilms({list(self._ids)})"
+
+    def add(self, film_id: int) -> bool:
+        """Adds a film id.
+
+        Returns:
+            `False` if the film was already guessed.
+        """
+        i = bisect_left(self._ids, film_id)
+        if i < len(self._ids) and self._ids[i] == film_id:
+            return False
+
+        if not self._ids:
+            self._ids = array("I")
+        self._ids.insert(i, film_id)
+        return True
+
+    def clear(self) -> None:
+        self._ids = ()
+
+    def to_list(self) -> List[int]:
+        """Returns film ids as a list of ints, e.g. for storing in MongoDB."""
+        return list(self._ids)
+
+
+@dataclass(slots=True)
+class PlayerChanges:
+    """Changes of a player made since it was saved last time.
+
+    Properties:
+        player_id: Id of the changed player.
+        score_delta: Sum of score changes.
+        fields: New values of changed scalar fields (`current_film`, `attempts`).
+        guessed_added: Ids of newly guessed films.
+        guessed_reset: Indicates if guessed films were forgotten before
+                       `guessed_added` were guessed.
+
+    """
+
+    player_id: int
+    score_delta: int = 0
+    fields: Dict[str, Any] = field(default_factory=dict)
+    guessed_added: List[int] = field(default_factory=list)
+    guessed_reset: bool = False
+
+    def merge(self, newer: "PlayerChanges") -> None:
+        """Adds changes made after these ones."""
+        self.score_delta += newer.score_delta
+        self.fields.update(newer.fields)
+        if newer.guessed_reset:
+            self.guessed_reset = True
+            self.guessed_added = list(newer.guessed_added)
+        else:
+            self.guessed_added.extend(newer.guessed_added)
+
+    def copy(self) -> "PlayerChanges":
+        """Returns changes which are not affected by merges into these ones."""
+        return PlayerChanges(
+            self.player_id, self.score_delta, dict(self.fields), list(self.guessed_added), self.guessed_reset
+        )
+
+
+@dataclass(slots=True)
 class Player:
     """Class representing a player object.
 
+    Changes made by the methods of the player are tracked, so only they are
+    written to the database (see `pop_changes`).
+
     Properties:
         _id: Player's unique identifier.
         current_film: Id of current film in the game. If None player is not in the game.
         attempts: Number of attempts player have to guess current film.
-        guessed_films: List of films ids which player already guessed.
+        guessed_films: Ids of films which player already guessed.
         score: Total score of player.
         in_game: Indicates if player is in the game.
 
@@ -24,11 +119,74 @@ class Player:
     _id: int
     current_film: Optional[int] = None
     attempts: int = 0
-    guessed_films: List[int] = field(default_factory=list)
+    guessed_films: GuessedFilms = field(default_factory=GuessedFilms)
     score: int = 0
+    _changes: Optional[PlayerChanges] = field(default=None, init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        # Documents from MongoDB store guessed films as an array.
+        if not isinstance(self.guessed_films, GuessedFilms):
+            self.guessed_films = GuessedFilms(self.guessed_films)
+
+    @property
+    def changed(self) -> bool:
+        return self._changes is not None
+
+    def start_round(self, film_id: int, attempts: int) -> None:
+        self.current_film = film_id
+        self.attempts = attempts
+        self._track().fields.update(current_film=film_id, attempts=attempts)
+
+    def use_attempt(self) -> int:
+        self.attempts -= 1
+        self._track().fields["attempts"] = self.attempts
+        return self.attempts
+
+    def finish_round(self, score_delta: int, guessed: bool) -> None:
+        changes = self._track()
+        if guessed and self.current_film is not None and self.guessed_films.add(self.current_film):
+            changes.guessed_added.append(self.current_film)
+        self.current_film = None
+        self.score += score_delta
+        changes.fields["current_film"] = None
+        changes.score_delta += score_delta
 
+    def add_score(self, score_delta: int) -> None:
+        self.score += score_delta
+        self._track().score_delta += score_delta
 
-@dataclass
+    def cancel_round(self) -> None:
+        self.current_film = None
+        self._track().fields["current_film"] = None
+
+    def reset_guessed(self) -> None:
+        self.guessed_films.clear()
+        changes = self._track()
+        changes.guessed_reset = True
+        changes.guessed_added = []
+
+    def pop_changes(self) -> Optional[PlayerChanges]:
+        """Returns changes made since the last call, `None` if there are none."""
+        changes, self._changes = self._changes, None
+        return changes
+
+    def copy_changes(self) -> Optional[PlayerChanges]:
+        """Returns a copy of changes made since the last `pop_changes`, `None` if there are none."""
+        return self._changes.copy() if self._changes is not None else None
+
+    def restore_changes(self, changes: PlayerChanges) -> None:
+        """Returns changes which were popped but not saved."""
+        if self._changes is not None:
+            changes.merge(self._changes)
+        self._changes = changes
+
+    def _track(self) -> PlayerChanges:
+        if self._changes is None:
+            self._changes = PlayerChanges(self._id)
+        return self._changes
+
+
+@dataclass(slots=True)
 class Film:
     """Class representing a Film object.
 
@@ -39,6 +197,7 @@ class Film:
         genre: Genre of the film.
         description: Additional information about the film.
         image_path: Path to the film image.
+        aliases: Other names of the film accepted as correct answers.
 
     """
     _id: int
@@ -47,13 +206,20 @@ class Film:
     genre: str
     description: Optional[str] = None
     image_path: Optional[str] = None
+    aliases: List[str] = field(default_factory=list)
+
+    def get_image_path(self) -> Optional[str]:
+        """Returns the absolute path to the film image or `None` if file does not exist."""
+        if not self.image_path:
+            return None
+
+        path = os.path.join(BASE_PATH, self.image_path)
+        return path if os.path.isfile(path) else None
 
     def get_image_file(self) -> Optional[FSInputFile]:
         """Returns the film image file or `None` if file does not exist."""
-        if self.image_path:
-            path = os.path.join(BASE_PATH, self.image_path)
-
-        return FSInputFile(path) if os.path.isfile(path) else None
+        path = self.get_image_path()
+        return FSInputFile(path) if path else None
 
     def explain(self) -> str:
         """Returns explanation for film with name, date, genre and short description."""
@@ -0,0 +1,220 @@
+import json
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import DEFAULT_DESTINY, BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from redis.asyncio import Redis
+from redis.asyncio.client import Pipeline
+
+from game.redis_store import (
+    RedisPlayerStore,
+    preload_player,
+    reset_preloaded_player,
+    take_written_state,
+    track_written_state,
+)
+
+
+@dataclass(slots=True)
+class StateSession:
+    """The FSM state of the update being handled and its changes not written yet.
+
+    Properties:
+        key: Storage key of the update.
+        state: Current state.
+        data: Current data encoded as JSON, `None` if it's empty.
+        changes: New values of the hash fields, `None` deletes a field.
+
+    """
+
+    key: StorageKey
+    state: Optional[str]
+    data: Optional[str]
+    changes: Dict[str, Optional[str]] = field(default_factory=dict)
+
+
+_session: ContextVar[Optional[StateSession]] = ContextVar("fsm_session", default=None)
+
+
+class PlayerStateStorage(BaseStorage):
+    """Keeps the FSM state of a private chat in the hash of its player.
+
+    The state of a private chat is the state of the player's round, so it's
+    kept as `fsm_state` and `fsm_data` fields of the hash `RedisPlayerStore`
+    keeps the round in. `PlayerStateMiddleware` opens a `session` for every
+    update: one pipelined call loads the state together with the player and
+    changes made by handlers are written by one MULTI when the update is
+    handled. The store writes the state along with starting and finishing
+    a round (see `RedisPlayerStore.in_game_state`), so changes of handlers
+    repeating it are not written again. States of other chats are kept in
+    their own hashes.
+
+    Player hashes don't include the bot id, so bots sharing Redis need
+    different `RedisPlayerStore.key_prefix`. Changing the state of a
+    private chat, or loading it with the player, refreshes the TTL of the
+    player like the store does; a hash holding only the state keeps the
+    TTL of its last change.
+
+    Properties:
+        redis: Redis client.
+        preload_players: Whether players are kept by `RedisPlayerStore`, so
+                         sessions load them along with the state.
+        player_ttl: Number of seconds a player hash is kept after its last
+                    access, `None` keeps it forever.
+        key_builder: Builds keys of hashes of chats other than private ones.
+
+    """
+
+    redis: Redis
+    preload_players: bool
+    player_ttl: Optional[float]
+    key_builder: KeyBuilder
+
+    state_field: str = RedisPlayerStore.state_field
+    data_field: str = RedisPlayerStore.data_field
+
+    def __init__(
+        self,
+        redis: Redis,
+        preload_players: bool = False,
+        player_ttl: Optional[float] = None,
+        key_builder: Optional[KeyBuilder] = None,
+    ) -> None:
+        self.redis = redis
+        self.preload_players = preload_players
+        self.player_ttl = player_ttl
+        self.key_builder = key_builder or DefaultKeyBuilder()
+
+    @asynccontextmanager
+    async def session(self, key: StorageKey) -> AsyncIterator[Optional[str]]:
+        """Loads the state of an update and writes its changes when the update is handled.
+
+        Yields:
+            The current state.
+        """
+        player_id = self._player_id(key)
+        preload = self.preload_players and player_id is not None
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hgetall(self._key(key))
+            if preload:
+                pipe.smembers(RedisPlayerStore.guessed_key(player_id))
+                self._touch(pipe, player_id)
+            results = await pipe.execute()
+
+        fields = results[0]
+        session = StateSession(
+            key,
+            self._decode(fields.get(self.state_field.encode())),
+            self._decode(fields.get(self.data_field.encode())),
+        )
+        session_token = _session.set(session)
+        player_token = preload_player(player_id, fields, results[1]) if preload else None
+        written_token = track_written_state(player_id) if preload else None
+        try:
+            yield session.state
+        finally:
+            written = take_written_state(written_token) if written_token is not None else {}
+            if player_token is not None:
+                reset_preloaded_player(player_token)
+            _session.reset(session_token)
+            # Fields the store has written along with the round are in the hash already.
+            changes = {
+                name: value
+                for name, value in session.changes.items()
+                if name not in written or written[name] != value
+            }
+            if changes:
+                await self._write(key, changes)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        session = self._current_session(key)
+        if session is None:
+            await self._write(key, {self.state_field: value})
+            return
+
+        session.state = value
+        session.changes[self.state_field] = value
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        session = self._current_session(key)
+        if session is not None:
+            return session.state
+        return self._decode(await self.redis.hget(self._key(key), self.state_field))
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        value = json.dumps(data) if data else None
+        session = self._current_session(key)
+        if session is None:
+            await self._write(key, {self.data_field: value})
+            return
+
+        session.data = value
+        session.changes[self.data_field] = value
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        session = self._current_session(key)
+        if session is not None:
+            value = session.data
+        else:
+            value = self._decode(await self.redis.hget(self._key(key), self.data_field))
+        return json.loads(value) if value else {}
+
+    async def close(self) -> None:
+        # The Redis client is shared with the game, which still needs it when the dispatcher stops.
+        pass
+
+    async def _write(self, key: StorageKey, changes: Dict[str, Optional[str]]) -> None:
+        hash_key = self._key(key)
+        values = {name: value for name, value in changes.items() if value is not None}
+        removed = [name for name, value in changes.items() if value is None]
+
+        async with self.redis.pipeline(transaction=True) as pipe:
+            if values:
+                pipe.hset(hash_key, mapping=values)
+            if removed:
+                pipe.hdel(hash_key, *removed)
+            self._touch(pipe, self._player_id(key))
+            await pipe.execute()
+
+    def _touch(self, pipe: Pipeline, player_id: Optional[int]) -> None:
+        """Refreshes the TTL of the player's hash and guessed films."""
+        if player_id is None or self.player_ttl is None:
+            return
+
+        ttl = int(self.player_ttl * 1000)
+        pipe.pexpire(RedisPlayerStore.key(player_id), ttl)
+        pipe.pexpire(RedisPlayerStore.guessed_key(player_id), ttl)
+
+    def _key(self, key: StorageKey) -> str:
+        player_id = self._player_id(key)
+        if player_id is not None:
+            return RedisPlayerStore.key(player_id)
+        return self.key_builder.build(key)
+
+    @staticmethod
+    def _player_id(key: StorageKey) -> Optional[int]:
+        """Returns the id of the player if the key is of a private chat."""
+        if (
+            key.chat_id != key.user_id
+            or key.thread_id is not None
+            or key.business_connection_id is not None
+            or key.destiny != DEFAULT_DESTINY
+        ):
+            return None
+        return key.user_id
+
+    @staticmethod
+    def _current_session(key: StorageKey) -> Optional[StateSession]:
+        session = _session.get()
+        if session is None or session.key != key:
+            return None
+        return session
+
+    @staticmethod
+    def _decode(value: Optional[bytes]) -> Optional[str]:
+        return value.decode() if isinstance(value, bytes) else value
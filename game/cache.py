@@ -0,0 +1,169 @@
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from database.models import Player
+
+
+class PlayerCache:
+    """Bounded LRU cache of players with TTL expiration and dirty tracking.
+
+    Players changed since the last flush are marked dirty. Dirty players are
+    never dropped silently: on eviction they are moved to a pending area and
+    stay there (and are still returned by `get`) until they are flushed.
+
+    Properties:
+        max_size: Maximal number of cached players.
+        ttl: Number of seconds a player stays in the cache since last access.
+        dirty_listener: Optional callable invoked with the number of dirty
+                        players each time a player is marked dirty.
+
+    """
+
+    max_size: int
+    ttl: float
+    dirty_listener: Optional[Callable[[int], None]]
+
+    def __init__(self, max_size: int, ttl: float, clock: Callable[[], float] = time.monotonic) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.dirty_listener = None
+        self._clock = clock
+        # player id -> (player, expiration time), ordered from least to most recently used.
+        self._entries: "OrderedDict[int, Tuple[Player, float]]" = OrderedDict()
+        self._dirty: Set[int] = set()
+        self._evicted: Dict[int, Player] = {}
+        # Evicted players which are being written to the database right now.
+        self._flushing: Dict[int, Player] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, player_id: int) -> bool:
+        return player_id in self._entries or player_id in self._evicted or player_id in self._flushing
+
+    @property
+    def dirty_count(self) -> int:
+        """Number of players waiting for a flush."""
+        return len(self._dirty) + len(self._evicted)
+
+    def values(self) -> List[Player]:
+        """Returns all players held by the cache including evicted dirty ones."""
+        return [player for player, _ in self._entries.values()] + list(self._evicted.values())
+
+    def get(self, player_id: int) -> Optional[Player]:
+        """Returns a cached player and marks it as recently used.
+
+        Args:
+            player_id: Player's unique identifier.
+
+        Returns:
+            The cached player or `None` if the player is not cached.
+        """
+        entry = self._entries.get(player_id)
+        now = self._clock()
+
+        if entry and entry[1] <= now:
+            self._evict(player_id)
+            entry = None
+
+        if entry:
+            self._entries[player_id] = (entry[0], now + self.ttl)
+            self._entries.move_to_end(player_id)
+            self.hits += 1
+            return entry[0]
+
+        if player := self._evicted.pop(player_id, None):
+            # Not flushed yet, so the database copy is stale.
+            self.put(player, dirty=True)
+            self.hits += 1
+            return player
+
+        if player := self._flushing.get(player_id):
+            # The flush in progress saves the player, a failed one restores the flag.
+            self.put(player)
+            self.hits += 1
+            return player
+
+        self.misses += 1
+        return None
+
+    def put(self, player: Player, dirty: bool = False) -> None:
+        """Adds a player to the cache evicting least recently used players.
+
+        Args:
+            player: A player to cache.
+            dirty: Whether the player has changes not saved to the database.
+        """
+        self._entries[player._id] = (player, self._clock() + self.ttl)
+        self._entries.move_to_end(player._id)
+
+        if dirty:
+            self._dirty.add(player._id)
+
+        while len(self._entries) > self.max_size:
+            self._evict(next(iter(self._entries)))
+
+        if dirty and self.dirty_listener:
+            self.dirty_listener(self.dirty_count)
+
+    def mark_dirty(self, player: Player) -> None:
+        """Marks a player as changed and refreshes it in the cache."""
+        self.put(player, dirty=True)
+
+    def evict_expired(self) -> int:
+        """Evicts all players whose TTL is over.
+
+        Returns:
+            Number of evicted players.
+        """
+        now = self._clock()
+        evicted = 0
+
+        # Entries are ordered by last access, so expired ones are at the start.
+        while self._entries:
+            player_id, (_, expires_at) = next(iter(self._entries.items()))
+            if expires_at > now:
+                break
+            self._evict(player_id)
+            evicted += 1
+
+        return evicted
+
+    def dirty_players(self) -> List[Player]:
+        """Returns players waiting for a flush without resetting their dirty flags."""
+        return [self._entries[player_id][0] for player_id in self._dirty] + list(self._evicted.values())
+
+    def take_dirty(self) -> List[Player]:
+        """Returns players waiting for a flush and resets their dirty flags."""
+        players = [self._entries[player_id][0] for player_id in self._dirty]
+        players.extend(self._evicted.values())
+
+        self._flushing.update(self._evicted)
+        self._dirty = set()
+        self._evicted = {}
+        return players
+
+    def complete_flush(self, players: Iterable[Player]) -> None:
+        """Forgets evicted players after they are saved to the database."""
+        for player in players:
+            self._flushing.pop(player._id, None)
+
+    def restore_dirty(self, players: Iterable[Player]) -> None:
+        """Marks players as dirty again after an unsuccessful flush."""
+        for player in players:
+            self._flushing.pop(player._id, None)
+
+            if player._id in self._entries:
+                self._dirty.add(player._id)
+            else:
+                self._evicted[player._id] = player
+
+    def _evict(self, player_id: int) -> None:
+        player, _ = self._entries.pop(player_id)
+
+        if player_id in self._dirty:
+            self._dirty.discard(player_id)
+            self._evicted[player_id] = player
@@ -0,0 +1,44 @@
+from typing import Dict, Iterable, Optional
+
+from config.config import NUMBER_OF_ATTEMPTS
+from database.models import Film
+from game.matching import AnswerMatcher
+from game.picker import FilmPicker
+from game.texts import FilmTextsIndex
+
+
+class Catalogue:
+    """Films of the game with indexes built over them.
+
+    A catalogue is never changed after it is built, so the game can replace
+    it with a new one by a single assignment while rounds are in progress.
+
+    Properties:
+        films: A dictionary mapping from film id to `Film` instance.
+        picker: A `FilmPicker` for choosing not guessed films.
+        matcher: An `AnswerMatcher` for validating answers.
+        texts: A `FilmTextsIndex` with explanations and hints of films.
+
+    """
+
+    films: Dict[int, Film]
+    picker: FilmPicker
+    matcher: AnswerMatcher
+    texts: FilmTextsIndex
+
+    def __init__(self, films: Iterable[Film], attempts: int = NUMBER_OF_ATTEMPTS) -> None:
+        self.films = {film._id: film for film in films}
+
+        if not self.films:
+            raise ValueError("Can't start game without films.")
+
+        self.picker = FilmPicker(self.films.values())
+        self.matcher = AnswerMatcher(self.films.values())
+        self.texts = FilmTextsIndex(self.films.values(), attempts)
+
+    def __len__(self) -> int:
+        return len(self.films)
+
+    def get(self, film_id: Optional[int]) -> Optional[Film]:
+        """Returns a film by id or `None` if the catalogue has no such film."""
+        return self.films.get(film_id)
@@ -0,0 +1,147 @@
+import json
+import logging
+import os
+from typing import Dict, Iterable, List, Optional
+
+from database.models import PlayerChanges
+
+logger = logging.getLogger(__name__)
+
+
+class PlayersCheckpoint:
+    """Append-only local file with changes of players not saved to the database yet.
+
+    Every line is a JSON record with all changes of a player not known to
+    be saved or a marker that the player was saved. The last record of
+    each player wins, players whose last record is a marker are skipped.
+    The file survives a killed process and lets a restarted one save the
+    lost changes before it serves updates. Changes are saved like a flush
+    does, so score increments made by others meanwhile, e.g. by group
+    rounds, are kept; a change saved right before the process was killed,
+    before its marker was written, is saved again.
+
+    The file is written from a worker thread, calls must not overlap.
+
+    Properties:
+        path: Path to the checkpoint file.
+        fsync: Whether every write is synced to the disk, which also
+               protects from a crash of the host, not only of the process.
+
+    """
+
+    path: str
+    fsync: bool
+
+    def __init__(self, path: str, fsync: bool = False) -> None:
+        self.path = path
+        self.fsync = fsync
+        self.records = 0
+        self._file = None
+
+    def write(self, changes: Iterable[PlayerChanges]) -> int:
+        """Appends unsaved changes of players.
+
+        Returns:
+            Number of written records.
+        """
+        return self._append(self._dump(player_changes) for player_changes in changes)
+
+    def mark_saved(self, player_ids: Iterable[int], changes: Iterable[PlayerChanges] = ()) -> int:
+        """Appends markers of saved players, then changes some of them got since they were saved."""
+        lines = [json.dumps({"_id": player_id, "saved": True}) for player_id in player_ids]
+        lines.extend(self._dump(player_changes) for player_changes in changes)
+        return self._append(lines)
+
+    def load(self) -> List[PlayerChanges]:
+        """Returns changes of players whose last record in the file is not a marker."""
+        if not os.path.exists(self.path):
+            return []
+
+        records: Dict[int, Optional[Dict]] = {}
+        with open(self.path, encoding="utf-8") as file:
+            for number, line in enumerate(file, 1):
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # The last line may be cut when the process is killed while writing it.
+                    logger.warning("Skipping a broken line %d of %s", number, self.path)
+                    continue
+                records[record["_id"]] = None if record.get("saved") else record
+
+        return [self._load(record) for record in records.values() if record is not None]
+
+    def rewrite(self, changes: Iterable[PlayerChanges]) -> None:
+        """Atomically replaces the file with the given changes only.
+
+        Must be called when all other changes are saved to the database.
+        """
+        self.close()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        temporary_path = f"{self.path}.tmp"
+        records = 0
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            for player_changes in changes:
+                file.write(self._dump(player_changes) + "\n")
+                records += 1
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, self.path)
+        self.records = records
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _append(self, lines: Iterable[str]) -> int:
+        if self._file is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(self.path, "a", encoding="utf-8")
+
+        written = 0
+        for line in lines:
+            self._file.write(line + "\n")
+            written += 1
+
+        if written:
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self.records += written
+        return written
+
+    @staticmethod
+    def _dump(changes: PlayerChanges) -> str:
+        return json.dumps(
+            {
+                "_id": changes.player_id,
+                "score_delta": changes.score_delta,
+                "fields": changes.fields,
+                "guessed_added": changes.guessed_added,
+                "guessed_reset": changes.guessed_reset,
+            }
+        )
+
+    @staticmethod
+    def _load(record: Dict) -> PlayerChanges:
+        if "score" in record:
+            # Files written by older versions hold the whole state of players, which replaces the saved one.
+            return PlayerChanges(
+                record["_id"],
+                fields={"current_film": record["current_film"], "attempts": record["attempts"], "score": record["score"]},
+                guessed_added=record["guessed_films"],
+                guessed_reset=True,
+            )
+
+        return PlayerChanges(
+            record["_id"],
+            record["score_delta"],
+            record["fields"],
+            record["guessed_added"],
+            record["guessed_reset"],
+        )
@@ -0,0 +1,275 @@
+import asyncio
+import logging
+import math
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+from redis.asyncio import Redis
+
+from database.models import Film
+from game.picker import AliasTable, FilmPicker
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class FilmStats:
+    """Results of the rounds of a film.
+
+    Properties:
+        wins: Number of rounds in which the film was guessed.
+        surrenders: Number of rounds lost or given up.
+        attempts_used: Number of attempts used in all rounds.
+
+    """
+
+    wins: int = 0
+    surrenders: int = 0
+    attempts_used: int = 0
+
+    @property
+    def rounds(self) -> int:
+        return self.wins + self.surrenders
+
+    def add(self, other: "FilmStats") -> None:
+        self.wins += other.wins
+        self.surrenders += other.surrenders
+        self.attempts_used += other.attempts_used
+
+
+@dataclass(slots=True)
+class DifficultyTables:
+    """Alias tables sampling the films of a picker by skill levels of players.
+
+    Properties:
+        films: The list of films of the picker the tables were built for.
+        levels: A table for every skill level, from the weakest players.
+
+    """
+
+    films: List[Film]
+    levels: List[AliasTable]
+
+    def table(self, skill: float) -> AliasTable:
+        """Returns the table of a skill between 0 and 1."""
+        return self.levels[min(len(self.levels) - 1, max(0, int(skill * len(self.levels))))]
+
+
+def build_tables(
+    films: List[Film],
+    stats: Dict[int, FilmStats],
+    levels: int,
+    spread: float = 0.15,
+    floor: float = 0.05,
+    prior_rounds: float = 5.0,
+) -> Optional[DifficultyTables]:
+    """Builds alias tables serving films of the difficulty matching every skill level.
+
+    The difficulty of a film is the percentile of its smoothed solve rate
+    among the films, the average number of attempts used breaks ties.
+    Films with few rounds are pulled towards the average of all films by
+    `prior_rounds` virtual rounds. A level serves films around its
+    difficulty with a Gaussian of width `spread`; every film keeps at
+    least `floor` of the weight, so new films still get played.
+
+    Returns:
+        The tables or `None` if no round has finished yet.
+    """
+    total = FilmStats()
+    for film_stats in stats.values():
+        total.add(film_stats)
+    if not total.rounds:
+        return None
+
+    mean_rate = total.wins / total.rounds
+    mean_attempts = total.attempts_used / total.rounds
+    empty = FilmStats()
+
+    ease = []
+    for film in films:
+        film_stats = stats.get(film._id, empty)
+        rounds = film_stats.rounds + prior_rounds
+        ease.append((
+            (film_stats.wins + prior_rounds * mean_rate) / rounds,
+            -(film_stats.attempts_used + prior_rounds * mean_attempts) / rounds,
+        ))
+
+    # From the easiest films; films with equal statistics get the same difficulty.
+    order = sorted(range(len(films)), key=ease.__getitem__, reverse=True)
+    difficulty = [0.0] * len(films)
+    last = max(1, len(films) - 1)
+    start = 0
+    while start < len(order):
+        end = start + 1
+        while end < len(order) and ease[order[end]] == ease[order[start]]:
+            end += 1
+        for index in order[start:end]:
+            difficulty[index] = (start + end - 1) / 2 / last
+        start = end
+
+    tables = []
+    for level in range(levels):
+        center = (level + 0.5) / levels
+        tables.append(AliasTable([floor + math.exp(-0.5 * ((value - center) / spread) ** 2) for value in difficulty]))
+    return DifficultyTables(films, tables)
+
+
+class FilmStatistics:
+    """Solve statistics of films and sampling of films matching the skill of players.
+
+    The game records the result of every round in memory; every
+    `flush_interval` seconds the results are added to Redis hashes shared
+    by all workers with one pipelined call. Every `rebuild_interval`
+    seconds the statistics are loaded and `DifficultyTables` of the current
+    catalogue are built in a thread, so picking a film for a player stays
+    O(1) however big the catalogue is. Until the first tables are built
+    and right after the catalogue is replaced films are picked uniformly.
+
+    Properties:
+        redis: Redis client.
+        picker: A function returning the picker of the current catalogue.
+        flush_interval: Number of seconds between flushes to Redis.
+        rebuild_interval: Number of seconds between rebuilds of the tables,
+                          0 disables the tables.
+        levels: Number of skill levels of players.
+
+    """
+
+    redis: Redis
+    picker: Callable[[], FilmPicker]
+    flush_interval: float
+    rebuild_interval: float
+    levels: int
+
+    key_prefix: str = "film_stats"
+
+    def __init__(
+        self,
+        redis: Redis,
+        picker: Callable[[], FilmPicker],
+        flush_interval: float,
+        rebuild_interval: float,
+        levels: int = 5,
+    ) -> None:
+        self.redis = redis
+        self.picker = picker
+        self.flush_interval = flush_interval
+        self.rebuild_interval = rebuild_interval
+        self.levels = levels
+        self._pending: Dict[int, FilmStats] = defaultdict(FilmStats)
+        self._tables: Optional[DifficultyTables] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def record(self, film_id: int, won: bool, attempts_used: int) -> None:
+        """Adds the result of a finished round."""
+        film_stats = self._pending[film_id]
+        if won:
+            film_stats.wins += 1
+        else:
+            film_stats.surrenders += 1
+        film_stats.attempts_used += attempts_used
+
+    def table(self, picker: FilmPicker, skill: float) -> Optional[AliasTable]:
+        """Returns the table for drawing films of the picker for a skill between 0 and 1.
+
+        Returns:
+            The table or `None` if there are no tables for the picker yet.
+        """
+        tables = self._tables
+        if tables is None or tables.films is not picker.films:
+            return None
+        return tables.table(skill)
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        # Players are saved after the statistics, which aren't worth losing them.
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Failed to flush film statistics")
+
+    async def flush(self) -> int:
+        """Adds the recorded results to the shared statistics.
+
+        Returns:
+            Number of films whose statistics were flushed.
+        """
+        pending, self._pending = self._pending, defaultdict(FilmStats)
+        if not pending:
+            return 0
+
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for film_id, film_stats in pending.items():
+                    pipe.hincrby(self._key("wins"), film_id, film_stats.wins)
+                    pipe.hincrby(self._key("surrenders"), film_id, film_stats.surrenders)
+                    pipe.hincrby(self._key("attempts_used"), film_id, film_stats.attempts_used)
+                await pipe.execute()
+        except BaseException:
+            # Results recorded meanwhile are kept along with the failed ones.
+            for film_id, film_stats in pending.items():
+                self._pending[film_id].add(film_stats)
+            raise
+
+        return len(pending)
+
+    async def load(self) -> Dict[int, FilmStats]:
+        """Returns the shared statistics of all films by film id."""
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hgetall(self._key("wins"))
+            pipe.hgetall(self._key("surrenders"))
+            pipe.hgetall(self._key("attempts_used"))
+            wins, surrenders, attempts_used = await pipe.execute()
+
+        stats: Dict[int, FilmStats] = defaultdict(FilmStats)
+        for film_id, value in wins.items():
+            stats[int(film_id)].wins = int(value)
+        for film_id, value in surrenders.items():
+            stats[int(film_id)].surrenders = int(value)
+        for film_id, value in attempts_used.items():
+            stats[int(film_id)].attempts_used = int(value)
+        return stats
+
+    async def rebuild(self) -> None:
+        """Builds the tables of the current catalogue from the shared statistics."""
+        picker = self.picker()
+        stats = await self.load()
+        tables = await asyncio.to_thread(build_tables, picker.films, stats, self.levels)
+        if tables is not None:
+            self._tables = tables
+
+    async def safe_rebuild(self) -> None:
+        """Rebuilds the tables, failures are logged and the old tables are kept."""
+        try:
+            await self.rebuild()
+        except Exception:
+            logger.exception("Failed to rebuild film difficulty tables")
+
+    async def _run(self) -> None:
+        rebuilt_at = None
+        while True:
+            if self.rebuild_interval > 0 and (rebuilt_at is None or time.monotonic() - rebuilt_at >= self.rebuild_interval):
+                rebuilt_at = time.monotonic()
+                await self.safe_rebuild()
+
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush film statistics, retrying in %s seconds", self.flush_interval)
+
+    def _key(self, counter: str) -> str:
+        return f"{self.key_prefix}:{counter}"
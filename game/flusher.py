@@ -0,0 +1,277 @@
+import asyncio
+import logging
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from database.dao import PlayerDao, PlayersNotSaved
+from database.models import Player, PlayerChanges
+from game.cache import PlayerCache
+from game.checkpoint import PlayersCheckpoint
+from services.metrics import PLAYERS_FLUSHED, PLAYERS_FLUSH_LATENCY
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindFlusher:
+    """Background task which writes dirty cached players to the database.
+
+    Changes of dirty players are saved with `PlayerDao.save_changes` every
+    `interval` seconds or as soon as the number of dirty players reaches
+    `threshold`. Big flushes are split into chunks written by several
+    concurrent bulk writes.
+
+    With a checkpoint, unsaved changes of players are appended to it every
+    `checkpoint_interval` seconds and before every flush, so they can be
+    saved after the process is killed. The checkpoint file is written in
+    a worker thread. The final flush on stop has a deadline; changes not
+    saved by then are left in the checkpoint.
+
+    Properties:
+        cache: The players cache to flush.
+        players_dao: An instance of `PlayerDao` for saving players.
+        interval: Maximal number of seconds between flushes.
+        threshold: Number of dirty players which triggers an early flush.
+        checkpoint: Optional local checkpoint of dirty players.
+        checkpoint_interval: Number of seconds between checkpoints.
+        chunk_size: Maximal number of players saved by one bulk write.
+        concurrency: Maximal number of bulk writes running at once.
+
+    """
+
+    cache: PlayerCache
+    players_dao: PlayerDao
+    interval: float
+    threshold: int
+    checkpoint: Optional[PlayersCheckpoint]
+    checkpoint_interval: float
+    chunk_size: int
+    concurrency: int
+
+    # The checkpoint is compacted when it has more records than this.
+    compact_threshold: int = 100_000
+
+    def __init__(
+        self,
+        cache: PlayerCache,
+        players_dao: PlayerDao,
+        interval: float,
+        threshold: int,
+        checkpoint: Optional[PlayersCheckpoint] = None,
+        checkpoint_interval: float = 1.0,
+        chunk_size: int = 1000,
+        concurrency: int = 4,
+    ) -> None:
+        self.cache = cache
+        self.players_dao = players_dao
+        self.interval = interval
+        self.threshold = threshold
+        self.checkpoint = checkpoint
+        self.checkpoint_interval = checkpoint_interval
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        # Keeps the order of checkpoint writes running in threads.
+        self._checkpoint_lock = asyncio.Lock()
+        # Changes being saved by a flush: player id -> changes.
+        self._in_flight: Dict[int, PlayerChanges] = {}
+        self._tasks: List[asyncio.Task] = []
+
+        cache.dirty_listener = self._on_dirty
+
+    async def replay(self) -> int:
+        """Saves changes of players left in the checkpoint by a previous run.
+
+        Returns:
+            Number of saved players.
+        """
+        if self.checkpoint is None:
+            return 0
+
+        changes = await asyncio.to_thread(self.checkpoint.load)
+        for start in range(0, len(changes), self.chunk_size):
+            # The checkpoint is deleted right after, so the changes must survive a failover.
+            await self.players_dao.save_changes(changes[start:start + self.chunk_size], durable=True)
+        await asyncio.to_thread(self.checkpoint.rewrite, ())
+
+        if changes:
+            logger.info("Saved %d players from the checkpoint", len(changes))
+        return len(changes)
+
+    def start(self) -> None:
+        """Starts the background flushing and checkpointing tasks."""
+        if self._tasks:
+            return
+
+        self._tasks.append(asyncio.create_task(self._run()))
+        if self.checkpoint is not None:
+            self._tasks.append(asyncio.create_task(self._run_checkpoints()))
+
+    async def stop(self, timeout: Optional[float] = None) -> None:
+        """Stops the background tasks and flushes all dirty players.
+
+        Args:
+            timeout: Number of seconds the final flush may take; players not
+                     saved by then are kept in the checkpoint.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        try:
+            await asyncio.wait_for(self.flush(durable=True), timeout)
+        except asyncio.TimeoutError:
+            if self.checkpoint is None:
+                raise
+            logger.error("Players were not saved in %s seconds, %d are left in the checkpoint", timeout, self.cache.dirty_count)
+        except Exception:
+            if self.checkpoint is None:
+                raise
+            logger.exception("Failed to save players, %d are left in the checkpoint", self.cache.dirty_count)
+        finally:
+            if self.checkpoint is not None:
+                # Players not saved by the flush are dirty again.
+                await self._write_checkpoint(self.checkpoint.rewrite, self._unsaved(self.cache.dirty_players()))
+                self.checkpoint.close()
+
+    async def flush(self, durable: bool = False) -> int:
+        """Saves all dirty players to the database.
+
+        Args:
+            durable: Whether to wait for the durable write concern.
+
+        Returns:
+            Number of saved players.
+
+        Raises:
+            PyMongoError: if the players can't be saved; not saved changes
+                          are kept for the next flush.
+        """
+        async with self._lock:
+            players = self.cache.take_dirty()
+            if not players:
+                return 0
+
+            pending = [(player, changes) for player in players if (changes := player.pop_changes()) is not None]
+            if len(pending) < len(players):
+                pending_ids = {player._id for player, _ in pending}
+                self.cache.complete_flush(player for player in players if player._id not in pending_ids)
+            self._in_flight.update((player._id, changes) for player, changes in pending)
+            if self.checkpoint is not None:
+                try:
+                    # The saved changes are in the checkpoint if the process dies before they are marked saved.
+                    await self._write_checkpoint(self.checkpoint.write, self._unsaved(player for player, _ in pending))
+                except BaseException:
+                    self._restore(pending)
+                    raise
+
+            chunks = [pending[start:start + self.chunk_size] for start in range(0, len(pending), self.chunk_size)]
+            semaphore = asyncio.Semaphore(self.concurrency)
+            with PLAYERS_FLUSH_LATENCY.labels("memory").time():
+                results = await asyncio.gather(
+                    *(self._save_chunk(chunk, semaphore, durable) for chunk in chunks),
+                    return_exceptions=True,
+                )
+
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+            return len(pending)
+
+    async def _save_chunk(
+        self,
+        chunk: List[Tuple[Player, PlayerChanges]],
+        semaphore: asyncio.Semaphore,
+        durable: bool,
+    ) -> None:
+        async with semaphore:
+            try:
+                await self.players_dao.save_changes([changes for _, changes in chunk], durable)
+            except PlayersNotSaved as e:
+                not_saved = {changes.player_id for changes in e.changes}
+                self._restore([(player, changes) for player, changes in chunk if player._id in not_saved])
+                await self._complete([player for player, _ in chunk if player._id not in not_saved])
+                raise
+            except BaseException:
+                self._restore(chunk)
+                raise
+
+        await self._complete([player for player, _ in chunk])
+
+    async def _complete(self, players: List[Player]) -> None:
+        for player in players:
+            self._in_flight.pop(player._id, None)
+        self.cache.complete_flush(players)
+        if self.checkpoint is not None:
+            # Changes made during the save replace the marker of a player.
+            newer = [changes for player in players if (changes := player.copy_changes()) is not None]
+            await self._write_checkpoint(self.checkpoint.mark_saved, [player._id for player in players], newer)
+        PLAYERS_FLUSHED.labels("memory").inc(len(players))
+
+    def _restore(self, pending: List[Tuple[Player, PlayerChanges]]) -> None:
+        for player, changes in pending:
+            self._in_flight.pop(player._id, None)
+            player.restore_changes(changes)
+        self.cache.restore_dirty(player for player, _ in pending)
+
+    def _unsaved(self, players: Iterable[Player]) -> List[PlayerChanges]:
+        """Returns copies of all unsaved changes of the players, including the ones being saved."""
+        unsaved = []
+        for player in players:
+            in_flight = self._in_flight.get(player._id)
+            changes = in_flight.copy() if in_flight is not None else None
+            newer = player.copy_changes()
+            if changes is None:
+                changes = newer
+            elif newer is not None:
+                changes.merge(newer)
+            if changes is not None:
+                unsaved.append(changes)
+        return unsaved
+
+    async def _write_checkpoint(self, method: Callable[..., Any], *args: Any) -> None:
+        # Changes are copied on the event loop, the thread only writes them.
+        async with self._checkpoint_lock:
+            write = asyncio.ensure_future(asyncio.to_thread(method, *args))
+            try:
+                await asyncio.shield(write)
+            except asyncio.CancelledError:
+                # The thread can't be stopped, the next write must not overlap with it.
+                await asyncio.gather(write, return_exceptions=True)
+                raise
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            self.cache.evict_expired()
+            try:
+                flushed = await self.flush()
+            except Exception:
+                logger.exception("Failed to flush players, retrying in %s seconds", self.interval)
+                await asyncio.sleep(self.interval)
+                continue
+
+            if flushed:
+                logger.debug("Flushed %d players", flushed)
+
+    async def _run_checkpoints(self) -> None:
+        while True:
+            await asyncio.sleep(self.checkpoint_interval)
+            try:
+                unsaved = self._unsaved(self.cache.dirty_players())
+                if self.checkpoint.records > self.compact_threshold and not self._lock.locked():
+                    # Without a flush in progress all players except dirty ones are saved.
+                    await self._write_checkpoint(self.checkpoint.rewrite, unsaved)
+                else:
+                    await self._write_checkpoint(self.checkpoint.write, unsaved)
+            except OSError:
+                logger.exception("Failed to write the players checkpoint")
+
+    def _on_dirty(self, dirty_count: int) -> None:
+        if dirty_count >= self.threshold:
+            self._wakeup.set()
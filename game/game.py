@@ -1,42 +1,109 @@
-from random import shuffle
-from typing import Dict, Optional, Tuple
+import asyncio
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
 
 from config.config import NUMBER_OF_ATTEMPTS
-from database.dao import FilmDao, ObjectDoesNotExist, PlayerDao
+from database.dao import FilmDao
 from database.models import Film, Player
+from game.catalogue import Catalogue
+from game.film_stats import FilmStatistics
+from game.leaderboard import Leaderboard
+from game.store import PlayerStore
+from services.metrics import PICKER_LATENCY
+
+if TYPE_CHECKING:
+    from pymongo.asynchronous.database import AsyncDatabase
+
+
+class RoundNotFound(Exception):
+    """Raises when a player has no active round to play or its film was removed."""
+
+    pass
 
 
 class GuessFilm:
     """Implementation of a guess film game.
 
     Properties:
-        films: A dictionary mapping from film id to `Film` instance.
-        players_dao: An instance of `PlayerDao` for accessing the player data
-                     in the database.
-        players: A dictionary mapping from player id to `Player` instance;
-                 stores cached players.
+        catalogue: The `Catalogue` of films; it can be replaced at any time
+                   with `replace_catalogue`.
+        players: A `PlayerStore` which keeps players state.
+        leaderboard: A `Leaderboard` updated after every change of a score.
+        stats: `FilmStatistics` recording results of rounds; with it films
+               are picked to match the skill of players.
 
     """
 
-    films: Dict[int, Film]
-    players: Dict[int, Player]
-    players_dao: PlayerDao
+    catalogue: Catalogue
+    players: PlayerStore
+    leaderboard: Optional[Leaderboard]
+    stats: Optional[FilmStatistics]
+
+    # A win gives `win_score` plus `attempt_score` for every attempt left.
+    win_score: int = 5
+    attempt_score: int = 2
+    surrender_score: int = -5
+
+    def __init__(
+        self,
+        catalogue: Catalogue,
+        players: PlayerStore,
+        leaderboard: Optional[Leaderboard] = None,
+        stats: Optional[FilmStatistics] = None,
+    ):
+        self.catalogue = catalogue
+        self.players = players
+        self.leaderboard = leaderboard
+        self.stats = stats
+
+    @property
+    def films(self) -> Dict[int, Film]:
+        """A dictionary mapping from film id to `Film` instance."""
+        return self.catalogue.films
+
+    def replace_catalogue(self, catalogue: Catalogue) -> None:
+        """Atomically replaces the catalogue of films.
+
+        Rounds in progress keep working if their film is in the new
+        catalogue, otherwise they are cancelled on the next player's action.
 
-    def __init__(self, database):
-        films_dao = FilmDao(database)
-        self.films = {film._id: film for film in films_dao.all()}
+        Args:
+            catalogue: A new catalogue.
+        """
+        self.catalogue = catalogue
+
+    @classmethod
+    async def from_database(
+        cls,
+        database: "AsyncDatabase",
+        players: PlayerStore,
+        leaderboard: Optional[Leaderboard] = None,
+        stats: Optional[FilmStatistics] = None,
+    ) -> "GuessFilm":
+        """Loads films from the database and creates a game.
 
-        if not self.films:
-            raise ValueError("Can't start game without films.")
+        Args:
+            database: The async Database object.
+            players: A storage of players state.
+            leaderboard: A ranking of players by score.
+            stats: Statistics of films.
 
-        self.players_dao = PlayerDao(database)
-        self.players = {}
+        Returns:
+            A new game instance.
+        """
+        catalogue = await cls.load_catalogue(FilmDao(database))
+        return cls(catalogue, players, leaderboard, stats)
 
-    def get_player(self, player_id: int) -> Player:
-        """Gets a player by id from the cache if exists othervise from DB.
+    @staticmethod
+    async def load_catalogue(films_dao: FilmDao) -> Catalogue:
+        """Loads films and builds a catalogue of them without blocking the event loop."""
+        films = await films_dao.all()
+        # Building indexes takes a while on big catalogues.
+        return await asyncio.to_thread(Catalogue, films)
 
-        Retrives a player for the cache if it exists othervise from
-        the database and saves the player to the cache.
+    async def get_player(self, player_id: int) -> Player:
+        """Gets a player by id from the players storage.
+
+        A new player is created if the player doesn't exist yet.
 
         Args:
             player_id: Player's unique identifier to retrieve.
@@ -44,21 +111,14 @@ class GuessFilm:
         Returns:
             The player instance with given id.
         """
-        if player := self.players.get(player_id):
-            return player
-
-        try:
-            player = self.players_dao.get(player_id)
-        except ObjectDoesNotExist:
-            player, _ = self.players_dao.create(Player(_id=player_id))
+        return await self.players.get(player_id)
 
-        self.players[player._id] = player
-        return player
-
-    def _get_film_for_player(self, player: Player) -> Film:
+    async def _get_film_for_player(self, player: Player) -> Film:
         """Returns a not guessed film for a specifiec player.
 
         If all films guessed resets player's guessed films and starts over.
+        With statistics of films, films matching the player's skill are
+        more likely.
 
         Args:
             player: A player instance for picking next film.
@@ -66,48 +126,46 @@ class GuessFilm:
         Returns:
             A next film for guessing.
         """
-        films = list(self.films.values())
-        shuffle(films)
-        
-        for film in films:
-            if film._id not in player.guessed_films:
-                return film
-
-        player.guessed_films = []
-        return self._get_film_for_player(player)
-
-    def _get_hint(self, film: Film, attempts_left: int) -> str:
-        """Returns a hint for guessing film depending on number of attempts.
-
-        If there are more then enough attempts it doesn't return a hint.
-
-        Args:
-            film: A Film instance to take info for hint.
-
-        Returns:
-            String that contains hint.
+        picker = self.catalogue.picker
+        with PICKER_LATENCY.time():
+            table = self.stats.table(picker, self._estimate_skill(player)) if self.stats is not None else None
+            film = picker.pick(player.guessed_films, table)
+        if film:
+            return film
+
+        await self.players.reset_guessed(player)
+        with PICKER_LATENCY.time():
+            return picker.pick(player.guessed_films, table)
+
+    def _estimate_skill(self, player: Player) -> float:
+        """Estimates the share of rounds the player wins, 0.5 for new players.
+
+        Players keep only the score and guessed films, so the number of lost
+        rounds is derived from the score, counting every win as the average
+        win score.
         """
-        ratio = attempts_left / NUMBER_OF_ATTEMPTS
-        if ratio < 0.7:
-            return f'Неверно. Подсказка: жанр фильма - {film.genre}'
-        elif ratio < 0.4:
-            return f'Ты не угадал. Подсказка: год выхода фильма - {film.year}'
-        else:
-            return f'Неверно.'
+        wins = len(player.guessed_films)
+        average_win_score = self.win_score + self.attempt_score * (NUMBER_OF_ATTEMPTS - 1) / 2
+        losses = max(0.0, (wins * average_win_score - player.score) / -self.surrender_score)
+        return (wins + 1) / (wins + losses + 2)
 
-    def _validate_answer(self, answer: str, film: Film):
+    def _validate_answer(self, answer: str, film: Film, catalogue: Catalogue):
         """Validates player's answer by comparison with name of current film.
 
+        Case, punctuation, "ё"/"е" and transliteration differences and a few
+        typos are tolerated.
+
         Args:
             answer: Player's answer.
             film: A Film instance to compare.
+            catalogue: The catalogue the film was taken from.
 
         Returns:
             Boolean representing the result of validating.
         """
-        return film.name.lower().strip() == answer.lower().strip()
+        return catalogue.matcher.matches(answer, film._id)
 
-    def play(self, player_id: int) -> Film:
+    async def play(self, player_id: int) -> Film:
         """Starts a new game round for a given player.
 
         Retrieves the `Player` instance, sets the `current_film` for
@@ -119,14 +177,30 @@ class GuessFilm:
         Returns:
             A next film for guessing.
         """
-        player = self.get_player(player_id)
-        film = self._get_film_for_player(player)
-        player.current_film = film._id
-        player.attempts = NUMBER_OF_ATTEMPTS
-        self.players[player._id] = player
+        player = await self.get_player(player_id)
+        film = await self._get_film_for_player(player)
+        await self.players.start_round(player, film._id, NUMBER_OF_ATTEMPTS)
+        return film
+
+    async def _get_current_film(self, player: Player, catalogue: Catalogue) -> Film:
+        """Returns the film guessed by the player.
+
+        A round whose film was removed from the catalogue is cancelled.
+
+        Raises:
+            RoundNotFound: if the player has no active round.
+        """
+        if player.current_film is None:
+            raise RoundNotFound(f"Player {player._id} has no active round.")
+
+        film = catalogue.get(player.current_film)
+        if film is None:
+            await self.players.cancel_round(player)
+            raise RoundNotFound(f"Film of player {player._id} was removed from the catalogue.")
+
         return film
 
-    def guess(self, player: Player, answer: str) -> Tuple[str, Optional[Film]]:
+    async def guess(self, player: Player, answer: str) -> Tuple[str, Optional[Film]]:
         """Processes a player's guess.
 
         Given a `Player` instance and a player's guess (`film`).
@@ -141,24 +215,31 @@ class GuessFilm:
         Returns:
             Tuple - message (a hint for guessing or lose/win result),
                     the film if guessed or attempts are over, `None` othervise.
+
+        Raises:
+            RoundNotFound: if the player has no active round, e.g. it was
+                           finished by another update.
         """
-        film = self.films[player.current_film]
-        player.attempts -= 1
-
-        if self._validate_answer(answer, film):
-            player.guessed_films.append(player.current_film)
-            player.current_film = None
-            player.score += 5 + player.attempts * 2
-            self.players[player._id] = player
+        catalogue = self.catalogue
+        film = await self._get_current_film(player, catalogue)
+        attempts = await self.players.use_attempt(player, film._id)
+        if attempts is None:
+            raise RoundNotFound(f"Player {player._id} has no active round.")
+
+        if self._validate_answer(answer, film, catalogue):
+            score_delta = self.win_score + attempts * self.attempt_score
+            if not await self.players.finish_round(player, film._id, score_delta, guessed=True):
+                raise RoundNotFound(f"Player {player._id} has no active round.")
+            self._record(film, won=True, attempts_left=attempts)
+            await self._update_leaderboard(player)
             return "win", film
         else:
-            if player.attempts == 0:
-                return "lose", self.surrender(player)
+            if attempts <= 0:
+                return "lose", await self.surrender(player)
             else:
-                self.players[player._id] = player
-                return self._get_hint(film, player.attempts), None
+                return catalogue.texts.hint(film, attempts), None
 
-    def surrender(self, player: Player) -> Film:
+    async def surrender(self, player: Player) -> Film:
         """Ends a game round and returns the hidden film.
 
         Given a `Player` instance, updates the player's score, sets the
@@ -170,14 +251,30 @@ class GuessFilm:
 
         Returns:
             The hidden film.
+
+        Raises:
+            RoundNotFound: if the player has no active round.
         """
 
-        film = self.films[player.current_film]
-        player.current_film = None
-        player.score -= 5
-        self.players[player._id] = player
+        film = await self._get_current_film(player, self.catalogue)
+        attempts_left = player.attempts
+        if not await self.players.finish_round(player, film._id, self.surrender_score, guessed=False):
+            raise RoundNotFound(f"Player {player._id} has no active round.")
+        self._record(film, won=False, attempts_left=attempts_left)
+        await self._update_leaderboard(player)
         return film
 
-    def cancel(self, player: Player) -> None:
-        player.current_film = None
-        self.players[player._id] = player
+    def explain(self, film: Film) -> str:
+        """Returns the explanation of a film pre-rendered by the catalogue."""
+        return self.catalogue.texts.explain(film)
+
+    def _record(self, film: Film, won: bool, attempts_left: int) -> None:
+        if self.stats is not None:
+            self.stats.record(film._id, won, NUMBER_OF_ATTEMPTS - attempts_left)
+
+    async def _update_leaderboard(self, player: Player) -> None:
+        if self.leaderboard is not None:
+            await self.leaderboard.update(player._id, player.score)
+
+    async def cancel(self, player: Player) -> None:
+        await self.players.cancel_round(player)
@@ -0,0 +1,247 @@
+import logging
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from redis.asyncio import Redis
+
+from database.models import Film
+from game.game import GuessFilm
+from services.timer_wheel import Timer, TimerWheel
+
+logger = logging.getLogger(__name__)
+
+
+# KEYS: round hash, participants set. ARGV: round id, film id, deadline, now, TTL in milliseconds.
+START_SCRIPT = """
+local deadline = tonumber(redis.call('HGET', KEYS[1], 'deadline'))
+if deadline and deadline > tonumber(ARGV[4]) then
+    return 0
+end
+redis.call('DEL', KEYS[1], KEYS[2])
+redis.call('HSET', KEYS[1], 'round', ARGV[1], 'film', ARGV[2], 'deadline', ARGV[3])
+redis.call('PEXPIRE', KEYS[1], ARGV[5])
+return 1
+"""
+
+# KEYS: round hash, participants set. ARGV: round id, user id, correct answer flag, now.
+# Returns 1 if the user has won, 0 for a wrong answer, -1 if the round is over and -2 if it has timed out.
+GUESS_SCRIPT = """
+local round = redis.call('HMGET', KEYS[1], 'round', 'deadline', 'winner')
+if round[1] ~= ARGV[1] or round[3] then
+    return -1
+end
+if tonumber(round[2]) <= tonumber(ARGV[4]) then
+    return -2
+end
+redis.call('SADD', KEYS[2], ARGV[2])
+redis.call('PEXPIRE', KEYS[2], redis.call('PTTL', KEYS[1]))
+if ARGV[3] ~= '1' then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'winner', ARGV[2])
+return 1
+"""
+
+# KEYS: round hash, participants set. ARGV: round id.
+# Returns the film id, the winner id or an empty string and ids of participants.
+FINISH_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'round') ~= ARGV[1] then
+    return false
+end
+local result = {redis.call('HGET', KEYS[1], 'film'), redis.call('HGET', KEYS[1], 'winner') or ''}
+for _, user_id in ipairs(redis.call('SMEMBERS', KEYS[2])) do
+    result[#result + 1] = user_id
+end
+redis.call('DEL', KEYS[1], KEYS[2])
+return result
+"""
+
+GUESS_WON = 1
+GUESS_OVER = -1
+GUESS_TIMED_OUT = -2
+
+
+@dataclass(slots=True)
+class GroupRound:
+    """A round of a group chat known to this process."""
+
+    round_id: str
+    film_id: int
+    timer: Optional[Timer] = None
+
+
+@dataclass(slots=True)
+class GroupResult:
+    """Result of a finished group round.
+
+    Properties:
+        film: The guessed film, `None` if it was removed from the catalogue.
+        winner_id: Id of the user who answered first, `None` if the round timed out.
+        scores: Score changes of the participants by user id.
+
+    """
+
+    film: Optional[Film]
+    winner_id: Optional[int]
+    scores: Dict[int, int]
+
+
+class GroupRounds:
+    """Quiz rounds in group chats, where all members guess the same film.
+
+    A chat has at most one round at a time. The round lives in Redis, so
+    every bot worker handles answers of any member: Lua scripts record the
+    participants, each member once however many answers they send, and
+    pick the first correct answer by compare-and-set of the winner.
+    Answers are checked against the catalogue in memory and players are
+    not loaded, so an answer costs one Redis call. Scores of all
+    participants are changed by one batch when the round ends; rounds
+    nobody has guessed are finished by a `TimerWheel`; if the bot stops,
+    they time out on the next answer.
+
+    Properties:
+        game: The game providing films and players.
+        redis: Redis client.
+        wheel: Timer wheel finishing rounds which time out.
+        duration: Number of seconds members have for guessing.
+        listeners: Coroutine functions called with the chat id and the
+                   result of every round which timed out.
+
+    """
+
+    game: GuessFilm
+    redis: Redis
+    wheel: TimerWheel
+    duration: float
+    listeners: List[Callable[[int, GroupResult], Awaitable[None]]]
+
+    key_prefix: str = "group"
+    win_score: int = 10
+    participation_score: int = 1
+    # Rounds left by a stopped bot are removed from Redis after this number of seconds.
+    expiration_margin: float = 3600.0
+
+    def __init__(self, game: GuessFilm, redis: Redis, wheel: TimerWheel, duration: float) -> None:
+        self.game = game
+        self.redis = redis
+        self.wheel = wheel
+        self.duration = duration
+        self.listeners = []
+        self._rounds: Dict[int, GroupRound] = {}
+
+        self._start = redis.register_script(START_SCRIPT)
+        self._guess = redis.register_script(GUESS_SCRIPT)
+        self._finish = redis.register_script(FINISH_SCRIPT)
+
+    async def play(self, chat_id: int) -> Optional[Film]:
+        """Starts a round in a chat.
+
+        Returns:
+            The film to guess or `None` if the chat already has a round.
+        """
+        film = self.game.catalogue.picker.pick(frozenset())
+        round_id = uuid.uuid4().hex
+        now = time.time()
+
+        started = await self._start(
+            keys=self._keys(chat_id),
+            args=[round_id, film._id, now + self.duration, now, int((self.duration + self.expiration_margin) * 1000)],
+        )
+        if not started:
+            return None
+
+        self._remember(chat_id, GroupRound(round_id, film._id), self.duration)
+        return film
+
+    async def guess(self, chat_id: int, user_id: int, answer: str) -> Optional[GroupResult]:
+        """Checks an answer of a chat member.
+
+        Returns:
+            The result of the round if the answer is the first correct one,
+            `None` otherwise, also if the chat has no round.
+        """
+        group_round = self._rounds.get(chat_id) or await self._load(chat_id)
+        if group_round is None:
+            return None
+
+        catalogue = self.game.catalogue
+        film = catalogue.get(group_round.film_id)
+        correct = film is not None and catalogue.matcher.matches(answer, film._id)
+
+        status = await self._guess(
+            keys=self._keys(chat_id),
+            args=[group_round.round_id, user_id, int(correct), time.time()],
+        )
+        if status == GUESS_WON:
+            return await self._finish_round(chat_id, group_round.round_id)
+
+        if status == GUESS_TIMED_OUT:
+            # The process which started the round may be gone along with its timer.
+            await self._time_out(chat_id, group_round.round_id)
+        elif status == GUESS_OVER:
+            self._forget(chat_id, group_round.round_id)
+        return None
+
+    async def _load(self, chat_id: int) -> Optional[GroupRound]:
+        round_id, film_id, deadline = await self.redis.hmget(self._keys(chat_id)[0], "round", "film", "deadline")
+        if round_id is None:
+            return None
+
+        group_round = GroupRound(round_id.decode(), int(film_id))
+        self._remember(chat_id, group_round, float(deadline) - time.time())
+        return group_round
+
+    def _remember(self, chat_id: int, group_round: GroupRound, timeout: float) -> None:
+        self._forget(chat_id)
+        group_round.timer = self.wheel.schedule(timeout, lambda: self._time_out(chat_id, group_round.round_id))
+        self._rounds[chat_id] = group_round
+
+    def _forget(self, chat_id: int, round_id: Optional[str] = None) -> None:
+        group_round = self._rounds.get(chat_id)
+        if group_round is None or (round_id is not None and group_round.round_id != round_id):
+            return
+
+        del self._rounds[chat_id]
+        if group_round.timer is not None:
+            group_round.timer.cancel()
+
+    async def _time_out(self, chat_id: int, round_id: str) -> None:
+        result = await self._finish_round(chat_id, round_id)
+        if result is None:
+            return
+
+        for listener in self.listeners:
+            try:
+                await listener(chat_id, result)
+            except Exception:
+                logger.exception("Failed to notify about the timed out round in chat %s", chat_id)
+
+    async def _finish_round(self, chat_id: int, round_id: str) -> Optional[GroupResult]:
+        """Ends the round and changes scores of its participants.
+
+        Returns:
+            The result or `None` if the round was finished by another update or worker.
+        """
+        self._forget(chat_id, round_id)
+
+        finished = await self._finish(keys=self._keys(chat_id), args=[round_id])
+        if not finished:
+            return None
+
+        film_id, winner_id, *participants = finished
+        scores = {int(user_id): self.participation_score for user_id in participants}
+        winner_id = int(winner_id) if winner_id else None
+        if winner_id is not None:
+            scores[winner_id] = self.win_score
+
+        if scores:
+            await self.game.players.add_scores(scores)
+            if self.game.leaderboard is not None:
+                await self.game.leaderboard.increment_many(scores)
+
+        return GroupResult(self.game.catalogue.get(int(film_id)), winner_id, scores)
+
+    def _keys(self, chat_id: int) -> List[str]:
+        return [f"{self.key_prefix}:{chat_id}", f"{self.key_prefix}:{chat_id}:players"]
@@ -0,0 +1,126 @@
+import logging
+from typing import AsyncIterable, Dict, List, Optional, Tuple
+
+from redis.asyncio import Redis
+
+logger = logging.getLogger(__name__)
+
+
+class Leaderboard:
+    """Ranking of players by score kept in a Redis sorted set.
+
+    The sorted set maps player ids to their scores, so the top of the
+    ranking and the place of a player are found in O(log N) without
+    touching MongoDB. The game updates the score of a player after every
+    change; the whole set can be rebuilt from the database with `rebuild`.
+    Names shown in the ranking are kept in a hash, players who haven't
+    told their name yet are shown by a masked id.
+
+    Properties:
+        redis: Redis client.
+
+    """
+
+    redis: Redis
+
+    key: str = "leaderboard"
+    names_key: str = "leaderboard:names"
+    # Names longer than this are cut in the ranking.
+    max_name_length: int = 32
+    rebuild_lock_key: str = "leaderboard:rebuild_lock"
+
+    def __init__(self, redis: Redis) -> None:
+        self.redis = redis
+
+    async def update(self, player_id: int, score: int) -> None:
+        """Sets the score of a player."""
+        await self.redis.zadd(self.key, {player_id: score})
+
+    async def update_many(self, scores: Dict[int, int]) -> None:
+        """Sets scores of many players with one round trip."""
+        if scores:
+            await self.redis.zadd(self.key, scores)
+
+    async def increment_many(self, score_deltas: Dict[int, int]) -> None:
+        """Adds score changes to many players with one round trip."""
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for player_id, score_delta in score_deltas.items():
+                pipe.zincrby(self.key, score_delta, player_id)
+            await pipe.execute()
+
+    async def top(self, count: int) -> List[Tuple[int, int]]:
+        """Returns pairs of player id and score of the best `count` players."""
+        rows = await self.redis.zrevrange(self.key, 0, count - 1, withscores=True)
+        return [(int(player_id), int(score)) for player_id, score in rows]
+
+    async def set_name(self, player_id: int, name: str) -> None:
+        """Stores the name the player is shown by in the ranking."""
+        await self.redis.hset(self.names_key, player_id, name[:self.max_name_length])
+
+    async def names(self, player_ids: List[int]) -> Dict[int, str]:
+        """Returns names of the players who have one, by player id."""
+        if not player_ids:
+            return {}
+
+        names = await self.redis.hmget(self.names_key, player_ids)
+        return {player_id: name.decode() for player_id, name in zip(player_ids, names) if name is not None}
+
+    async def rank(self, player_id: int) -> Optional[int]:
+        """Returns the place of a player starting from 1 or `None` if the player is not ranked."""
+        rank = await self.redis.zrevrank(self.key, player_id)
+        return None if rank is None else rank + 1
+
+    async def size(self) -> int:
+        """Returns the number of ranked players."""
+        return await self.redis.zcard(self.key)
+
+    async def rebuild(self, scores: AsyncIterable[Tuple[int, int]], batch_size: int = 10000) -> int:
+        """Replaces the ranking with scores from the database.
+
+        Scores are written to a temporary set in batches, which then
+        atomically replaces the ranking, so queries are answered during
+        the rebuild. Scores changed while rebuilding may be stale until
+        the next change of the player's score.
+
+        Args:
+            scores: Pairs of player id and score, e.g. `PlayerDao.iter_scores()`.
+            batch_size: Number of players written to Redis at once.
+
+        Returns:
+            Number of ranked players.
+        """
+        async with self.redis.lock(self.rebuild_lock_key, timeout=600):
+            return await self._rebuild(scores, batch_size)
+
+    async def rebuild_if_missing(self, scores: AsyncIterable[Tuple[int, int]], batch_size: int = 10000) -> int:
+        """Rebuilds the ranking unless it exists, e.g. after Redis lost its data.
+
+        Returns:
+            Number of ranked players or 0 if the ranking exists.
+        """
+        async with self.redis.lock(self.rebuild_lock_key, timeout=600):
+            if await self.redis.exists(self.key):
+                return 0
+            return await self._rebuild(scores, batch_size)
+
+    async def _rebuild(self, scores: AsyncIterable[Tuple[int, int]], batch_size: int) -> int:
+        temporary_key = f"{self.key}:rebuild"
+        await self.redis.delete(temporary_key)
+
+        ranked = 0
+        batch: Dict[int, int] = {}
+        async for player_id, score in scores:
+            batch[player_id] = score
+            if len(batch) >= batch_size:
+                ranked += await self.redis.zadd(temporary_key, batch)
+                batch = {}
+        if batch:
+            ranked += await self.redis.zadd(temporary_key, batch)
+
+        if ranked:
+            await self.redis.rename(temporary_key, self.key)
+        else:
+            await self.redis.delete(self.key)
+
+        logger.info("Leaderboard is rebuilt with %d players", ranked)
+        return ranked
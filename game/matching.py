@@ -0,0 +1,180 @@
+import re
+import unicodedata
+from typing import Dict, Iterable, List, Set, Tuple
+
+from database.models import Film
+
+
+TRANSLITERATION: Dict[str, str] = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "е": "e", "ё": "e", "ж": "zh",
+    "з": "z", "и": "i", "й": "i", "к": "k", "л": "l", "м": "m", "н": "n", "о": "o",
+    "п": "p", "р": "r", "с": "s", "т": "t", "у": "u", "ф": "f", "х": "h", "ц": "c",
+    "ч": "ch", "ш": "sh", "щ": "sch", "ъ": "", "ы": "y", "ь": "", "э": "e", "ю": "yu",
+    "я": "ya",
+}
+
+_TRANSLITERATION_TABLE = str.maketrans(TRANSLITERATION)
+_NOT_WORD_CHARS = re.compile(r"[\W_]+")
+
+
+def normalize(text: str) -> str:
+    """Returns a canonical form of a film name or an answer.
+
+    The text is casefolded, punctuation is replaced with spaces and
+    Cyrillic letters are transliterated to Latin ones, so "Матрица.",
+    "МАТРИЦА" and "matrica" have the same form ("ё" and "е" too).
+
+    Args:
+        text: A text to normalize.
+
+    Returns:
+        The normalized text.
+    """
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = _NOT_WORD_CHARS.sub(" ", text).strip()
+    return text.translate(_TRANSLITERATION_TABLE)
+
+
+def max_typos(text: str) -> int:
+    """Returns the number of typos tolerated in a normalized answer of the given length."""
+    if len(text) <= 3:
+        return 0
+    if len(text) <= 7:
+        return 1
+    return 2
+
+
+def bounded_distance(first: str, second: str, limit: int) -> int:
+    """Returns the Levenshtein distance between strings or `limit + 1` if it exceeds `limit`."""
+    if abs(len(first) - len(second)) > limit:
+        return limit + 1
+
+    previous = list(range(len(second) + 1))
+    for i, first_char in enumerate(first, 1):
+        current = [i]
+        for j, second_char in enumerate(second, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (first_char != second_char),
+            ))
+
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+
+    return min(previous[-1], limit + 1)
+
+
+def trigrams(text: str) -> Set[str]:
+    """Returns distinct trigrams of a text padded at both ends."""
+    padded = f"$${text}$$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    """Inverted index of normalized film names by trigrams.
+
+    One edit changes at most three trigrams, so a name within `limit` edits
+    of a text shares at least `len(trigrams(text)) - 3 * limit` trigrams with
+    it. Only names passing this filter are compared with the text.
+
+    """
+
+    def __init__(self) -> None:
+        self._names: List[str] = []
+        self._film_ids: List[Set[int]] = []
+        self._positions: Dict[str, int] = {}
+        self._postings: Dict[str, List[int]] = {}
+
+    def add(self, name: str, film_id: int) -> None:
+        if (position := self._positions.get(name)) is not None:
+            self._film_ids[position].add(film_id)
+            return
+
+        position = len(self._names)
+        self._positions[name] = position
+        self._names.append(name)
+        self._film_ids.append({film_id})
+
+        for gram in trigrams(name):
+            self._postings.setdefault(gram, []).append(position)
+
+    def search(self, text: str, limit: int) -> List[Tuple[int, Set[int]]]:
+        """Returns pairs of distance and film ids for names within `limit` of `text`."""
+        grams = trigrams(text)
+        min_common = len(grams) - 3 * limit
+
+        if min_common > 0:
+            common: Dict[int, int] = {}
+            for gram in grams:
+                for position in self._postings.get(gram, ()):
+                    common[position] = common.get(position, 0) + 1
+            candidates: Iterable[int] = (position for position, count in common.items() if count >= min_common)
+        else:
+            candidates = range(len(self._names))
+
+        found = []
+        for position in candidates:
+            distance = bounded_distance(text, self._names[position], limit)
+            if distance <= limit:
+                found.append((distance, self._film_ids[position]))
+
+        return found
+
+
+class AnswerMatcher:
+    """Matches players' answers with film names tolerating typos.
+
+    Normalized names and aliases of all films are precomputed. An exact
+    match of normalized forms is checked with a dictionary lookup. Otherwise
+    an answer with a few typos is accepted if it is closer to the film than
+    to any other film in the catalogue, which is checked with a trigram index.
+
+    """
+
+    def __init__(self, films: Iterable[Film]) -> None:
+        self._names: Dict[int, List[str]] = {}
+        self._exact: Dict[str, Set[int]] = {}
+        self._index = TrigramIndex()
+
+        for film in films:
+            names = {normalize(name) for name in (film.name, *film.aliases)}
+            names.discard("")
+            self._names[film._id] = list(names)
+
+            for name in names:
+                self._exact.setdefault(name, set()).add(film._id)
+                self._index.add(name, film._id)
+
+    def matches(self, answer: str, film_id: int) -> bool:
+        """Checks whether the answer names the film.
+
+        Args:
+            answer: Player's answer.
+            film_id: Id of the film to compare with.
+
+        Returns:
+            Boolean representing the result of matching.
+        """
+        answer = normalize(answer)
+        if not answer:
+            return False
+
+        if exact := self._exact.get(answer):
+            return film_id in exact
+
+        limit = max_typos(answer)
+        if not limit:
+            return False
+
+        distance = min(
+            (bounded_distance(answer, name, limit) for name in self._names.get(film_id, ())),
+            default=limit + 1,
+        )
+        if distance > limit:
+            return False
+
+        # Reject the answer if it names another film more precisely, e.g. a sequel.
+        # Names at distance 0 are exact matches, which are checked above.
+        return distance == 1 or not self._index.search(answer, distance - 1)
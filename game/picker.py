@@ -0,0 +1,118 @@
+from random import Random
+from typing import AbstractSet, Iterable, List, Optional, Sequence
+
+from database.models import Film
+
+
+class AliasTable:
+    """Samples indexes with given weights in O(1) by Vose's alias method.
+
+    Every column of the table keeps the probability of its own index and
+    an alias index taking the rest of the column, so a sample is one
+    uniform number: a column and a point inside it. Building takes O(n).
+    """
+
+    __slots__ = ("_probabilities", "_aliases")
+
+    def __init__(self, weights: Sequence[float]) -> None:
+        size = len(weights)
+        total = sum(weights)
+        if size == 0 or total <= 0:
+            raise ValueError("Weights must have a positive sum.")
+
+        scaled = [weight * size / total for weight in weights]
+        self._probabilities = [1.0] * size
+        self._aliases = list(range(size))
+
+        small = [index for index, weight in enumerate(scaled) if weight < 1.0]
+        large = [index for index, weight in enumerate(scaled) if weight >= 1.0]
+        while small and large:
+            index, alias = small.pop(), large.pop()
+            self._probabilities[index] = scaled[index]
+            self._aliases[index] = alias
+            scaled[alias] += scaled[index] - 1.0
+            (small if scaled[alias] < 1.0 else large).append(alias)
+        # Columns left in either list are full up to rounding errors.
+
+    def __len__(self) -> int:
+        return len(self._probabilities)
+
+    def sample(self, uniform: float) -> int:
+        """Returns a random index for a uniform random number in [0, 1)."""
+        column = uniform * len(self._probabilities)
+        index = int(column)
+        return index if column - index < self._probabilities[index] else self._aliases[index]
+
+
+class FilmPicker:
+    """Picks a random film which is not guessed by a player yet.
+
+    Films are stored in a dense list, so a random film is picked by index
+    without copying the catalogue. The picker draws random films and rejects
+    already guessed ones, which takes `len(films) / remaining` draws on
+    average. When the expected number of draws exceeds `max_draws` (the
+    player guessed almost everything) or the draws are unlucky, it falls back
+    to a pick from the remaining films.
+
+    Properties:
+        films: A dense list of films to pick from.
+        max_draws: Maximal expected number of random draws before falling
+                   back to the remaining films.
+
+    """
+
+    films: List[Film]
+    max_draws: int
+
+    def __init__(self, films: Iterable[Film], max_draws: int = 32, rng: Optional[Random] = None) -> None:
+        self.films = list(films)
+        self.max_draws = max_draws
+        self._rng = rng or Random()
+
+    def __len__(self) -> int:
+        return len(self.films)
+
+    def pick(self, guessed: AbstractSet[int], table: Optional[AliasTable] = None) -> Optional[Film]:
+        """Returns a random film which id is not in `guessed`.
+
+        Args:
+            guessed: Ids of films already guessed by a player. Must support
+                     O(1) membership checks.
+            table: Weights of `films` for the random draws, films are drawn
+                   uniformly without it. The fallback is always uniform.
+
+        Returns:
+            A not guessed film or `None` if all films are guessed.
+        """
+        films = self.films
+        if not films:
+            return None
+
+        size = len(films)
+        # Guessed ids may include films removed from the catalogue, so this
+        # is a lower bound and never makes the picker skip a possible film.
+        remaining = size - len(guessed)
+
+        if remaining > 0 and size <= remaining * self.max_draws:
+            draws = 4 * size // remaining + 1
+            if table is not None and len(table) == size:
+                sample, random = table.sample, self._rng.random
+                for _ in range(draws):
+                    film = films[sample(random())]
+                    if film._id not in guessed:
+                        return film
+            else:
+                randrange = self._rng.randrange
+                for _ in range(draws):
+                    film = films[randrange(size)]
+                    if film._id not in guessed:
+                        return film
+
+        return self._pick_from_remaining(guessed)
+
+    def _pick_from_remaining(self, guessed: AbstractSet[int]) -> Optional[Film]:
+        """Returns a uniformly random film from the not guessed ones."""
+        # Built-in sets are much faster for checking every film of the catalogue.
+        guessed = guessed if isinstance(guessed, (set, frozenset)) else set(guessed)
+        remaining = [film for film in self.films if film._id not in guessed]
+        return self._rng.choice(remaining) if remaining else None
@@ -0,0 +1,525 @@
+import asyncio
+import logging
+from contextvars import ContextVar, Token
+from typing import Dict, List, Optional, Set, Tuple
+
+from redis.asyncio import Redis
+
+from database.dao import ObjectDoesNotExist, PlayerDao, PlayersNotSaved
+from database.models import GuessedFilms, Player, PlayerChanges
+from game.store import PlayerStore
+from services.metrics import PLAYERS_FLUSHED, PLAYERS_FLUSH_LATENCY
+
+logger = logging.getLogger(__name__)
+
+
+# Every script touching a player refreshes the TTL of its hash and sets, ARGV[1] is the TTL in milliseconds.
+
+# KEYS: player hash, guessed films set. ARGV: TTL, attempts, score, current film, guessed films...
+SEED_SCRIPT = """
+if redis.call('HEXISTS', KEYS[1], 'score') == 1 then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'attempts', ARGV[2], 'score', ARGV[3])
+if ARGV[4] ~= '' then
+    redis.call('HSET', KEYS[1], 'current_film', ARGV[4])
+end
+for i = 5, #ARGV do
+    redis.call('SADD', KEYS[2], ARGV[i])
+end
+redis.call('PEXPIRE', KEYS[1], ARGV[1])
+redis.call('PEXPIRE', KEYS[2], ARGV[1])
+return 1
+"""
+
+# The FSM state of the player's private chat is written along with the round, see `RedisPlayerStore.in_game_state`.
+
+# KEYS: player hash, guessed films set, dirty set. ARGV: TTL, player id, film id, attempts, FSM state.
+START_ROUND_SCRIPT = """
+redis.call('HSET', KEYS[1], 'current_film', ARGV[3], 'attempts', ARGV[4])
+if ARGV[5] ~= '' then
+    redis.call('HSET', KEYS[1], 'fsm_state', ARGV[5])
+end
+redis.call('PEXPIRE', KEYS[1], ARGV[1])
+redis.call('PEXPIRE', KEYS[2], ARGV[1])
+redis.call('SADD', KEYS[3], ARGV[2])
+return 1
+"""
+
+# KEYS: player hash, guessed films set, dirty set. ARGV: TTL, player id, film id.
+USE_ATTEMPT_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'current_film') ~= ARGV[3] then
+    return -1
+end
+redis.call('PEXPIRE', KEYS[1], ARGV[1])
+redis.call('PEXPIRE', KEYS[2], ARGV[1])
+redis.call('SADD', KEYS[3], ARGV[2])
+return redis.call('HINCRBY', KEYS[1], 'attempts', -1)
+"""
+
+# KEYS: player hash, guessed films set, new guessed films set, dirty set.
+# ARGV: TTL, player id, film id, score delta, guessed flag, FSM clearing flag.
+FINISH_ROUND_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'current_film') ~= ARGV[3] then
+    return false
+end
+redis.call('HDEL', KEYS[1], 'current_film')
+if ARGV[6] == '1' then
+    redis.call('HDEL', KEYS[1], 'fsm_state', 'fsm_data')
+end
+if ARGV[5] == '1' and redis.call('SADD', KEYS[2], ARGV[3]) == 1 then
+    redis.call('SADD', KEYS[3], ARGV[3])
+end
+redis.call('HINCRBY', KEYS[1], 'score_delta', ARGV[4])
+redis.call('PEXPIRE', KEYS[1], ARGV[1])
+redis.call('PEXPIRE', KEYS[2], ARGV[1])
+redis.call('PEXPIRE', KEYS[3], ARGV[1])
+redis.call('SADD', KEYS[4], ARGV[2])
+return redis.call('HINCRBY', KEYS[1], 'score', ARGV[4])
+"""
+
+# KEYS: player hash, guessed films set, dirty set. ARGV: TTL, player id, score delta.
+ADD_SCORE_SCRIPT = """
+if redis.call('HEXISTS', KEYS[1], 'score') == 0 then
+    return false
+end
+redis.call('HINCRBY', KEYS[1], 'score_delta', ARGV[3])
+redis.call('PEXPIRE', KEYS[1], ARGV[1])
+redis.call('PEXPIRE', KEYS[2], ARGV[1])
+redis.call('SADD', KEYS[3], ARGV[2])
+return redis.call('HINCRBY', KEYS[1], 'score', ARGV[3])
+"""
+
+# KEYS: player hash, new guessed films set.
+# Returns current film, attempts, score delta, guessed reset flag and new guessed films.
+TAKE_CHANGES_SCRIPT = """
+if redis.call('HEXISTS', KEYS[1], 'score') == 0 then
+    return false
+end
+local fields = redis.call('HMGET', KEYS[1], 'current_film', 'attempts', 'score_delta', 'guessed_reset')
+local changes = {fields[1] or '', fields[2] or '0', fields[3] or '0', fields[4] or '0'}
+for _, film_id in ipairs(redis.call('SMEMBERS', KEYS[2])) do
+    changes[#changes + 1] = film_id
+end
+redis.call('HDEL', KEYS[1], 'score_delta', 'guessed_reset')
+redis.call('DEL', KEYS[2])
+return changes
+"""
+
+# KEYS: player hash, guessed films set, new guessed films set, dirty set.
+# ARGV: TTL, player id, score delta, guessed reset flag, new guessed films...
+RESTORE_CHANGES_SCRIPT = """
+redis.call('HINCRBY', KEYS[1], 'score_delta', ARGV[3])
+-- Films guessed before a newer reset are forgotten anyway.
+if redis.call('HGET', KEYS[1], 'guessed_reset') ~= '1' then
+    if ARGV[4] == '1' then
+        redis.call('HSET', KEYS[1], 'guessed_reset', '1')
+    end
+    for i = 5, #ARGV do
+        redis.call('SADD', KEYS[3], ARGV[i])
+    end
+end
+-- The changes must outlive the failed flush, so they live for the whole TTL again.
+redis.call('PEXPIRE', KEYS[1], ARGV[1])
+redis.call('PEXPIRE', KEYS[2], ARGV[1])
+redis.call('PEXPIRE', KEYS[3], ARGV[1])
+redis.call('SADD', KEYS[4], ARGV[2])
+return 1
+"""
+
+
+# The hash and guessed films of the player whose update is being handled,
+# loaded by the FSM storage together with the state, see `fsm.storage`.
+_preloaded: ContextVar[Optional[Tuple[int, Dict[bytes, bytes], Set[bytes]]]] = ContextVar(
+    "preloaded_player", default=None
+)
+
+
+def preload_player(player_id: int, fields: Dict[bytes, bytes], guessed: Set[bytes]) -> Token:
+    """Lets the next `RedisPlayerStore.get` of the player in this context use the loaded hash.
+
+    Returns:
+        A token for `reset_preloaded_player` called when the update is handled.
+    """
+    return _preloaded.set((player_id, fields, guessed))
+
+
+def reset_preloaded_player(token: Token) -> None:
+    _preloaded.reset(token)
+
+
+# FSM fields of the player's private chat written by the store while the update is handled.
+_written_state: ContextVar[Optional[Tuple[int, Dict[str, Optional[str]]]]] = ContextVar(
+    "written_player_state", default=None
+)
+
+
+def track_written_state(player_id: int) -> Token:
+    """Starts collecting FSM fields the store writes along with rounds of the player in this context.
+
+    Returns:
+        A token for `take_written_state` called when the update is handled.
+    """
+    return _written_state.set((player_id, {}))
+
+
+def take_written_state(token: Token) -> Dict[str, Optional[str]]:
+    """Returns the FSM fields written since `track_written_state`, `None` values are deleted fields."""
+    tracked = _written_state.get()
+    _written_state.reset(token)
+    return tracked[1] if tracked is not None else {}
+
+
+class RedisPlayerStore(PlayerStore):
+    """Stores players in Redis shared by all bot workers, MongoDB is the durable tier.
+
+    Each player is a hash with `current_film`, `attempts` and `score` fields
+    plus a set of guessed films; the hash may also keep the FSM state of the
+    player's private chat, so a player exists once it has a score. Changes are applied atomically by Lua
+    scripts, so any worker can process any update of a player. Changed
+    players are added to a dirty set, which a background task writes to
+    MongoDB in batches; only one worker flushes at a time. Along with the
+    state, the hash keeps the score change and the set of films guessed
+    since the last flush, so only these deltas are written to MongoDB.
+
+    With `in_game_state`, starting a round also sets the FSM state of the
+    player's private chat and finishing or cancelling it clears the state,
+    so handlers changing the state accordingly don't write it again, see
+    `fsm.storage`.
+
+    Every access to a player refreshes the TTL of its hash and sets, so
+    players who stopped playing leave Redis after `ttl` seconds. Changes
+    are flushed within seconds, so an expired player is loaded from
+    MongoDB again; the TTL must be much longer than `flush_interval` and
+    than an outage of MongoDB the changes have to survive.
+
+    Properties:
+        redis: Redis client.
+        players_dao: An instance of `PlayerDao` for accessing the player data
+                     in the database.
+        flush_interval: Number of seconds between flushes to the database.
+        flush_batch_size: Maximal number of players saved with one bulk write.
+        ttl: Number of seconds a player is kept in Redis after its last access.
+        in_game_state: The FSM state of a private chat during a round, `None`
+                       leaves the state to the FSM storage.
+
+    """
+
+    redis: Redis
+    players_dao: PlayerDao
+    flush_interval: float
+    flush_batch_size: int
+    ttl: float
+    in_game_state: Optional[str]
+
+    key_prefix: str = "player"
+    state_field: str = "fsm_state"
+    data_field: str = "fsm_data"
+    dirty_key: str = "players:dirty"
+    flush_lock_key: str = "players:flush_lock"
+
+    def __init__(
+        self,
+        redis: Redis,
+        players_dao: PlayerDao,
+        flush_interval: float,
+        flush_batch_size: int,
+        ttl: float,
+        in_game_state: Optional[str] = None,
+    ) -> None:
+        self.redis = redis
+        self.players_dao = players_dao
+        self.flush_interval = flush_interval
+        self.flush_batch_size = flush_batch_size
+        self.ttl = ttl
+        self.in_game_state = in_game_state
+        self._task: Optional[asyncio.Task] = None
+
+        self._seed = redis.register_script(SEED_SCRIPT)
+        self._start_round = redis.register_script(START_ROUND_SCRIPT)
+        self._use_attempt = redis.register_script(USE_ATTEMPT_SCRIPT)
+        self._finish_round = redis.register_script(FINISH_ROUND_SCRIPT)
+        self._add_score = redis.register_script(ADD_SCORE_SCRIPT)
+        self._take_changes = redis.register_script(TAKE_CHANGES_SCRIPT)
+        self._restore_changes = redis.register_script(RESTORE_CHANGES_SCRIPT)
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        await self.flush(durable=True)
+
+    async def get(self, player_id: int) -> Player:
+        player = self._take_preloaded(player_id) or await self._load(player_id)
+        if player:
+            return player
+
+        try:
+            player = await self.players_dao.get(player_id)
+        except ObjectDoesNotExist:
+            player, _ = await self.players_dao.create(Player(_id=player_id))
+
+        seeded = await self._seed(
+            keys=[self.key(player_id), self.guessed_key(player_id)],
+            args=[
+                self._ttl_ms,
+                player.attempts,
+                player.score,
+                "" if player.current_film is None else player.current_film,
+                *player.guessed_films,
+            ],
+        )
+        if seeded:
+            return player
+
+        # Another worker has loaded the player first.
+        return await self._load(player_id)
+
+    async def start_round(self, player: Player, film_id: int, attempts: int) -> None:
+        await self._start_round(
+            keys=[self.key(player._id), self.guessed_key(player._id), self.dirty_key],
+            args=[self._ttl_ms, player._id, film_id, attempts, self.in_game_state or ""],
+        )
+        player.current_film = film_id
+        player.attempts = attempts
+        if self.in_game_state is not None:
+            self._wrote_state(player._id, {self.state_field: self.in_game_state})
+
+    async def use_attempt(self, player: Player, film_id: int) -> Optional[int]:
+        attempts = await self._use_attempt(
+            keys=[self.key(player._id), self.guessed_key(player._id), self.dirty_key],
+            args=[self._ttl_ms, player._id, film_id],
+        )
+        if attempts < 0:
+            return None
+
+        player.attempts = attempts
+        return attempts
+
+    async def finish_round(self, player: Player, film_id: int, score_delta: int, guessed: bool) -> bool:
+        score = await self._finish_round(
+            keys=[
+                self.key(player._id),
+                self.guessed_key(player._id),
+                self._guessed_new_key(player._id),
+                self.dirty_key,
+            ],
+            args=[self._ttl_ms, player._id, film_id, score_delta, int(guessed), int(self.in_game_state is not None)],
+        )
+        if score is None:
+            return False
+        if self.in_game_state is not None:
+            self._wrote_state(player._id, {self.state_field: None, self.data_field: None})
+
+        if guessed:
+            player.guessed_films.add(film_id)
+        player.current_film = None
+        player.score = score
+        return True
+
+    async def cancel_round(self, player: Player) -> None:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            if self.in_game_state is not None:
+                pipe.hdel(self.key(player._id), "current_film", self.state_field, self.data_field)
+            else:
+                pipe.hdel(self.key(player._id), "current_film")
+            pipe.pexpire(self.key(player._id), self._ttl_ms)
+            pipe.pexpire(self.guessed_key(player._id), self._ttl_ms)
+            pipe.sadd(self.dirty_key, player._id)
+            await pipe.execute()
+        player.current_film = None
+        if self.in_game_state is not None:
+            self._wrote_state(player._id, {self.state_field: None, self.data_field: None})
+
+    async def reset_guessed(self, player: Player) -> None:
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(self.guessed_key(player._id), self._guessed_new_key(player._id))
+            pipe.hset(self.key(player._id), "guessed_reset", 1)
+            pipe.pexpire(self.key(player._id), self._ttl_ms)
+            pipe.sadd(self.dirty_key, player._id)
+            await pipe.execute()
+        player.guessed_films.clear()
+
+    async def add_scores(self, scores: Dict[int, int]) -> None:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for player_id, score_delta in scores.items():
+                await self._add_score(
+                    keys=[self.key(player_id), self.guessed_key(player_id), self.dirty_key],
+                    args=[self._ttl_ms, player_id, score_delta],
+                    client=pipe,
+                )
+            results = await pipe.execute()
+
+        # Players not in Redis get the delta added by the database.
+        await self.players_dao.save_changes([
+            PlayerChanges(player_id, score_delta=score_delta)
+            for (player_id, score_delta), score in zip(scores.items(), results)
+            if score is None
+        ])
+
+    async def flush(self, durable: bool = False) -> int:
+        """Saves all changed players to the database.
+
+        Args:
+            durable: Whether to wait for the durable write concern.
+
+        Returns:
+            Number of saved players or 0 if another worker is flushing.
+        """
+        lock = self.redis.lock(self.flush_lock_key, timeout=max(60.0, self.flush_interval * 2))
+        if not await lock.acquire(blocking=False):
+            return 0
+
+        flushed = 0
+        try:
+            while player_ids := await self.redis.spop(self.dirty_key, self.flush_batch_size):
+                changes = await self._take_many([int(player_id) for player_id in player_ids])
+
+                try:
+                    with PLAYERS_FLUSH_LATENCY.labels("redis").time():
+                        await self.players_dao.save_changes(changes, durable)
+                except PlayersNotSaved as e:
+                    await self._restore_many(e.changes)
+                    raise
+                except BaseException:
+                    await self._restore_many(changes)
+                    raise
+                flushed += len(changes)
+                PLAYERS_FLUSHED.labels("redis").inc(len(changes))
+        finally:
+            await lock.release()
+
+        return flushed
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                flushed = await self.flush()
+            except Exception:
+                logger.exception("Failed to flush players, retrying in %s seconds", self.flush_interval)
+                continue
+
+            if flushed:
+                logger.debug("Flushed %d players", flushed)
+
+    async def _take_many(self, player_ids: List[int]) -> List[PlayerChanges]:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for player_id in player_ids:
+                await self._take_changes(
+                    keys=[self.key(player_id), self._guessed_new_key(player_id)],
+                    client=pipe,
+                )
+            results = await pipe.execute()
+
+        changes = []
+        for player_id, result in zip(player_ids, results):
+            if not result:
+                continue
+
+            current_film, attempts, score_delta, guessed_reset, *guessed_added = result
+            changes.append(PlayerChanges(
+                player_id=player_id,
+                score_delta=int(score_delta),
+                fields={
+                    "current_film": int(current_film) if current_film else None,
+                    "attempts": int(attempts),
+                },
+                guessed_added=[int(film_id) for film_id in guessed_added],
+                guessed_reset=guessed_reset == b"1",
+            ))
+        return changes
+
+    async def _restore_many(self, changes: List[PlayerChanges]) -> None:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for player_changes in changes:
+                player_id = player_changes.player_id
+                await self._restore_changes(
+                    keys=[
+                        self.key(player_id),
+                        self.guessed_key(player_id),
+                        self._guessed_new_key(player_id),
+                        self.dirty_key,
+                    ],
+                    args=[
+                        self._ttl_ms,
+                        player_id,
+                        player_changes.score_delta,
+                        int(player_changes.guessed_reset),
+                        *player_changes.guessed_added,
+                    ],
+                    client=pipe,
+                )
+            await pipe.execute()
+
+    @staticmethod
+    def _wrote_state(player_id: int, fields: Dict[str, Optional[str]]) -> None:
+        tracked = _written_state.get()
+        if tracked is not None and tracked[0] == player_id:
+            tracked[1].update(fields)
+
+    def _take_preloaded(self, player_id: int) -> Optional[Player]:
+        preloaded = _preloaded.get()
+        if preloaded is None or preloaded[0] != player_id:
+            return None
+
+        # Scripts change the hash afterwards, so later calls load it again.
+        _preloaded.set(None)
+        return self._to_player(*preloaded)
+
+    async def _load(self, player_id: int) -> Optional[Player]:
+        return (await self._load_many([player_id]))[0]
+
+    async def _load_many(self, player_ids: List[int]) -> List[Optional[Player]]:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for player_id in player_ids:
+                pipe.hgetall(self.key(player_id))
+                pipe.smembers(self.guessed_key(player_id))
+                pipe.pexpire(self.key(player_id), self._ttl_ms)
+                pipe.pexpire(self.guessed_key(player_id), self._ttl_ms)
+            results = await pipe.execute()
+
+        return [
+            self._to_player(player_id, fields, guessed)
+            for player_id, fields, guessed in zip(player_ids, results[::4], results[1::4])
+        ]
+
+    @staticmethod
+    def _to_player(player_id: int, fields: Dict[bytes, bytes], guessed: Set[bytes]) -> Optional[Player]:
+        if b"score" not in fields:
+            return None
+
+        current_film = fields.get(b"current_film")
+        return Player(
+            _id=player_id,
+            current_film=int(current_film) if current_film is not None else None,
+            attempts=int(fields.get(b"attempts", 0)),
+            guessed_films=GuessedFilms(int(film_id) for film_id in guessed),
+            score=int(fields.get(b"score", 0)),
+        )
+
+    @property
+    def _ttl_ms(self) -> int:
+        return int(self.ttl * 1000)
+
+    @classmethod
+    def key(cls, player_id: int) -> str:
+        """Returns the key of the player hash."""
+        return f"{cls.key_prefix}:{player_id}"
+
+    @classmethod
+    def guessed_key(cls, player_id: int) -> str:
+        """Returns the key of the set of films guessed by the player."""
+        return f"{cls.key_prefix}:{player_id}:guessed"
+
+    def _guessed_new_key(self, player_id: int) -> str:
+        return f"{self.key_prefix}:{player_id}:guessed_new"
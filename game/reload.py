@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import os
+from typing import Callable, List, Optional
+
+from redis.asyncio import Redis
+
+from database.dao import FilmDao
+from game.catalogue import Catalogue
+from game.game import GuessFilm
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogueReloader:
+    """Reloads the films catalogue of a running game without a restart.
+
+    A reload is triggered by a change of the films file, which is checked
+    every `watch_interval` seconds, or by a message in the Redis channel,
+    which is published by `request_reload` (e.g. from the admin command) and
+    reaches every bot worker. The new catalogue is built in a worker thread
+    and swapped into the game in one assignment.
+
+    Properties:
+        game: The game to reload films of.
+        films_dao: An instance of `FilmDao` for loading films.
+        redis: Redis client for the reload channel.
+        watch_path: Path to the films file to watch or `None`.
+        watch_interval: Number of seconds between checks of the films file.
+        listeners: Callables invoked with the new catalogue after a reload.
+
+    """
+
+    game: GuessFilm
+    films_dao: FilmDao
+    redis: Redis
+    watch_path: Optional[str]
+    watch_interval: float
+    listeners: List[Callable[[Catalogue], None]]
+
+    channel: str = "catalogue:reload"
+
+    def __init__(
+        self,
+        game: GuessFilm,
+        films_dao: FilmDao,
+        redis: Redis,
+        watch_path: Optional[str] = None,
+        watch_interval: float = 10.0,
+    ) -> None:
+        self.game = game
+        self.films_dao = films_dao
+        self.redis = redis
+        self.watch_path = watch_path
+        self.watch_interval = watch_interval
+        self.listeners = []
+        self._lock = asyncio.Lock()
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        """Starts watching the films file and listening to the reload channel."""
+        self._tasks.append(asyncio.create_task(self._listen()))
+        if self.watch_path and self.watch_interval > 0:
+            self._tasks.append(asyncio.create_task(self._watch()))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def request_reload(self) -> int:
+        """Asks all bot workers to reload the catalogue.
+
+        Returns:
+            Number of workers which received the request.
+        """
+        return await self.redis.publish(self.channel, "reload")
+
+    async def reload(self) -> Catalogue:
+        """Loads films and replaces the game catalogue.
+
+        Returns:
+            The new catalogue.
+
+        Raises:
+            ValueError: if the new catalogue has no films; the game keeps
+                        the old catalogue.
+        """
+        async with self._lock:
+            catalogue = await GuessFilm.load_catalogue(self.films_dao)
+            self.game.replace_catalogue(catalogue)
+
+        for listener in self.listeners:
+            listener(catalogue)
+
+        logger.info("Reloaded the catalogue with %d films", len(catalogue))
+        return catalogue
+
+    async def _safe_reload(self) -> None:
+        try:
+            await self.reload()
+        except Exception:
+            logger.exception("Failed to reload the catalogue, keeping the old one")
+
+    async def _watch(self) -> None:
+        last_modified = self._get_modified_time()
+        while True:
+            await asyncio.sleep(self.watch_interval)
+            modified = self._get_modified_time()
+            if modified != last_modified:
+                last_modified = modified
+                await self._safe_reload()
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                async with self.redis.pubsub() as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            await self._safe_reload()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Lost the catalogue reload channel, resubscribing")
+                await asyncio.sleep(self.watch_interval or 10.0)
+
+    def _get_modified_time(self) -> Optional[int]:
+        try:
+            return os.stat(self.watch_path).st_mtime_ns
+        except OSError:
+            return None
@@ -0,0 +1,324 @@
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional, Tuple
+
+from redis.asyncio import Redis
+
+from database.dao import ObjectDoesNotExist, PlayerDao, PlayersNotSaved
+from database.models import Player, PlayerChanges
+from game.cache import PlayerCache
+from game.checkpoint import PlayersCheckpoint
+from game.flusher import WriteBehindFlusher
+from game.leaderboard import Leaderboard
+
+logger = logging.getLogger(__name__)
+
+
+class PlayerStore(ABC):
+    """Storage of players state used by the game.
+
+    Every operation which changes a player is applied to the storage and to
+    the passed `Player` instance, so callers always see the result. Operations
+    on a round take the id of the film being guessed and do nothing if the
+    player's round has already changed (e.g. it was finished by another
+    update), which makes them safe when several workers serve one player.
+
+    """
+
+    async def start(self) -> None:
+        """Starts background tasks of the storage."""
+
+    async def stop(self) -> None:
+        """Stops background tasks and saves all changes durably."""
+
+    @abstractmethod
+    async def get(self, player_id: int) -> Player:
+        """Returns a player by id creating a new one if it doesn't exist."""
+
+    @abstractmethod
+    async def start_round(self, player: Player, film_id: int, attempts: int) -> None:
+        """Sets the film to guess and the number of attempts."""
+
+    @abstractmethod
+    async def use_attempt(self, player: Player, film_id: int) -> Optional[int]:
+        """Decrements the number of attempts.
+
+        Returns:
+            Number of attempts left or `None` if the player doesn't guess
+            the film anymore.
+        """
+
+    @abstractmethod
+    async def finish_round(self, player: Player, film_id: int, score_delta: int, guessed: bool) -> bool:
+        """Ends the round, changes the score and remembers a guessed film.
+
+        Returns:
+            `False` if the player doesn't guess the film anymore.
+        """
+
+    @abstractmethod
+    async def cancel_round(self, player: Player) -> None:
+        """Ends the round without changing the score."""
+
+    @abstractmethod
+    async def reset_guessed(self, player: Player) -> None:
+        """Forgets all films guessed by the player."""
+
+    @abstractmethod
+    async def add_scores(self, scores: Dict[int, int]) -> None:
+        """Adds score changes to many players at once, e.g. at the end of a group round.
+
+        Players don't have to be loaded; rounds they play are not affected.
+        """
+
+
+class ScoreInbox:
+    """Score changes of players sent to the worker process owning them.
+
+    With several workers, each one keeps its own players in memory, so a
+    worker must not change players of another one even in the database:
+    the owner would keep and rank them with a stale score. Score changes of
+    such players, e.g. at the end of a group round, are added to a Redis
+    hash of their owner, which takes them every `interval` seconds.
+
+    Properties:
+        redis: Redis client.
+        worker_index: Index of this worker.
+        owner: A function returning the index of the worker owning a player.
+        interval: Number of seconds between taking the received changes.
+        leaderboard: The ranking which gets scores of players changed by the
+                     received changes, rounds finished meanwhile could set
+                     a stale score there.
+
+    """
+
+    redis: Redis
+    worker_index: int
+    owner: Callable[[int], int]
+    interval: float
+    leaderboard: Optional[Leaderboard]
+
+    key_prefix: str = "players:score_deltas"
+
+    def __init__(
+        self,
+        redis: Redis,
+        worker_index: int,
+        owner: Callable[[int], int],
+        interval: float = 1.0,
+        leaderboard: Optional[Leaderboard] = None,
+    ) -> None:
+        self.redis = redis
+        self.worker_index = worker_index
+        self.owner = owner
+        self.interval = interval
+        self.leaderboard = leaderboard
+
+    async def send(self, scores: Dict[int, int]) -> Dict[int, int]:
+        """Sends score changes of players owned by other workers to them.
+
+        Returns:
+            Score changes of players owned by this worker.
+        """
+        own: Dict[int, int] = {}
+        other: Dict[int, Dict[int, int]] = {}
+        for player_id, score_delta in scores.items():
+            index = self.owner(player_id)
+            if index == self.worker_index:
+                own[player_id] = score_delta
+            else:
+                other.setdefault(index, {})[player_id] = score_delta
+
+        if other:
+            await self._add(other)
+        return own
+
+    async def receive(self) -> Dict[int, int]:
+        """Takes score changes sent to this worker."""
+        key = self._key(self.worker_index)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hgetall(key)
+            pipe.delete(key)
+            received, _ = await pipe.execute()
+        return {int(player_id): int(score_delta) for player_id, score_delta in received.items()}
+
+    async def give_back(self, scores: Dict[int, int]) -> None:
+        """Returns taken score changes which were not applied, so they are taken again."""
+        if scores:
+            await self._add({self.worker_index: scores})
+
+    async def _add(self, scores_by_worker: Dict[int, Dict[int, int]]) -> None:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for index, scores in scores_by_worker.items():
+                for player_id, score_delta in scores.items():
+                    pipe.hincrby(self._key(index), player_id, score_delta)
+            await pipe.execute()
+
+    def _key(self, worker_index: int) -> str:
+        return f"{self.key_prefix}:{worker_index}"
+
+
+class LocalPlayerStore(PlayerStore):
+    """Stores players in the process memory and saves them to MongoDB.
+
+    Players live in a bounded `PlayerCache`; changes of players are written
+    to the database in batches by a `WriteBehindFlusher`. Only one process may
+    serve a player with this storage; with several workers, score changes
+    of players owned by others are sent to them with a `ScoreInbox`. With a
+    checkpoint, players not saved when the process was killed are saved on
+    the next start.
+
+    Properties:
+        cache: Cache of players.
+        players_dao: An instance of `PlayerDao` for accessing the player data
+                     in the database.
+        flusher: Background writer of changed players.
+        shutdown_timeout: Number of seconds the final flush may take.
+        inbox: Score changes of players owned by other workers, `None` if
+               this is the only worker.
+
+    """
+
+    cache: PlayerCache
+    players_dao: PlayerDao
+    flusher: WriteBehindFlusher
+    shutdown_timeout: Optional[float]
+    inbox: Optional[ScoreInbox]
+
+    def __init__(
+        self,
+        cache: PlayerCache,
+        players_dao: PlayerDao,
+        flush_interval: float,
+        flush_threshold: int,
+        checkpoint: Optional[PlayersCheckpoint] = None,
+        checkpoint_interval: float = 1.0,
+        shutdown_timeout: Optional[float] = None,
+        inbox: Optional[ScoreInbox] = None,
+    ) -> None:
+        self.cache = cache
+        self.players_dao = players_dao
+        self.flusher = WriteBehindFlusher(
+            cache, players_dao, flush_interval, flush_threshold, checkpoint, checkpoint_interval
+        )
+        self.shutdown_timeout = shutdown_timeout
+        self.inbox = inbox
+        self._inbox_task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        # Replayed before any update, so players are loaded with the saved changes.
+        await self.flusher.replay()
+        self.flusher.start()
+        if self.inbox is not None and self._inbox_task is None:
+            self._inbox_task = asyncio.create_task(self._receive_scores())
+
+    async def stop(self) -> None:
+        if self._inbox_task is not None:
+            self._inbox_task.cancel()
+            await asyncio.gather(self._inbox_task, return_exceptions=True)
+            self._inbox_task = None
+            try:
+                # Changes received until now are saved with the final flush, later ones wait for the next start.
+                await self._apply_received()
+            except Exception:
+                logger.exception("Failed to apply received score changes, they are kept for the next start")
+
+        await self.flusher.stop(self.shutdown_timeout)
+
+    async def get(self, player_id: int) -> Player:
+        if player := self.cache.get(player_id):
+            return player
+
+        try:
+            player = await self.players_dao.get(player_id)
+        except ObjectDoesNotExist:
+            player, _ = await self.players_dao.create(Player(_id=player_id))
+
+        # Another update of the player could load it while we were waiting.
+        if cached := self.cache.get(player_id):
+            return cached
+
+        self.cache.put(player)
+        return player
+
+    async def start_round(self, player: Player, film_id: int, attempts: int) -> None:
+        player.start_round(film_id, attempts)
+        self.cache.mark_dirty(player)
+
+    async def use_attempt(self, player: Player, film_id: int) -> Optional[int]:
+        if player.current_film != film_id:
+            return None
+
+        attempts = player.use_attempt()
+        self.cache.mark_dirty(player)
+        return attempts
+
+    async def finish_round(self, player: Player, film_id: int, score_delta: int, guessed: bool) -> bool:
+        if player.current_film != film_id:
+            return False
+
+        player.finish_round(score_delta, guessed)
+        self.cache.mark_dirty(player)
+        return True
+
+    async def cancel_round(self, player: Player) -> None:
+        player.cancel_round()
+        self.cache.mark_dirty(player)
+
+    async def reset_guessed(self, player: Player) -> None:
+        player.reset_guessed()
+        self.cache.mark_dirty(player)
+
+    async def add_scores(self, scores: Dict[int, int]) -> None:
+        if self.inbox is not None:
+            scores = await self.inbox.send(scores)
+
+        _, not_cached = self._add_cached_scores(scores)
+        await self.players_dao.save_changes(not_cached)
+
+    def _add_cached_scores(self, scores: Dict[int, int]) -> Tuple[List[Player], List[PlayerChanges]]:
+        """Adds score changes to cached players.
+
+        Returns:
+            The changed players and changes of players which are not cached.
+        """
+        changed: List[Player] = []
+        not_cached: List[PlayerChanges] = []
+
+        for player_id, score_delta in scores.items():
+            if player := self.cache.get(player_id):
+                player.add_score(score_delta)
+                self.cache.mark_dirty(player)
+                changed.append(player)
+            else:
+                # Not worth loading; the database adds the delta to the saved score.
+                not_cached.append(PlayerChanges(player_id, score_delta=score_delta))
+
+        return changed, not_cached
+
+    async def _apply_received(self) -> None:
+        scores = await self.inbox.receive()
+        if not scores:
+            return
+
+        changed, not_cached = self._add_cached_scores(scores)
+        try:
+            await self.players_dao.save_changes(not_cached)
+        except PlayersNotSaved as e:
+            await self.inbox.give_back({changes.player_id: changes.score_delta for changes in e.changes})
+            raise
+        except Exception:
+            await self.inbox.give_back({changes.player_id: changes.score_delta for changes in not_cached})
+            raise
+        finally:
+            if changed and self.inbox.leaderboard is not None:
+                await self.inbox.leaderboard.update_many({player._id: player.score for player in changed})
+
+    async def _receive_scores(self) -> None:
+        while True:
+            await asyncio.sleep(self.inbox.interval)
+            try:
+                await self._apply_received()
+            except Exception:
+                logger.exception("Failed to apply received score changes, retrying in %s seconds", self.inbox.interval)
@@ -0,0 +1,80 @@
+from typing import Dict, Iterable, NamedTuple, Tuple
+
+from database.models import Film
+
+
+def format_hint(film: Film, attempts_left: int, attempts: int) -> str:
+    """Returns a hint for guessing film depending on number of attempts left.
+
+    If there are more then enough attempts it doesn't return a hint.
+
+    Args:
+        film: A Film instance to take info for hint.
+        attempts_left: Number of attempts the player has left.
+        attempts: Number of attempts in a round.
+
+    Returns:
+        String that contains hint.
+    """
+    ratio = attempts_left / attempts
+    if ratio < 0.4:
+        return f'Ты не угадал. Подсказка: год выхода фильма - {film.year}'
+    elif ratio < 0.7:
+        return f'Неверно. Подсказка: жанр фильма - {film.genre}'
+    else:
+        return f'Неверно.'
+
+
+class FilmTexts(NamedTuple):
+    """Texts sent about a film, rendered once when a catalogue is built.
+
+    Properties:
+        film: The film the texts are rendered for.
+        explanation: Result of `Film.explain`.
+        hints: Hints by number of attempts left, from 0 to the number of
+               attempts in a round.
+
+    """
+
+    film: Film
+    explanation: str
+    hints: Tuple[str, ...]
+
+
+class FilmTextsIndex:
+    """Pre-rendered texts of all films of a catalogue.
+
+    Handlers send the same texts for a film in every round, so they are
+    built once with the catalogue and dropped together with it on reload.
+
+    Properties:
+        attempts: Number of attempts in a round.
+
+    """
+
+    attempts: int
+
+    def __init__(self, films: Iterable[Film], attempts: int) -> None:
+        self.attempts = attempts
+        self._texts: Dict[int, FilmTexts] = {
+            film._id: FilmTexts(
+                film,
+                film.explain(),
+                tuple(format_hint(film, left, attempts) for left in range(attempts + 1)),
+            )
+            for film in films
+        }
+
+    def explain(self, film: Film) -> str:
+        """Returns the explanation of a film, rendering it if the film is not from this catalogue."""
+        texts = self._texts.get(film._id)
+        if texts is None or texts.film is not film:
+            return film.explain()
+        return texts.explanation
+
+    def hint(self, film: Film, attempts_left: int) -> str:
+        """Returns a hint for a film when the player has `attempts_left` attempts."""
+        texts = self._texts.get(film._id)
+        if texts is None or texts.film is not film or not 0 <= attempts_left <= self.attempts:
+            return format_hint(film, attempts_left, self.attempts)
+        return texts.hints[attempts_left]
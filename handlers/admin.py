@@ -0,0 +1,25 @@
+from aiogram import F, Router
+from aiogram.filters import Command
+from aiogram.types import Message
+
+from config.config import ADMIN_IDS
+from game.reload import CatalogueReloader
+from lexicon.lexicon_ru import LEXICON_RU
+from services.outbox import Outbox
+
+
+async def process_reload_command(message: Message, reloader: CatalogueReloader, outbox: Outbox):
+    """Asks all bot workers to reload the films catalogue."""
+
+    await reloader.request_reload()
+    outbox.send_message(message.chat.id, LEXICON_RU["/reload"])
+
+
+def create_router() -> Router:
+    """Creates a router handling admin commands."""
+
+    router = Router()
+    router.message.filter(F.from_user.id.in_(ADMIN_IDS))
+
+    router.message.register(process_reload_command, Command(commands="reload"))
+    return router
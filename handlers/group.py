@@ -0,0 +1,78 @@
+from aiogram import F, Router, html
+from aiogram.enums import ChatType
+from aiogram.filters import Command
+from aiogram.types import Message
+
+from game.game import GuessFilm
+from game.group import GroupResult, GroupRounds
+from game.leaderboard import Leaderboard
+from lexicon.lexicon_ru import LEXICON_RU
+from services.image_cache import ImageCache
+from services.outbox import Outbox, Priority
+
+
+async def process_group_play_command(
+    message: Message,
+    group_rounds: GroupRounds,
+    image_cache: ImageCache,
+    outbox: Outbox,
+):
+    """Starts a round in a group chat, all members guess the same film."""
+
+    film = await group_rounds.play(message.chat.id)
+    if film is None:
+        outbox.send_message(message.chat.id, LEXICON_RU["group_round_running"])
+        return
+
+    photo = await image_cache.get_photo(film)
+    caption = LEXICON_RU["group_round"].format(seconds=round(group_rounds.duration))
+    sent = await outbox.send_photo(message.chat.id, photo, Priority.ROUND, caption=caption)
+    await image_cache.remember(film, sent)
+
+
+async def process_group_answer(
+    message: Message,
+    game: GuessFilm,
+    group_rounds: GroupRounds,
+    leaderboard: Leaderboard,
+    outbox: Outbox,
+):
+    """Checks an answer of a group member; only the first correct answer gets a reply.
+
+    Other messages of the chat are ignored, so the bot doesn't flood it.
+    """
+
+    if not message.text:
+        return
+
+    result = await group_rounds.guess(message.chat.id, message.from_user.id, message.text)
+    if result is None:
+        return
+
+    name = html.quote(message.from_user.full_name)
+    text = LEXICON_RU["group_win"].format(name=name, score=result.scores[result.winner_id])
+    if result.film is not None:
+        text += "\n\n" + game.explain(result.film)
+    outbox.send_message(message.chat.id, text, Priority.ROUND, reply_to_message_id=message.message_id)
+    # Winners are shown in the ranking by name.
+    await leaderboard.set_name(message.from_user.id, message.from_user.full_name)
+
+
+async def announce_timeout(outbox: Outbox, game: GuessFilm, chat_id: int, result: GroupResult) -> None:
+    """Tells a group chat that nobody has guessed the film in time."""
+
+    text = LEXICON_RU["group_timeout"]
+    if result.film is not None:
+        text += "\n\n" + game.explain(result.film)
+    outbox.send_message(chat_id, text, Priority.ROUND)
+
+
+def create_router() -> Router:
+    """Creates a router handling group chats."""
+
+    router = Router()
+    router.message.filter(F.chat.type.in_({ChatType.GROUP, ChatType.SUPERGROUP}))
+
+    router.message.register(process_group_play_command, Command(commands="play"))
+    router.message.register(process_group_answer, ~F.text.startswith("/"))
+    return router
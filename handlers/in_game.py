@@ -3,18 +3,15 @@ from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.types import Message
 
-from game.game import GuessFilm
+from game.game import GuessFilm, RoundNotFound
 from fsm.states import FSMFillForm
-from keyboards.reply_keyboards import create_reply_keyboard
+from keyboards.reply_keyboards import MAIN_KEYBOARD
 from lexicon.lexicon_ru import LEXICON_RU
+from services.image_cache import ImageCache
+from services.outbox import Outbox, Priority
 
 
-router = Router()
-router.message.filter(StateFilter(FSMFillForm.in_game_state))
-
-
-@router.message(Command(commands="surrender"))
-async def process_surrender_command(message: Message, game: GuessFilm, state: FSMContext):
+async def process_surrender_command(message: Message, game: GuessFilm, outbox: Outbox, state: FSMContext):
     """Process the surrender command for the film guessing game.
 
     This function processes the surrender command from the user during a round
@@ -23,16 +20,18 @@ async def process_surrender_command(message: Message, game: GuessFilm, state: FS
     and updates the user's statistics in the database.
     """
 
-    player = game.get_player(message.from_user.id)
-    keyboard = create_reply_keyboard("/play", "/stat")
+    player = await game.get_player(message.from_user.id)
 
-    film = game.surrender(player)
-    await message.answer(film.explain(), reply_markup=keyboard)
+    try:
+        film = await game.surrender(player)
+    except RoundNotFound:
+        outbox.send_message(message.chat.id, LEXICON_RU["no_round"], Priority.ROUND, reply_markup=MAIN_KEYBOARD)
+    else:
+        outbox.send_message(message.chat.id, game.explain(film), Priority.ROUND, reply_markup=MAIN_KEYBOARD)
     await state.clear()
 
 
-@router.message(Command(commands="cancel"))
-async def process_cancel_command(message: Message, game: GuessFilm, state: FSMContext):
+async def process_cancel_command(message: Message, game: GuessFilm, outbox: Outbox, state: FSMContext):
     """Process the cancel command for the film guessing game.
 
     This function processes the cancel command from the user during a round of
@@ -41,34 +40,60 @@ async def process_cancel_command(message: Message, game: GuessFilm, state: FSMCo
     have left the game.
     """
 
-    player = game.get_player(message.from_user.id)
-    keyboard = create_reply_keyboard("/play", "/stat")
+    player = await game.get_player(message.from_user.id)
 
-    game.cancel(player)
-    await message.answer(
-        LEXICON_RU["/cancel"],
-        reply_markup=keyboard,
-    )
+    await game.cancel(player)
+    outbox.send_message(message.chat.id, LEXICON_RU["/cancel"], Priority.ROUND, reply_markup=MAIN_KEYBOARD)
     await state.clear()
 
 
-@router.message(~Command(commands=["start", "stat", "play", "help"]))
-async def process_film_answer(message: Message, game: GuessFilm, state: FSMContext):
+async def process_film_answer(
+    message: Message,
+    game: GuessFilm,
+    image_cache: ImageCache,
+    outbox: Outbox,
+    state: FSMContext,
+):
     """Process a user's answer to a film in the current game.
 
     Validates an answer. Gets a result from the game and sends a result message
     to the user. The result message has either gussed film infomation or
-    hints for guessing.
+    hints for guessing; a hint comes with a clearer image of the film.
     """
 
     answer = message.text
-    player = game.get_player(message.from_user.id)
+    player = await game.get_player(message.from_user.id)
 
-    msg, film = game.guess(player, answer)
+    try:
+        msg, film = await game.guess(player, answer)
+    except RoundNotFound:
+        outbox.send_message(message.chat.id, LEXICON_RU["no_round"], Priority.ROUND, reply_markup=MAIN_KEYBOARD)
+        await state.clear()
+        return
 
     if film:
-        await message.answer(LEXICON_RU[msg])
-        await message.answer(film.explain(), reply_markup=create_reply_keyboard("/play", "/stat"))
+        # Both texts are merged into one message by the outbox.
+        outbox.send_message(message.chat.id, LEXICON_RU[msg], Priority.ROUND)
+        outbox.send_message(message.chat.id, game.explain(film), Priority.ROUND, reply_markup=MAIN_KEYBOARD)
         await state.clear()
     else:
-        await message.answer(msg)
+        film = game.catalogue.get(player.current_film)
+        photo = await image_cache.get_photo(film, player.attempts) if film else None
+        if photo is None:
+            outbox.send_message(message.chat.id, msg, Priority.ROUND)
+            return
+
+        sent = await outbox.send_photo(message.chat.id, photo, Priority.ROUND, caption=msg)
+        await image_cache.remember(film, sent, player.attempts)
+
+
+def create_router() -> Router:
+    """Creates a router handling a round in a private chat."""
+
+    router = Router()
+    router.message.filter(StateFilter(FSMFillForm.in_game_state))
+
+    router.message.register(process_surrender_command, Command(commands="surrender"))
+    router.message.register(process_cancel_command, Command(commands="cancel"))
+    router.message.register(process_film_answer, ~Command(commands=["start", "stat", "play", "help", "top", "rank"]))
+    return router
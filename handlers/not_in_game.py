@@ -1,52 +1,66 @@
-from aiogram import Router
+from aiogram import Router, html
 from aiogram.filters import Command, CommandStart, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import default_state
-from aiogram.types import Message, ReplyKeyboardRemove
+from aiogram.types import Message
 
-from database.models import Player
+from config.config import NUMBER_OF_ATTEMPTS
 from game.game import GuessFilm
+from game.leaderboard import Leaderboard
 from fsm.states import FSMFillForm
-from keyboards.reply_keyboards import create_reply_keyboard
+from keyboards.reply_keyboards import MAIN_KEYBOARD, REMOVE_KEYBOARD
 from lexicon.lexicon_ru import LEXICON_RU
+from services.image_cache import ImageCache
+from services.outbox import Outbox, Priority
 
 
-router = Router()
-router.message.filter(StateFilter(default_state))
+TOP_SIZE = 10
 
 
-@router.message(CommandStart())
-async def process_start_command(message: Message, game: GuessFilm):
+async def process_start_command(message: Message, game: GuessFilm, leaderboard: Leaderboard, outbox: Outbox):
     """Process the start command for the film guessing game.
 
     This function processes the start command from the user, sends a welcome
     message and information about the game, and creates a new player in
     the database.
     """
-    
-    keyboard = create_reply_keyboard('/play', '/stat')
-    await message.answer(LEXICON_RU["/start"], reply_markup=keyboard)
 
-    player = Player(_id=message.from_user.id)
-    game.players_dao.create(player)
+    outbox.send_message(message.chat.id, LEXICON_RU["/start"], reply_markup=MAIN_KEYBOARD)
 
+    await game.get_player(message.from_user.id)
+    await leaderboard.set_name(message.from_user.id, message.from_user.full_name)
 
-@router.message(Command(commands="play"))
-async def process_play_command(message: Message, game: GuessFilm, state: FSMContext):
+
+async def process_play_command(
+    message: Message,
+    game: GuessFilm,
+    image_cache: ImageCache,
+    outbox: Outbox,
+    state: FSMContext,
+):
     """Process the play command for the film guessing game.
 
     This function starts a new round of the game. The function retrieves
     the next film from the game memory and sends it to the user for guessing.
+    The image is blurred and gets clearer with every wrong answer; the
+    original one is sent until the blurred variants are rendered. Every
+    image is uploaded only once, later rounds reuse its `file_id`.
     """
 
-    film = game.play(message.from_user.id)
+    film = await game.play(message.from_user.id)
+
+    attempts_left = NUMBER_OF_ATTEMPTS
+    photo = await image_cache.get_photo(film, attempts_left)
+    if photo is None:
+        attempts_left = None
+        photo = await image_cache.get_photo(film)
 
-    await message.answer_photo(photo=film.get_image_file(), reply_markup=ReplyKeyboardRemove())
+    sent = await outbox.send_photo(message.chat.id, photo, Priority.ROUND, reply_markup=REMOVE_KEYBOARD)
+    await image_cache.remember(film, sent, attempts_left)
     await state.set_state(FSMFillForm.in_game_state)
 
 
-@router.message(Command(commands="stat"))
-async def process_stat_command(message: Message, game: GuessFilm):
+async def process_stat_command(message: Message, game: GuessFilm, outbox: Outbox):
     """Handles the stat command, which retrieves the statistics of the player.
 
     The statistics include:
@@ -55,10 +69,56 @@ async def process_stat_command(message: Message, game: GuessFilm):
         Number of guessed films: the number of films that the player has
                                   successfully guessed.
     """
-    player = game.get_player(message.from_user.id)
+    player = await game.get_player(message.from_user.id)
     guessed_films_num = len(player.guessed_films)
 
-    await message.answer(
+    outbox.send_message(
+        message.chat.id,
         f"Очки: {player.score}\n"
-        f"Угаданных фильмов: {guessed_films_num}\n"
+        f"Угаданных фильмов: {guessed_films_num}\n",
     )
+
+
+async def process_top_command(message: Message, leaderboard: Leaderboard, outbox: Outbox):
+    """Handles the top command, which shows the best players by score.
+
+    Players are shown by their names, ids of players without a name are
+    masked, so the command doesn't reveal Telegram ids.
+    """
+    await leaderboard.set_name(message.from_user.id, message.from_user.full_name)
+    top = await leaderboard.top(TOP_SIZE)
+    if not top:
+        outbox.send_message(message.chat.id, LEXICON_RU["empty_top"])
+        return
+
+    names = await leaderboard.names([player_id for player_id, _ in top])
+    lines = []
+    for place, (player_id, score) in enumerate(top, 1):
+        name = html.quote(names[player_id]) if player_id in names else f"Игрок …{str(player_id)[-3:]}"
+        lines.append(f"{place}. {name}{' (вы)' if player_id == message.from_user.id else ''} - {score}")
+    outbox.send_message(message.chat.id, LEXICON_RU["/top"] + "\n".join(lines))
+
+
+async def process_rank_command(message: Message, leaderboard: Leaderboard, outbox: Outbox):
+    """Handles the rank command, which shows the place of the player in the ranking."""
+    await leaderboard.set_name(message.from_user.id, message.from_user.full_name)
+    rank = await leaderboard.rank(message.from_user.id)
+    if rank is None:
+        outbox.send_message(message.chat.id, LEXICON_RU["not_ranked"])
+        return
+
+    outbox.send_message(message.chat.id, f"Ваше место в рейтинге: {rank} из {await leaderboard.size()}")
+
+
+def create_router() -> Router:
+    """Creates a router handling a private chat between rounds."""
+
+    router = Router()
+    router.message.filter(StateFilter(default_state))
+
+    router.message.register(process_start_command, CommandStart())
+    router.message.register(process_play_command, Command(commands="play"))
+    router.message.register(process_stat_command, Command(commands="stat"))
+    router.message.register(process_top_command, Command(commands="top"))
+    router.message.register(process_rank_command, Command(commands="rank"))
+    return router
@@ -2,37 +2,42 @@ from aiogram import Router
 from aiogram.filters import Command
 from aiogram.types import Message
 
-from keyboards.reply_keyboards import create_reply_keyboard
+from keyboards.reply_keyboards import CANCEL_KEYBOARD
 from lexicon.lexicon_ru import LEXICON_RU
+from services.outbox import Outbox
 
 
-router = Router()
-
-
-@router.message(Command(commands="help"))
-async def process_help_command(message: Message):
+async def process_help_command(message: Message, outbox: Outbox):
     """Sends game rules and a list of commands."""
 
-    await message.answer(LEXICON_RU["/help"])
+    outbox.send_message(message.chat.id, LEXICON_RU["/help"])
 
 
-@router.message(Command(commands=["surrender", "cancel"]))
-async def warning_in_game_commands(message: Message):
+async def warning_in_game_commands(message: Message, outbox: Outbox):
     """Handler that triggers if user sends in-game command not in game"""
 
-    await message.answer(LEXICON_RU["in_game_command"])
+    outbox.send_message(message.chat.id, LEXICON_RU["in_game_command"])
 
 
-@router.message(Command(commands=["start", "stat", "play"]))
-async def warning_not_in_game_commands(message: Message):
+async def warning_not_in_game_commands(message: Message, outbox: Outbox):
     """Handler that triggers if user sends not-in-game command in game"""
 
-    keyboard = create_reply_keyboard("/cancel")
-    await message.answer(LEXICON_RU["not_in_game_command"], reply_markup=keyboard)
+    outbox.send_message(message.chat.id, LEXICON_RU["not_in_game_command"], reply_markup=CANCEL_KEYBOARD)
 
 
-@router.message()
-async def process_other_text_answers(message: Message):
+async def process_other_text_answers(message: Message, outbox: Outbox):
     """Handler that triggers if user sends any unexpected message"""
 
-    await message.answer(LEXICON_RU["other"])
+    outbox.send_message(message.chat.id, LEXICON_RU["other"])
+
+
+def create_router() -> Router:
+    """Creates a router handling messages no other router has handled."""
+
+    router = Router()
+
+    router.message.register(process_help_command, Command(commands="help"))
+    router.message.register(warning_in_game_commands, Command(commands=["surrender", "cancel"]))
+    router.message.register(warning_not_in_game_commands, Command(commands=["start", "stat", "play", "top", "rank"]))
+    router.message.register(process_other_text_answers)
+    return router
@@ -1,8 +1,8 @@
-from aiogram.types import InlineKeyboardMarkup, KeyboardButton
+from aiogram.types import KeyboardButton, ReplyKeyboardMarkup, ReplyKeyboardRemove
 from aiogram.utils.keyboard import ReplyKeyboardBuilder
 
 
-def create_reply_keyboard(*buttons: str) -> InlineKeyboardMarkup:
+def create_reply_keyboard(*buttons: str) -> ReplyKeyboardMarkup:
     """Creates reply keyboard using the passed args.
 
     Args:
@@ -16,3 +16,9 @@ def create_reply_keyboard(*buttons: str) -> InlineKeyboardMarkup:
     kb_builder.row(*[KeyboardButton(text=button) for button in buttons])
 
     return kb_builder.as_markup(resize_keyboard=True)
+
+
+# Keyboards are never changed after they are built, so handlers share them.
+MAIN_KEYBOARD = create_reply_keyboard("/play", "/stat")
+CANCEL_KEYBOARD = create_reply_keyboard("/cancel")
+REMOVE_KEYBOARD = ReplyKeyboardRemove()
@@ -7,22 +7,37 @@ LEXICON_RU: dict[str, str] = {
     "/help": (
         "Правила игры:\n\nЯ присылаю кадр из фильма, "
         "а вам нужно назвать его название.\n"
-        "Необходимо указать точное название фильма вне зависимости от регистра\n"
+        "Необходимо указать название фильма, регистр и знаки препинания не важны, "
+        "небольшие опечатки допускаются\n"
         "Пример ответа: Форрест Гамп\n\n"
         "Доступные команды вне игры:\n\n"
         "/play - начать играть (доступна только вне игры)\n"
-        "/stat - посмотреть статистику\n\n"
+        "/stat - посмотреть статистику\n"
+        "/top - лучшие игроки\n"
+        "/rank - ваше место в рейтинге\n\n"
         "Доступные команды в игре\n\n"
         "/sur - сдаться (доступна только в игре)\n"
         "/cancel - отменить игру (доступна только в игре)\n\n"
         "Давай сыграем?"
     ),
+    "/reload": "Каталог фильмов будет перезагружен.",
+    "/top": "Лучшие игроки:\n\n",
+    "empty_top": "В рейтинге пока никого нет. Сыграйте первым! /play",
+    "not_ranked": "Вы пока не в рейтинге. Сыграйте, чтобы попасть в него! /play",
     "/cancel": "Вы вышли из игры. Если захотите сыграть снова - напишите об этом. /play",
     "in_game_command": "Данная команда доступна только в игре. Мы сейчас с вами не играем. Хотите сыграть?",
     "not_in_game_command": "Данная команда доступна только вне игры. Мы сейчас играем. Хотите выйти?",
     "other": "Я играю только по правилам, введите /help, чтобы узнать правила.",
     "win": "Поздравляю, ты победил!",
     "lose": "К сожалению ты проиграл :(",
+    "no_round": "Этот раунд уже завершён. Хотите сыграть ещё? /play",
+    "throttled": "Слишком много сообщений. Подождите немного, лишние сообщения я пропущу.",
+    "overloaded": "Бот сейчас перегружен. Подождите немного и отправьте сообщение ещё раз.",
+    "starting": "Бот запускается, попробуйте ещё раз через минуту.",
+    "group_round": "Угадайте фильм! Первый правильный ответ получает очки, на раунд {seconds} секунд.",
+    "group_round_running": "Раунд уже идёт, сначала угадайте этот фильм.",
+    "group_win": "{name} угадал первым и получает {score} очков!",
+    "group_timeout": "Время вышло, никто не угадал фильм. Сыграем ещё? /play",
 }
 
 
@@ -32,4 +47,6 @@ LEXICON_COMMANDS_RU: dict[str, str] = {
     "/surrender": "Сдаться (доступно в игре)",
     "/cancel": "Выход из режима игры (доступно в игре)",
     "/stat": "Посмотреть статистику (доступно вне игры)",
+    "/top": "Лучшие игроки (доступно вне игры)",
+    "/rank": "Ваше место в рейтинге (доступно вне игры)",
 }
@@ -1,51 +1,78 @@
 import asyncio
 import logging
+
 from aiogram import Bot, Dispatcher
-from aiogram.client.default import DefaultBotProperties
-from aiogram.enums import ParseMode
-from aiogram.fsm.storage.redis import Redis, RedisStorage
-from pymongo.database import Database
+from aiogram.fsm.storage.redis import Redis
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 
-from config.config import BOT_TOKEN
-from database.database import get_database
-from game.game import GuessFilm
-from handlers import in_game, not_in_game, other
-from keyboards.set_menu import set_main_menu
+from config.config import (
+    METRICS_HOST,
+    METRICS_PORT,
+    REDIS_HOST,
+    REDIS_PORT,
+    RUN_MODE,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WORKERS,
+)
+from services.dispatcher import create_bot, create_dispatcher
+from services.metrics import start_metrics_server
+from services.preparation import connect_database
+from services.server import create_stop_event, serve_app, set_webhook, setup_logging
+from services.supervisor import run_sharded
 
 logger = logging.getLogger(__name__)
 
 
-async def main():
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(filename)s:%(lineno)d #%(levelname)-8s [%(asctime)s] - %(name)s - %(message)s",
-    )
+async def run_polling(bot: Bot, dp: Dispatcher):
+    """Receives updates with long polling until the process is stopped."""
+    await bot.delete_webhook(drop_pending_updates=True)
+    await dp.start_polling(bot)
 
-    logger.info("Starting bot")
 
-    redis = Redis(host='redis')
-    storage = RedisStorage(redis=redis)
+async def run_webhook(bot: Bot, dp: Dispatcher):
+    """Serves updates pushed by Telegram until SIGINT or SIGTERM is received.
 
-    bot: Bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    dp: Dispatcher = Dispatcher(storage=storage)
+    Several replicas can serve the same webhook URL behind a load balancer,
+    so a replica never deletes the webhook or drops pending updates.
+    """
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+    # The application cleanup triggers the dispatcher shutdown, which flushes players.
+    setup_application(app, dp, bot=bot)
 
-    database: Database = get_database()
-    game: GuessFilm = GuessFilm(database)
+    await set_webhook(bot, dp.resolve_used_update_types())
+    await serve_app(app, create_stop_event())
 
-    dp.workflow_data.update({"game": game})
 
-    dp.include_router(in_game.router)
-    dp.include_router(not_in_game.router)
-    dp.include_router(other.router)
+async def main():
+    setup_logging()
 
-    await set_main_menu(bot)
+    logger.info("Starting bot in %s mode with %d workers", RUN_MODE, WORKERS)
 
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    bot: Bot = create_bot()
+    metrics_runner = await start_metrics_server(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
+
+    if WORKERS > 1:
+        try:
+            await run_sharded(bot)
+        finally:
+            if metrics_runner is not None:
+                await metrics_runner.cleanup()
+        return
+
+    redis = Redis(host=REDIS_HOST, port=REDIS_PORT)
+    dp: Dispatcher = await create_dispatcher(redis, connect_database, bot)
 
-    data = game.players.values()
-    if data:
-        game.players_dao.save_many(data)
+    try:
+        if RUN_MODE == "webhook":
+            await run_webhook(bot, dp)
+        else:
+            await run_polling(bot, dp)
+    finally:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,57 @@
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import Response, TelegramMethod
+from aiogram.types import TelegramObject
+
+from services.metrics import HANDLER_LATENCY, TELEGRAM_API_LATENCY
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Measures the time of handlers of a router.
+
+    Properties:
+        router_name: Value of the `router` label.
+
+    """
+
+    router_name: str
+
+    def __init__(self, router_name: str) -> None:
+        self.router_name = router_name
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = getattr(handler_object.callback, "__name__", "unknown") if handler_object else "unknown"
+
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            HANDLER_LATENCY.labels(self.router_name, name).observe(time.perf_counter() - start)
+
+
+class TelegramApiMetricsMiddleware(BaseRequestMiddleware):
+    """Measures the time of Bot API requests made by the bot session."""
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType,
+        bot: Bot,
+        method: TelegramMethod,
+    ) -> Response:
+        status = "error"
+        start = time.perf_counter()
+        try:
+            response = await make_request(bot, method)
+            status = "ok"
+            return response
+        finally:
+            TELEGRAM_API_LATENCY.labels(type(method).__name__, status).observe(time.perf_counter() - start)
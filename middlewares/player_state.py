@@ -0,0 +1,35 @@
+from typing import Any, Awaitable, Callable, Dict, cast
+
+from aiogram import Bot
+from aiogram.fsm.middleware import FSMContextMiddleware
+from aiogram.types import TelegramObject
+
+from fsm.storage import PlayerStateStorage
+
+
+class PlayerStateMiddleware(FSMContextMiddleware):
+    """Passes the FSM context to handlers like the aiogram one, with one call to Redis per update.
+
+    The state is loaded by a session of `PlayerStateStorage`, which also
+    loads the player of a private chat, and changes of the state made by
+    handlers are written together when the update is handled. The
+    middleware replaces the FSM middleware of the dispatcher.
+    """
+
+    storage: PlayerStateStorage
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        context = self.resolve_event_context(cast(Bot, data["bot"]), data)
+        data["fsm_storage"] = self.storage
+        if context is None:
+            return await handler(event, data)
+
+        async with self.events_isolation.lock(key=context.key):
+            async with self.storage.session(context.key) as raw_state:
+                data.update({"state": context, "raw_state": raw_state})
+                return await handler(event, data)
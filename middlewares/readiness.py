@@ -0,0 +1,50 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import Message, TelegramObject
+
+from lexicon.lexicon_ru import LEXICON_RU
+from services.readiness import Readiness
+
+
+class ReadinessMiddleware(BaseMiddleware):
+    """Holds updates until the game they need is ready.
+
+    The middleware is registered as an inner middleware of routers whose
+    handlers need the game. It passes the prepared dependencies to the
+    handlers, so updates received while the bot starts are handled as soon
+    as the game is ready. A user whose update waited longer than `timeout`
+    seconds is asked to retry.
+
+    Properties:
+        readiness: Dependencies prepared in the background.
+        timeout: Number of seconds an update waits for the dependencies.
+
+    """
+
+    readiness: Readiness
+    timeout: float
+
+    def __init__(self, readiness: Readiness, timeout: float) -> None:
+        self.readiness = readiness
+        self.timeout = timeout
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        dependencies = self.readiness.data
+        if dependencies is None:
+            try:
+                dependencies = await self.readiness.wait(self.timeout)
+            except asyncio.TimeoutError:
+                if isinstance(event, Message):
+                    data["outbox"].send_message(event.chat.id, LEXICON_RU["starting"])
+                return None
+
+        # Updates fed before the game was ready don't have it in their data.
+        data.update(dependencies)
+        return await handler(event, data)
@@ -0,0 +1,178 @@
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, NamedTuple, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import Message, TelegramObject
+from redis.asyncio import Redis
+
+from lexicon.lexicon_ru import LEXICON_RU
+from services.metrics import THROTTLED_UPDATES
+
+logger = logging.getLogger(__name__)
+
+
+# KEYS: user bucket, global bucket.
+# ARGV: now, user rate, user burst, global rate, global burst; a rate of 0 means no limit.
+# Returns 1 if the update is allowed, 1 if the user should be warned and 1 if the global limit is exceeded.
+TOKEN_BUCKET_SCRIPT = """
+local now = tonumber(ARGV[1])
+
+local function available(key, rate, burst)
+    local bucket = redis.call('HMGET', key, 'tokens', 'updated')
+    local tokens = tonumber(bucket[1]) or burst
+    local updated = tonumber(bucket[2]) or now
+    return math.min(burst, tokens + math.max(0, now - updated) * rate)
+end
+
+local function take(key, tokens, rate, burst)
+    redis.call('HSET', key, 'tokens', tokens - 1, 'updated', now)
+    redis.call('HDEL', key, 'warned')
+    -- A full bucket is the same as a missing one.
+    redis.call('PEXPIRE', key, math.ceil(burst / rate * 1000))
+end
+
+local user_rate, user_burst = tonumber(ARGV[2]), tonumber(ARGV[3])
+local global_rate, global_burst = tonumber(ARGV[4]), tonumber(ARGV[5])
+local user_tokens, global_tokens
+
+if user_rate > 0 then
+    user_tokens = available(KEYS[1], user_rate, user_burst)
+    if user_tokens < 1 then
+        return {0, redis.call('HSETNX', KEYS[1], 'warned', 1), 0}
+    end
+end
+if global_rate > 0 then
+    global_tokens = available(KEYS[2], global_rate, global_burst)
+    if global_tokens < 1 then
+        -- The user is warned once for a series too; the flag lives in the user's bucket.
+        local warn = redis.call('HSETNX', KEYS[1], 'warned', 1)
+        if redis.call('PTTL', KEYS[1]) < 0 then
+            redis.call('PEXPIRE', KEYS[1], math.ceil(global_burst / global_rate * 1000))
+        end
+        return {0, warn, 1}
+    end
+end
+
+if user_rate > 0 then
+    take(KEYS[1], user_tokens, user_rate, user_burst)
+end
+if global_rate > 0 then
+    take(KEYS[2], global_tokens, global_rate, global_burst)
+end
+return {1, 0, 0}
+"""
+
+
+class RateLimit(NamedTuple):
+    """Token bucket parameters: `rate` tokens per second, up to `burst` tokens."""
+
+    rate: float
+    burst: int
+
+
+class Acquired(NamedTuple):
+    """Result of taking a token.
+
+    Properties:
+        allowed: Whether the request is allowed.
+        warn: Whether it's the first request rejected since the last allowed one.
+        global_limit: Whether the request is rejected by the global limit.
+
+    """
+
+    allowed: bool
+    warn: bool
+    global_limit: bool
+
+
+class RateLimiter:
+    """Token bucket rate limiter stored in Redis and shared by all bot workers.
+
+    Every key has its own bucket; besides, all requests take a token from
+    the global bucket. Buckets are refilled lazily when they are checked
+    and expire when they are full, so idle users don't occupy memory.
+
+    Properties:
+        redis: Redis client.
+        global_limit: Limit of requests for all keys together, `None` for no limit.
+
+    """
+
+    redis: Redis
+    global_limit: Optional[RateLimit]
+
+    key_prefix: str = "throttle"
+
+    def __init__(self, redis: Redis, global_limit: Optional[RateLimit] = None) -> None:
+        self.redis = redis
+        self.global_limit = global_limit
+        self._acquire = redis.register_script(TOKEN_BUCKET_SCRIPT)
+
+    async def acquire(self, key: str, limit: Optional[RateLimit]) -> Acquired:
+        """Takes a token for a request.
+
+        Args:
+            key: Key of the bucket, e.g. an id of a user.
+            limit: Limit of requests for the key, `None` for no limit.
+        """
+        limit = limit or RateLimit(0, 0)
+        global_limit = self.global_limit or RateLimit(0, 0)
+
+        allowed, warn, global_limited = await self._acquire(
+            keys=[f"{self.key_prefix}:{key}", f"{self.key_prefix}:global"],
+            args=[time.time(), limit.rate, limit.burst, global_limit.rate, global_limit.burst],
+        )
+        return Acquired(bool(allowed), bool(warn), bool(global_limited))
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Drops updates of users who send them too often.
+
+    The middleware is registered as an inner middleware of a router, so it
+    runs only for updates matched by the router's handlers and applies the
+    router's policy. Excess updates never reach the handlers; a user gets
+    one warning for a series of dropped updates instead of an answer to each.
+    Updates dropped by the global limit are counted separately and logged,
+    since they mean the whole bot is overloaded.
+
+    Properties:
+        limiter: Rate limiter shared by all routers.
+        name: Name of the policy, separates buckets of different routers.
+        limit: Limit of updates from one user.
+
+    """
+
+    limiter: RateLimiter
+    name: str
+    limit: Optional[RateLimit]
+
+    def __init__(self, limiter: RateLimiter, name: str, limit: Optional[RateLimit]) -> None:
+        self.limiter = limiter
+        self.name = name
+        self.limit = limit
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        acquired = await self.limiter.acquire(f"{self.name}:{user.id}", self.limit)
+        if acquired.allowed:
+            return await handler(event, data)
+
+        THROTTLED_UPDATES.labels(self.name, "global" if acquired.global_limit else "user").inc()
+        if not acquired.warn:
+            return None
+
+        if acquired.global_limit:
+            logger.warning("The global limit of updates is exceeded, dropping updates of user %s", user.id)
+        if isinstance(event, Message):
+            text = LEXICON_RU["overloaded" if acquired.global_limit else "throttled"]
+            data["outbox"].send_message(event.chat.id, text)
+        return None
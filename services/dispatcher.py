@@ -0,0 +1,219 @@
+"""Assembly of the bot: the dispatcher with its routers, middlewares and hooks."""
+
+import functools
+import logging
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import Bot, Dispatcher, Router
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.enums import ParseMode
+from aiogram.fsm.storage.redis import Redis
+
+from config.config import (
+    BOT_TOKEN,
+    FAST_START,
+    IMAGES_CHECK_INTERVAL,
+    IMAGE_VARIANTS_PATH,
+    IMAGE_VARIANTS_WORKERS,
+    NUMBER_OF_ATTEMPTS,
+    OUTBOX_CHAT_INTERVAL,
+    OUTBOX_GLOBAL_RATE,
+    PLAYERS_REDIS_TTL,
+    PLAYERS_STORE,
+    STARTUP_WAIT_TIMEOUT,
+    TELEGRAM_API_SERVER,
+    THROTTLE_GLOBAL,
+    THROTTLE_GROUP,
+    THROTTLE_IN_GAME,
+    THROTTLE_NOT_IN_GAME,
+    THROTTLE_OTHER,
+)
+from fsm.storage import PlayerStateStorage
+from game.leaderboard import Leaderboard
+from handlers import admin, group, in_game, not_in_game, other
+from keyboards.set_menu import set_main_menu
+from middlewares.metrics import HandlerMetricsMiddleware, TelegramApiMetricsMiddleware
+from middlewares.player_state import PlayerStateMiddleware
+from middlewares.readiness import ReadinessMiddleware
+from middlewares.throttling import RateLimit, RateLimiter, ThrottlingMiddleware
+from services.image_cache import ImageCache
+from services.image_variants import ImageVariants
+from services.outbox import Outbox
+from services.preparation import prepare_game
+from services.readiness import Readiness
+
+if TYPE_CHECKING:
+    from pymongo.asynchronous.database import AsyncDatabase
+
+logger = logging.getLogger(__name__)
+
+
+async def on_startup(
+    bot: Bot,
+    dispatcher: Dispatcher,
+    outbox: Outbox,
+    image_cache: ImageCache,
+    readiness: Readiness,
+    prepare: Callable[[], Awaitable[Dict[str, Any]]],
+    primary: bool,
+):
+    """Prepares the bot before it starts receiving updates.
+
+    With a fast start the game is prepared in the background and updates
+    are received right away. With several workers, tasks done once per bot
+    run only in the primary one.
+    """
+    outbox.start()
+    await image_cache.start()
+
+    if primary:
+        await set_main_menu(bot)
+
+    if FAST_START:
+        readiness.start(prepare)
+    else:
+        await readiness.prepare(prepare)
+
+
+async def on_shutdown(outbox: Outbox, readiness: Readiness, image_cache: ImageCache):
+    """Saves all changed players and sends queued messages before the bot stops.
+
+    Players go first: the container may be killed before all messages are sent.
+    """
+    await readiness.stop()
+    await image_cache.stop()
+    if image_cache.variants is not None:
+        image_cache.variants.stop()
+
+    if readiness.data is not None:
+        await readiness.data["reloader"].stop()
+        # Rounds which time out later are finished on the next answer.
+        await readiness.data["group_rounds"].wheel.stop()
+
+        logger.info("Saving players")
+        game = readiness.data["game"]
+        await game.stats.stop()
+        await game.players.stop()
+
+    await outbox.stop()
+
+
+def create_routers() -> Dict[str, Router]:
+    """Creates routers of all handlers by name, in the order they are matched.
+
+    A router can be attached to one dispatcher only, so every dispatcher
+    gets new routers with their own middlewares.
+    """
+    # Group chats have their own rounds, so /play and answers there never reach the single-player routers.
+    return {
+        "group": group.create_router(),
+        "admin": admin.create_router(),
+        "in_game": in_game.create_router(),
+        "not_in_game": not_in_game.create_router(),
+        "other": other.create_router(),
+    }
+
+
+def setup_middlewares(routers: Dict[str, Router], redis: Redis, readiness: Readiness) -> None:
+    """Measures handlers and limits updates handled by the game routers.
+
+    Admin commands are not limited. Throttling goes first, so dropped
+    updates are not counted as handled and don't wait for the game.
+    Handlers of the `other` router don't need the game and answer
+    while it's being prepared.
+    """
+    limiter = RateLimiter(redis, RateLimit(*THROTTLE_GLOBAL) if THROTTLE_GLOBAL else None)
+    readiness_middleware = ReadinessMiddleware(readiness, STARTUP_WAIT_TIMEOUT)
+
+    for name, limit in (
+        ("in_game", THROTTLE_IN_GAME),
+        ("not_in_game", THROTTLE_NOT_IN_GAME),
+        ("other", THROTTLE_OTHER),
+        ("group", THROTTLE_GROUP),
+    ):
+        router = routers[name]
+        router.message.middleware(ThrottlingMiddleware(limiter, name, RateLimit(*limit) if limit else None))
+        if name != "other":
+            router.message.middleware(readiness_middleware)
+        router.message.middleware(HandlerMetricsMiddleware(name))
+    routers["admin"].message.middleware(readiness_middleware)
+    routers["admin"].message.middleware(HandlerMetricsMiddleware("admin"))
+
+
+def create_bot() -> Bot:
+    """Creates a bot which talks to the configured Bot API server."""
+    session: Optional[AiohttpSession] = None
+    if TELEGRAM_API_SERVER:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_SERVER))
+
+    bot = Bot(token=BOT_TOKEN, session=session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    bot.session.middleware(TelegramApiMetricsMiddleware())
+    return bot
+
+
+def used_update_types() -> List[str]:
+    """Returns types of updates handled by the routers."""
+    return sorted(
+        {
+            update_type
+            for router in create_routers().values()
+            for update_type in router.resolve_used_update_types()
+        }
+    )
+
+
+async def create_dispatcher(
+    redis: Redis,
+    connect_database: Callable[[], "AsyncDatabase"],
+    bot: Bot,
+    worker_index: int = 0,
+    workers: int = 1,
+) -> Dispatcher:
+    """Creates a dispatcher with all routers, middlewares and hooks.
+
+    The game is prepared by the startup hook, see `prepare_game`.
+
+    Args:
+        redis: Redis client for FSM states and shared caches.
+        connect_database: A function returning the async Database object,
+                          called in a worker thread.
+        bot: Bot instance sending messages.
+        worker_index: Index of the worker process in the sharded mode.
+        workers: Number of worker processes sharing the outgoing messages limit;
+                 score changes of players are sent to the worker owning them.
+
+    Returns:
+        A dispatcher ready to receive updates.
+    """
+    # The state of a private chat is loaded with its player, so the dispatcher gets our FSM middleware.
+    storage = PlayerStateStorage(redis, preload_players=PLAYERS_STORE == "redis", player_ttl=PLAYERS_REDIS_TTL)
+    dp = Dispatcher(storage=storage, disable_fsm=True)
+    dp.fsm = PlayerStateMiddleware(storage, dp.fsm.events_isolation, dp.fsm.strategy)
+    dp.update.outer_middleware(dp.fsm)
+    readiness = Readiness()
+    variants = None
+    if IMAGE_VARIANTS_PATH:
+        variants = ImageVariants(IMAGE_VARIANTS_PATH, NUMBER_OF_ATTEMPTS, IMAGE_VARIANTS_WORKERS)
+
+    dp.workflow_data.update(
+        {
+            "leaderboard": Leaderboard(redis),
+            "image_cache": ImageCache(redis, variants, IMAGES_CHECK_INTERVAL),
+            "outbox": Outbox(bot, OUTBOX_GLOBAL_RATE / workers, OUTBOX_CHAT_INTERVAL),
+            "readiness": readiness,
+            "prepare": functools.partial(prepare_game, dp, redis, connect_database, worker_index, workers),
+            "primary": worker_index == 0,
+        }
+    )
+
+    routers = create_routers()
+    setup_middlewares(routers, redis, readiness)
+    for router in routers.values():
+        dp.include_router(router)
+
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+
+    return dp
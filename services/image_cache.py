@@ -0,0 +1,221 @@
+import asyncio
+import hashlib
+import logging
+import os
+from typing import Dict, Iterable, Optional, Tuple, Union
+
+from aiogram.types import FSInputFile, Message
+from redis.asyncio import Redis
+
+from database.models import Film
+from services.image_variants import ImageVariants
+from services.outbox import Outbox, Priority
+
+logger = logging.getLogger(__name__)
+
+
+class ImageCache:
+    """Cache of Telegram `file_id`s of uploaded film images.
+
+    The first round with a film uploads its image from disk; the `file_id`
+    returned by Telegram is stored in Redis and reused by later rounds, so an
+    image is uploaded only once. Keys contain a hash of the image file, so
+    a replaced image is uploaded again. Hashes are kept in memory with the
+    modification time and the size of the file; rounds don't touch the
+    disk, a background task checks the files every `check_interval` seconds
+    and forgets hashes of changed ones. Rendered variants of images shown
+    while a round goes on are cached the same way.
+
+    Properties:
+        redis: Redis client for persisting file ids.
+        variants: Rendered variants of images, `None` if they are disabled.
+        check_interval: Number of seconds between checks of image files,
+                        0 disables the checks.
+        key_prefix: Prefix of Redis keys.
+
+    """
+
+    redis: Redis
+    variants: Optional[ImageVariants]
+    check_interval: float
+    key_prefix: str = "film_image"
+
+    def __init__(self, redis: Redis, variants: Optional[ImageVariants] = None, check_interval: float = 0) -> None:
+        self.redis = redis
+        self.variants = variants
+        self.check_interval = check_interval
+        self._task: Optional[asyncio.Task] = None
+        # (film id, attempts left) -> (image hash, file id)
+        self._file_ids: Dict[Tuple[int, Optional[int]], Tuple[str, str]] = {}
+        # film id -> ((path, modification time, size) of the image file, image hash)
+        self._hashes: Dict[int, Tuple[Tuple[str, int, int], str]] = {}
+
+    async def start(self) -> None:
+        if self._task is None and self.check_interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def check_files(self) -> int:
+        """Forgets hashes of image files changed since they were computed.
+
+        Returns:
+            Number of forgotten hashes.
+        """
+        hashes = dict(self._hashes)
+        changed = await asyncio.to_thread(
+            lambda: [film_id for film_id, (signature, _) in hashes.items() if self._stat(signature[0]) != signature]
+        )
+        for film_id in changed:
+            # The hash may have been computed again meanwhile.
+            if self._hashes.get(film_id) == hashes[film_id]:
+                del self._hashes[film_id]
+        return len(changed)
+
+    def reset(self, *args) -> None:
+        """Forgets file ids and hashes kept in memory, e.g. after the catalogue reload.
+
+        Ids stored in Redis are kept, they are keyed by image hashes.
+        """
+        self._file_ids.clear()
+        self._hashes.clear()
+
+    async def get_photo(self, film: Film, attempts_left: Optional[int] = None) -> Union[str, FSInputFile, None]:
+        """Returns a cached `file_id` of the film image or the image file to upload.
+
+        Args:
+            film: A film to get the image for.
+            attempts_left: Number of attempts the player has left for the
+                           variant revealed accordingly, `None` for the
+                           original image.
+
+        Returns:
+            A `file_id` string if the image was uploaded before, the image
+            file otherwise or `None` if the film has no image or the variant
+            is not rendered yet.
+        """
+        image_hash = await self._get_hash(film, attempts_left)
+        if image_hash is None:
+            return None
+
+        cached = self._file_ids.get((film._id, attempts_left))
+        if cached and cached[0] == image_hash:
+            return cached[1]
+
+        file_id = await self.redis.get(self._key(film._id, image_hash))
+        if file_id:
+            file_id = file_id.decode() if isinstance(file_id, bytes) else file_id
+            self._file_ids[(film._id, attempts_left)] = (image_hash, file_id)
+            return file_id
+
+        if attempts_left is not None:
+            return FSInputFile(self.variants.path(film, attempts_left))
+        return await asyncio.to_thread(film.get_image_file)
+
+    async def remember(self, film: Film, message: Message, attempts_left: Optional[int] = None) -> None:
+        """Stores the `file_id` of the film image sent with the message.
+
+        Args:
+            film: A film whose image was sent.
+            message: The message returned by Telegram after sending the photo.
+            attempts_left: The variant of the image passed to `get_photo`.
+        """
+        if not message.photo:
+            return
+
+        image_hash = await self._get_hash(film, attempts_left)
+        cached = self._file_ids.get((film._id, attempts_left))
+        if image_hash is None or (cached and cached[0] == image_hash):
+            return
+
+        # The largest size is the last one.
+        file_id = message.photo[-1].file_id
+        self._file_ids[(film._id, attempts_left)] = (image_hash, file_id)
+        await self.redis.set(self._key(film._id, image_hash), file_id)
+
+    async def warm_up(self, outbox: Outbox, chat_id: int, films: Iterable[Film]) -> int:
+        """Uploads images which have no cached `file_id` yet.
+
+        Each image is sent to a service chat and the message is deleted right
+        after the `file_id` is stored. Uploads have the lowest priority in
+        the outbox, so they don't delay replies to players.
+
+        Args:
+            outbox: Outbox to upload images with.
+            chat_id: Id of the service chat.
+            films: Films to upload images of.
+
+        Returns:
+            Number of uploaded images.
+        """
+        uploaded = 0
+
+        for film in films:
+            photo = await self.get_photo(film)
+            if not isinstance(photo, FSInputFile):
+                continue
+
+            message = await outbox.send_photo(chat_id, photo, Priority.BACKGROUND, disable_notification=True)
+            await self.remember(film, message)
+            await outbox.bot.delete_message(chat_id, message.message_id)
+            uploaded += 1
+
+        logger.info("Uploaded %d film images to warm up the cache", uploaded)
+        return uploaded
+
+    async def _get_hash(self, film: Film, attempts_left: Optional[int] = None) -> Optional[str]:
+        if attempts_left is not None:
+            # Names of variants contain the hash of the original image.
+            path = self.variants.path(film, attempts_left) if self.variants else None
+            return os.path.splitext(os.path.basename(path))[0] if path else None
+
+        cached = self._hashes.get(film._id)
+        if cached is None:
+            cached = await asyncio.to_thread(self._hash_image, film)
+            if cached is None:
+                return None
+            self._hashes[film._id] = cached
+
+        return cached[1]
+
+    def _key(self, film_id: int, image_hash: str) -> str:
+        return f"{self.key_prefix}:{film_id}:{image_hash}"
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                changed = await self.check_files()
+            except Exception:
+                logger.exception("Failed to check film images, retrying in %s seconds", self.check_interval)
+                continue
+
+            if changed:
+                logger.info("Images of %d films have changed", changed)
+
+    @staticmethod
+    def _stat(path: str) -> Optional[Tuple[str, int, int]]:
+        """Returns the path, modification time and size of a file or `None` if it doesn't exist."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return path, stat.st_mtime_ns, stat.st_size
+
+    @classmethod
+    def _hash_image(cls, film: Film) -> Optional[Tuple[Tuple[str, int, int], str]]:
+        """Returns the signature and the hash of the film image or `None` if it doesn't exist."""
+        path = film.get_image_path()
+        signature = cls._stat(path) if path else None
+        if signature is None:
+            return None
+
+        with open(path, "rb") as image_file:
+            return signature, hashlib.sha1(image_file.read()).hexdigest()
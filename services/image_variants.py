@@ -0,0 +1,166 @@
+"""Film images revealed gradually during a round.
+
+The first image of a round is heavily blurred and every wrong answer
+reveals more of it. Variants are rendered with Pillow in worker processes
+when the bot starts and cached on disk, so rounds never process images.
+They can also be rendered before deploying:
+
+    python -m services.image_variants
+
+"""
+
+import argparse
+import asyncio
+import hashlib
+import importlib.util
+import io
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from database.models import Film
+
+logger = logging.getLogger(__name__)
+
+# Changes of the rendering must change the version, so cached variants are rendered again.
+VERSION = 1
+
+
+def variant_name(source_hash: str, attempts_left: int, attempts: int) -> str:
+    """Returns the file name of a variant without the extension."""
+    return f"{source_hash}-v{VERSION}-{attempts_left}of{attempts}"
+
+
+def render_variants(source_path: str, directory: str, attempts: int, max_blur: float = 0.05) -> Tuple[str, ...]:
+    """Renders variants of an image for every number of attempts left, runs in a worker process.
+
+    The blur radius is `max_blur` of the image size with all attempts left
+    and decreases linearly with every used attempt. Variants rendered
+    before are not rendered again.
+
+    Returns:
+        Paths of the variants by number of attempts left starting from 1.
+    """
+    from PIL import Image, ImageFilter
+
+    with open(source_path, "rb") as source_file:
+        data = source_file.read()
+    source_hash = hashlib.sha1(data).hexdigest()
+
+    paths = []
+    image = None
+    for attempts_left in range(1, attempts + 1):
+        path = os.path.join(directory, variant_name(source_hash, attempts_left, attempts) + ".jpg")
+        paths.append(path)
+        if os.path.exists(path):
+            continue
+
+        if image is None:
+            image = Image.open(io.BytesIO(data)).convert("RGB")
+        radius = max(image.size) * max_blur * attempts_left / attempts
+
+        # Another worker may render the same image, each one writes its own file.
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        image.filter(ImageFilter.GaussianBlur(radius)).save(temporary_path, "JPEG", quality=85)
+        os.replace(temporary_path, path)
+
+    return tuple(paths)
+
+
+class ImageVariants:
+    """Blurred variants of film images for every number of attempts left.
+
+    Properties:
+        directory: Directory where rendered variants are cached.
+        attempts: Number of attempts in a round.
+        workers: Number of processes rendering variants.
+
+    """
+
+    directory: str
+    attempts: int
+    workers: int
+
+    def __init__(self, directory: str, attempts: int, workers: int = 2) -> None:
+        self.directory = directory
+        self.attempts = attempts
+        self.workers = workers
+        # film id -> (image path of the film, paths of variants)
+        self._variants: Dict[int, Tuple[str, Tuple[str, ...]]] = {}
+        self._pools: Set[ProcessPoolExecutor] = set()
+
+    def path(self, film: Film, attempts_left: int) -> Optional[str]:
+        """Returns the path of the variant or `None` if it's not rendered yet."""
+        variants = self._variants.get(film._id)
+        if variants is None or variants[0] != film.image_path or not 1 <= attempts_left <= len(variants[1]):
+            return None
+        return variants[1][attempts_left - 1]
+
+    async def prepare(self, films: Iterable[Film]) -> int:
+        """Renders missing variants of the films and remembers paths of all of them.
+
+        Returns:
+            Number of films whose variants are ready.
+        """
+        if importlib.util.find_spec("PIL") is None:
+            logger.warning("Pillow is not installed, hints are sent without images")
+            return 0
+
+        sources = await asyncio.to_thread(self._find_sources, list(films))
+        await asyncio.to_thread(os.makedirs, self.directory, exist_ok=True)
+
+        loop = asyncio.get_running_loop()
+        # Forking a process with running threads is unsafe.
+        pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        self._pools.add(pool)
+
+        async def render(film: Film, source_path: str) -> bool:
+            try:
+                variants = await loop.run_in_executor(pool, render_variants, source_path, self.directory, self.attempts)
+            except Exception:
+                logger.exception("Failed to render image variants of film %s", film._id)
+                return False
+
+            self._variants[film._id] = (film.image_path, variants)
+            return True
+
+        try:
+            prepared = sum(await asyncio.gather(*(render(film, path) for film, path in sources)))
+        finally:
+            self._pools.discard(pool)
+            pool.shutdown(wait=False, cancel_futures=True)
+
+        logger.info("Image variants of %d films are ready", prepared)
+        return prepared
+
+    def stop(self) -> None:
+        """Cancels rendering which hasn't started yet."""
+        for pool in self._pools:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def _find_sources(films: List[Film]) -> List[Tuple[Film, str]]:
+        return [(film, path) for film in films if (path := film.get_image_path())]
+
+
+def main() -> None:
+    from config.config import IMAGE_VARIANTS_PATH, IMAGE_VARIANTS_WORKERS, NUMBER_OF_ATTEMPTS, RESOURCES_PATH
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", default=os.path.join(RESOURCES_PATH, "images"), help="directory of film images")
+    parser.add_argument("--output", default=IMAGE_VARIANTS_PATH, help="directory of variants")
+    parser.add_argument("--attempts", type=int, default=NUMBER_OF_ATTEMPTS)
+    parser.add_argument("--workers", type=int, default=IMAGE_VARIANTS_WORKERS)
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+    sources = sorted(entry.path for entry in os.scandir(args.images) if entry.is_file())
+    with ProcessPoolExecutor(args.workers) as pool:
+        rendered = list(pool.map(render_variants, sources, [args.output] * len(sources), [args.attempts] * len(sources)))
+    print(f"Rendered variants of {len(rendered)} images into {args.output}")
+
+
+if __name__ == "__main__":
+    main()
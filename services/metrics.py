@@ -0,0 +1,102 @@
+"""Prometheus metrics of the bot.
+
+Metrics are registered in the default registry and served by
+`start_metrics_server` on a separate port, so they are not exposed with
+the public webhook.
+
+"""
+
+from typing import Iterator, Optional
+
+from aiohttp import web
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+from prometheus_client.core import REGISTRY, CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+from game.cache import PlayerCache
+
+
+# Buckets for operations done in memory, from 1 us to 10 ms.
+FAST_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 1e-2)
+
+HANDLER_LATENCY = Histogram(
+    "bot_handler_duration_seconds",
+    "Time of handling an update by a handler.",
+    ["router", "handler"],
+)
+THROTTLED_UPDATES = Counter(
+    "bot_throttled_updates_total",
+    "Number of updates dropped by throttling of a user or by the global limit.",
+    ["router", "limit"],
+)
+TELEGRAM_API_LATENCY = Histogram(
+    "bot_telegram_api_duration_seconds",
+    "Time of Bot API requests.",
+    ["method", "status"],
+)
+MONGO_LATENCY = Histogram(
+    "bot_mongo_duration_seconds",
+    "Time of MongoDB operations.",
+    ["collection", "operation"],
+)
+PLAYERS_FLUSH_LATENCY = Histogram(
+    "bot_players_flush_duration_seconds",
+    "Time of saving changed players to MongoDB.",
+    ["store"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+PLAYERS_FLUSHED = Counter(
+    "bot_players_flushed_total",
+    "Number of players saved to MongoDB.",
+    ["store"],
+)
+PICKER_LATENCY = Histogram(
+    "bot_picker_duration_seconds",
+    "Time of picking a film for a round.",
+    buckets=FAST_BUCKETS,
+)
+
+
+class PlayerCacheCollector(Collector):
+    """Reports the size and the hit rate of a `PlayerCache` when metrics are scraped."""
+
+    def __init__(self, cache: PlayerCache) -> None:
+        self.cache = cache
+
+    def collect(self) -> Iterator:
+        yield GaugeMetricFamily("bot_players_cache_size", "Number of cached players.", value=len(self.cache))
+        yield GaugeMetricFamily(
+            "bot_players_cache_dirty", "Number of players waiting for a flush.", value=self.cache.dirty_count
+        )
+        yield CounterMetricFamily("bot_players_cache_hits", "Number of players found in the cache.", value=self.cache.hits)
+        yield CounterMetricFamily(
+            "bot_players_cache_misses", "Number of players not found in the cache.", value=self.cache.misses
+        )
+
+
+_player_cache_collector: Optional[PlayerCacheCollector] = None
+
+
+def register_player_cache(cache: PlayerCache) -> None:
+    """Reports a players cache, replacing the one registered before."""
+    global _player_cache_collector
+
+    if _player_cache_collector is not None:
+        REGISTRY.unregister(_player_cache_collector)
+    _player_cache_collector = PlayerCacheCollector(cache)
+    REGISTRY.register(_player_cache_collector)
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(body=generate_latest(REGISTRY), headers={"Content-Type": CONTENT_TYPE_LATEST})
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """Serves `/metrics` on the given address until the returned runner is cleaned up."""
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host=host, port=port).start()
+    return runner
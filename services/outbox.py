@@ -0,0 +1,295 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+from aiogram.methods import SendMessage, SendPhoto
+from aiogram.methods.base import TelegramMethod
+
+logger = logging.getLogger(__name__)
+
+
+# Telegram rejects longer texts.
+MAX_TEXT_LENGTH = 4096
+
+
+class Priority(IntEnum):
+    """Priority of an outgoing message, lower values are sent first."""
+
+    ROUND = 0
+    DEFAULT = 1
+    BACKGROUND = 2
+
+
+@dataclass(slots=True)
+class _Outgoing:
+    method: TelegramMethod
+    priority: Priority
+    futures: List[asyncio.Future] = field(default_factory=list)
+    attempt: int = 0
+
+
+class _Chat:
+    __slots__ = ("queue", "ready_at", "sending", "ready_entry")
+
+    def __init__(self) -> None:
+        self.queue: Deque[_Outgoing] = deque()
+        self.ready_at = 0.0
+        self.sending = False
+        # Sequence number of the chat's current entry in the ready heap, older entries are skipped.
+        self.ready_entry: Optional[int] = None
+
+
+class Outbox:
+    """Queue of outgoing messages which respects Telegram rate limits.
+
+    Messages are sent by a background task at most `global_rate` per second
+    and at most one per `chat_interval` seconds to a chat. Messages to a
+    chat are sent in order; among chats ready to receive a message the one
+    with the most urgent message goes first, so replies in a round are not
+    delayed by background uploads. Consecutive texts to a chat waiting in
+    the queue are merged into one message.
+
+    A chat which got `RetryAfter` is paused for the requested time plus a
+    random jitter; network and server errors are retried with exponential
+    backoff. Limits are per process, so with several bot workers
+    `global_rate` should be divided between them.
+
+    Properties:
+        bot: Bot instance sending the messages.
+        global_rate: Maximal number of messages per second.
+        chat_interval: Minimal number of seconds between messages to a chat.
+        max_attempts: Number of attempts to send a message on transient errors.
+        backoff: Delay before the second attempt, doubled for every next one.
+
+    """
+
+    bot: Bot
+    global_rate: float
+    chat_interval: float
+    max_attempts: int
+    backoff: float
+
+    def __init__(
+        self,
+        bot: Bot,
+        global_rate: float = 30.0,
+        chat_interval: float = 1.0,
+        max_attempts: int = 5,
+        backoff: float = 0.5,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.bot = bot
+        self.global_rate = global_rate
+        self.chat_interval = chat_interval
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self._clock = clock
+
+        self._chats: Dict[int, _Chat] = {}
+        # Chats with messages waiting for their per chat interval: (ready at, chat id).
+        self._waiting: List[Tuple[float, int]] = []
+        # Chats allowed to receive a message: (priority, sequence, chat id).
+        self._ready: List[Tuple[int, int, int]] = []
+        self._sequence = itertools.count()
+        self._next_send_at = 0.0
+        self._wakeup = asyncio.Event()
+        self._sending: set = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        """Number of messages waiting to be sent."""
+        return sum(len(chat.queue) for chat in self._chats.values())
+
+    def start(self) -> None:
+        """Starts the background sending task."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Sends the queued messages for up to `timeout` seconds and stops."""
+        if self._task is None:
+            return
+
+        deadline = self._clock() + timeout
+        while (len(self) or self._sending) and self._clock() < deadline:
+            await asyncio.sleep(0.05)
+
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+        for chat in self._chats.values():
+            for outgoing in chat.queue:
+                self._fail(outgoing, asyncio.CancelledError())
+        self._chats.clear()
+
+    def send(self, method: TelegramMethod, priority: Priority = Priority.DEFAULT) -> asyncio.Future:
+        """Queues a method sending a message to a chat.
+
+        Args:
+            method: A method with a `chat_id`, e.g. `SendMessage`.
+            priority: Priority of the message.
+
+        Returns:
+            A future resolved with the result of the method, e.g. the sent
+            `Message`. Failures are logged, so the future may be ignored.
+        """
+        future = asyncio.get_running_loop().create_future()
+        # Marks the exception as retrieved when nobody awaits the future.
+        future.add_done_callback(lambda done: done.cancelled() or done.exception())
+
+        chat_id = method.chat_id
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _Chat()
+
+        last = chat.queue[-1] if chat.queue else None
+        if last is not None and last.attempt == 0 and (merged := self._merge(last.method, method)):
+            last.method = merged
+            last.futures.append(future)
+            if priority < last.priority:
+                last.priority = priority
+                if last is chat.queue[0] and chat.ready_entry is not None:
+                    # The chat is ready already, it moves up to the new priority.
+                    self._push_ready(chat_id, chat)
+            return future
+
+        chat.queue.append(_Outgoing(method, priority, [future]))
+        if len(chat.queue) == 1 and not chat.sending:
+            self._schedule(chat_id, chat)
+        return future
+
+    def send_message(
+        self,
+        chat_id: int,
+        text: str,
+        priority: Priority = Priority.DEFAULT,
+        **kwargs: Any,
+    ) -> asyncio.Future:
+        """Queues a text message, see `send`."""
+        return self.send(SendMessage(chat_id=chat_id, text=text, **kwargs), priority)
+
+    def send_photo(self, chat_id: int, photo: Any, priority: Priority = Priority.DEFAULT, **kwargs: Any) -> asyncio.Future:
+        """Queues a photo, see `send`."""
+        return self.send(SendPhoto(chat_id=chat_id, photo=photo, **kwargs), priority)
+
+    @staticmethod
+    def _merge(first: TelegramMethod, second: TelegramMethod) -> Optional[SendMessage]:
+        """Returns one message with texts of both messages or `None` if they can't be merged."""
+        if not isinstance(first, SendMessage) or not isinstance(second, SendMessage):
+            return None
+        # A keyboard is shown under the last message only.
+        if first.reply_markup is not None or first.entities or second.entities:
+            return None
+        # The merged message is sent with the parameters of both, e.g. the replied message.
+        parameters = {"text", "reply_markup"}
+        if first.model_dump(exclude=parameters) != second.model_dump(exclude=parameters):
+            return None
+
+        text = f"{first.text}\n\n{second.text}"
+        if len(text) > MAX_TEXT_LENGTH:
+            return None
+        return second.model_copy(update={"text": text})
+
+    def _schedule(self, chat_id: int, chat: _Chat) -> None:
+        if chat.ready_at <= self._clock():
+            self._push_ready(chat_id, chat)
+        else:
+            heapq.heappush(self._waiting, (chat.ready_at, chat_id))
+        self._wakeup.set()
+
+    def _push_ready(self, chat_id: int, chat: _Chat) -> None:
+        chat.ready_entry = next(self._sequence)
+        heapq.heappush(self._ready, (chat.queue[0].priority, chat.ready_entry, chat_id))
+
+    async def _run(self) -> None:
+        while True:
+            now = self._clock()
+            while self._waiting and self._waiting[0][0] <= now:
+                _, chat_id = heapq.heappop(self._waiting)
+                self._push_ready(chat_id, self._chats[chat_id])
+
+            if not self._ready:
+                self._wakeup.clear()
+                timeout = self._waiting[0][0] - now if self._waiting else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            if self._next_send_at > now:
+                await asyncio.sleep(self._next_send_at - now)
+                continue
+
+            _, entry, chat_id = heapq.heappop(self._ready)
+            chat = self._chats.get(chat_id)
+            if chat is None or entry != chat.ready_entry:
+                # The chat was pushed again with a higher priority.
+                continue
+            chat.ready_entry = None
+            chat.sending = True
+            self._next_send_at = max(self._next_send_at, now - 1 / self.global_rate) + 1 / self.global_rate
+
+            task = asyncio.create_task(self._send(chat_id, chat, chat.queue.popleft()))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(self, chat_id: int, chat: _Chat, outgoing: _Outgoing) -> None:
+        delay = self.chat_interval
+        try:
+            result = await self.bot(outgoing.method)
+        except TelegramRetryAfter as e:
+            delay = e.retry_after + random.uniform(0, max(1.0, e.retry_after * 0.1))
+            logger.warning("Flood control for chat %s, retrying in %.1f seconds", chat_id, delay)
+            chat.queue.appendleft(outgoing)
+        except (TelegramNetworkError, TelegramServerError) as e:
+            outgoing.attempt += 1
+            if outgoing.attempt >= self.max_attempts:
+                self._fail(outgoing, e)
+            else:
+                delay = self.backoff * 2 ** (outgoing.attempt - 1) * random.uniform(0.5, 1.5)
+                chat.queue.appendleft(outgoing)
+        except Exception as e:
+            self._fail(outgoing, e)
+        else:
+            for future in outgoing.futures:
+                if not future.done():
+                    future.set_result(result)
+
+        chat.sending = False
+        chat.ready_at = self._clock() + delay
+        if chat.queue:
+            self._schedule(chat_id, chat)
+        else:
+            # The chat keeps its interval until it's over.
+            asyncio.get_running_loop().call_later(delay, self._forget, chat_id)
+
+    def _forget(self, chat_id: int) -> None:
+        chat = self._chats.get(chat_id)
+        if chat is not None and not chat.queue and not chat.sending and chat.ready_at <= self._clock():
+            del self._chats[chat_id]
+
+    @staticmethod
+    def _fail(outgoing: _Outgoing, error: BaseException) -> None:
+        if not isinstance(error, asyncio.CancelledError):
+            logger.error("Failed to send %s to chat %s: %s", type(outgoing.method).__name__, outgoing.method.chat_id, error)
+
+        for future in outgoing.futures:
+            if not future.done():
+                if isinstance(error, asyncio.CancelledError):
+                    future.cancel()
+                else:
+                    future.set_exception(error)
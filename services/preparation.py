@@ -0,0 +1,232 @@
+"""Preparation of the game: connecting to MongoDB, loading the catalogue and starting background tasks.
+
+The dispatcher prepares the game when it starts, see `services.dispatcher`;
+with a fast start `Readiness` runs the preparation in the background.
+
+"""
+
+import asyncio
+import contextlib
+import functools
+import inspect
+import logging
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional
+
+from aiogram import Dispatcher
+from aiogram.fsm.storage.redis import Redis
+
+from config.config import (
+    DIFFICULTY_LEVELS,
+    FILMS_FILE_PATH,
+    FILMS_SOURCE,
+    FILMS_WATCH_INTERVAL,
+    FILM_STATS_FLUSH_INTERVAL,
+    FILM_STATS_REBUILD_INTERVAL,
+    GROUP_ROUND_DURATION,
+    IMAGES_WARMUP_CHAT_ID,
+    PLAYERS_CACHE_SIZE,
+    PLAYERS_CACHE_TTL,
+    PLAYERS_CHECKPOINT_INTERVAL,
+    PLAYERS_CHECKPOINT_PATH,
+    PLAYERS_FLUSH_INTERVAL,
+    PLAYERS_FLUSH_THRESHOLD,
+    PLAYERS_REDIS_BATCH_SIZE,
+    PLAYERS_REDIS_TTL,
+    PLAYERS_SHUTDOWN_TIMEOUT,
+    PLAYERS_STORE,
+)
+from database.dao import FilmDao, PlayerDao
+from fsm.states import FSMFillForm
+from game.cache import PlayerCache
+from game.catalogue import Catalogue
+from game.checkpoint import PlayersCheckpoint
+from game.film_stats import FilmStatistics
+from game.game import GuessFilm
+from game.group import GroupRounds
+from game.leaderboard import Leaderboard
+from game.redis_store import RedisPlayerStore
+from game.reload import CatalogueReloader
+from game.store import LocalPlayerStore, PlayerStore, ScoreInbox
+from handlers.group import announce_timeout
+from services.image_cache import ImageCache
+from services.metrics import register_player_cache
+from services.outbox import Outbox
+from services.timer_wheel import TimerWheel
+
+if TYPE_CHECKING:
+    from pymongo.asynchronous.database import AsyncDatabase
+
+logger = logging.getLogger(__name__)
+
+# Keeps references to fire-and-forget tasks so they are not garbage collected.
+background_tasks = set()
+
+
+def run_in_background(coroutine) -> None:
+    task = asyncio.create_task(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+async def prepare_game(
+    dispatcher: Dispatcher,
+    redis: Redis,
+    connect_database: Callable[[], "AsyncDatabase"],
+    worker_index: int,
+    workers: int = 1,
+) -> Dict[str, Any]:
+    """Connects to MongoDB, loads the catalogue and starts the game.
+
+    Films are loaded from the file while the database is connected.
+
+    Returns:
+        Dependencies of handlers, they are also added to the dispatcher.
+    """
+    # A failed preparation is retried from scratch, so whatever was started is stopped first.
+    async with contextlib.AsyncExitStack() as started:
+        # Resolving a mongodb+srv:// URI and importing pymongo block, so they are done in a thread.
+        database_task = asyncio.ensure_future(asyncio.to_thread(connect_database))
+        # Every attempt connects a new client, the one of a failed attempt is closed.
+        started.push_async_callback(close_database, database_task)
+
+        async def load_catalogue() -> Catalogue:
+            database = await database_task if FILMS_SOURCE == "mongo" else None
+            return await GuessFilm.load_catalogue(FilmDao(database))
+
+        database, catalogue = await asyncio.gather(database_task, load_catalogue())
+
+        players_dao = PlayerDao(database)
+        players = create_player_store(
+            redis, players_dao, worker_index, workers, dispatcher.workflow_data["leaderboard"]
+        )
+        image_cache: ImageCache = dispatcher.workflow_data["image_cache"]
+        outbox: Outbox = dispatcher.workflow_data["outbox"]
+
+        # Replays players left by a killed process before any update reads them.
+        await players.start()
+        started.push_async_callback(players.stop)
+
+        # Tables are rebuilt in the background, films are picked uniformly until then.
+        stats = FilmStatistics(
+            redis,
+            lambda: game.catalogue.picker,
+            FILM_STATS_FLUSH_INTERVAL,
+            FILM_STATS_REBUILD_INTERVAL,
+            DIFFICULTY_LEVELS,
+        )
+        game = GuessFilm(catalogue, players, dispatcher.workflow_data["leaderboard"], stats)
+        await stats.start()
+        started.push_async_callback(stats.stop)
+
+        watch_path = FILMS_FILE_PATH if FILMS_SOURCE == "file" else None
+        reloader = CatalogueReloader(game, FilmDao(database), redis, watch_path, FILMS_WATCH_INTERVAL)
+        reloader.listeners.append(image_cache.reset)
+        if FILM_STATS_REBUILD_INTERVAL > 0:
+            reloader.listeners.append(lambda reloaded: run_in_background(stats.safe_rebuild()))
+        if image_cache.variants is not None:
+            variants = image_cache.variants
+            reloader.listeners.append(lambda reloaded: run_in_background(variants.prepare(reloaded.films.values())))
+        reloader.start()
+        started.push_async_callback(reloader.stop)
+
+        group_rounds = GroupRounds(game, redis, TimerWheel(), GROUP_ROUND_DURATION)
+        group_rounds.listeners.append(functools.partial(announce_timeout, outbox, game))
+        group_rounds.wheel.start()
+        started.push_async_callback(group_rounds.wheel.stop)
+
+        started.pop_all()
+
+    # Nothing below fails, so one-off background tasks are started once.
+    if image_cache.variants is not None:
+        # Rendering runs in worker processes, rounds send original images until it's done.
+        run_in_background(image_cache.variants.prepare(catalogue.films.values()))
+
+    if dispatcher.workflow_data["primary"]:
+        if IMAGES_WARMUP_CHAT_ID is not None:
+            run_in_background(image_cache.warm_up(outbox, IMAGES_WARMUP_CHAT_ID, game.films.values()))
+
+        # The ranking is lost only with Redis data, rebuilding it doesn't block updates.
+        run_in_background(game.leaderboard.rebuild_if_missing(players_dao.iter_scores()))
+        # Building an index of a big collection takes minutes, the game doesn't need to wait.
+        run_in_background(ensure_indexes(database))
+
+    dependencies = {"game": game, "reloader": reloader, "players_dao": players_dao, "group_rounds": group_rounds}
+    dispatcher.workflow_data.update(dependencies)
+    logger.info("The game is ready with %d films", len(catalogue))
+    return dependencies
+
+
+async def ensure_indexes(database: "AsyncDatabase") -> None:
+    """Creates indexes of the collections, a failure doesn't stop the bot."""
+    from database.database import ensure_indexes
+
+    try:
+        await ensure_indexes(database)
+    except Exception:
+        logger.exception("Failed to create indexes")
+
+
+def create_player_store(
+    redis: Redis,
+    players_dao: PlayerDao,
+    worker_index: int = 0,
+    workers: int = 1,
+    leaderboard: Optional[Leaderboard] = None,
+) -> PlayerStore:
+    """Creates the configured storage of players state."""
+    if PLAYERS_STORE == "redis":
+        return RedisPlayerStore(
+            redis,
+            players_dao,
+            PLAYERS_FLUSH_INTERVAL,
+            PLAYERS_REDIS_BATCH_SIZE,
+            PLAYERS_REDIS_TTL,
+            FSMFillForm.in_game_state.state,
+        )
+
+    cache = PlayerCache(PLAYERS_CACHE_SIZE, PLAYERS_CACHE_TTL)
+    register_player_cache(cache)
+
+    checkpoint = None
+    if PLAYERS_CHECKPOINT_PATH:
+        # Every worker process has its own file.
+        path = f"{PLAYERS_CHECKPOINT_PATH}.{worker_index}" if worker_index else PLAYERS_CHECKPOINT_PATH
+        checkpoint = PlayersCheckpoint(path)
+
+    inbox = None
+    if workers > 1:
+        # Imported here, the supervisor module imports this one.
+        from services.supervisor import shard_of
+
+        inbox = ScoreInbox(redis, worker_index, functools.partial(shard_of, workers=workers), leaderboard=leaderboard)
+
+    return LocalPlayerStore(
+        cache,
+        players_dao,
+        PLAYERS_FLUSH_INTERVAL,
+        PLAYERS_FLUSH_THRESHOLD,
+        checkpoint,
+        PLAYERS_CHECKPOINT_INTERVAL,
+        PLAYERS_SHUTDOWN_TIMEOUT,
+        inbox,
+    )
+
+
+def connect_database() -> "AsyncDatabase":
+    """Returns the configured database, importing pymongo only when it's needed."""
+    from database.database import get_database
+
+    return get_database()
+
+
+async def close_database(database_task: "asyncio.Future[AsyncDatabase]") -> None:
+    """Closes the client of a database connected by `connect_database`, if it was connected."""
+    try:
+        database = await database_task
+    except Exception:
+        return
+
+    # The client of pymongo closes asynchronously, Motor clients used in tests close synchronously.
+    closing = database.client.close()
+    if inspect.isawaitable(closing):
+        await closing
@@ -0,0 +1,66 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Readiness:
+    """Dependencies of handlers which are prepared after the bot starts receiving updates.
+
+    Connecting to MongoDB and loading films take seconds, so with a fast
+    start they run in the background and updates which need them wait.
+    A failed preparation is retried with exponential backoff.
+
+    Properties:
+        data: Prepared dependencies by name, `None` until they are ready.
+        max_delay: Maximal number of seconds between attempts to prepare.
+
+    """
+
+    data: Optional[Dict[str, Any]]
+    max_delay: float
+
+    def __init__(self, max_delay: float = 30.0) -> None:
+        self.data = None
+        self.max_delay = max_delay
+        self._ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def prepare(self, factory: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """Prepares the dependencies, retrying until `factory` succeeds."""
+        delay = 1.0
+        while True:
+            try:
+                data = await factory()
+            except Exception:
+                logger.exception("Failed to prepare the game, retrying in %s seconds", delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_delay)
+                continue
+
+            self.data = data
+            self._ready.set()
+            return data
+
+    def start(self, factory: Callable[[], Awaitable[Dict[str, Any]]]) -> None:
+        """Prepares the dependencies in the background."""
+        if self._task is None:
+            self._task = asyncio.create_task(self.prepare(factory))
+
+    async def stop(self) -> None:
+        """Cancels the preparation if it's still running."""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def wait(self, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Returns the dependencies once they are ready.
+
+        Raises:
+            asyncio.TimeoutError: if they are not ready in `timeout` seconds.
+        """
+        if self.data is None:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        return self.data
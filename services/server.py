@@ -0,0 +1,62 @@
+"""Running the bot process: logging, stop signals and serving webhooks."""
+
+import asyncio
+import logging
+import signal
+from typing import List
+
+from aiogram import Bot
+from aiohttp import web
+
+from config.config import (
+    WEBHOOK_BASE_URL,
+    WEBHOOK_HOST,
+    WEBHOOK_MAX_CONNECTIONS,
+    WEBHOOK_PATH,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def setup_logging():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(filename)s:%(lineno)d #%(levelname)-8s [%(asctime)s] - %(processName)s - %(name)s - %(message)s",
+    )
+
+
+def create_stop_event() -> asyncio.Event:
+    """Returns an event set when SIGINT or SIGTERM is received."""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+    return stop_event
+
+
+async def set_webhook(bot: Bot, allowed_updates: List[str]):
+    if not WEBHOOK_BASE_URL:
+        raise ValueError("Set WEBHOOK_BASE_URL to run the bot in webhook mode.")
+
+    await bot.set_webhook(
+        url=f"{WEBHOOK_BASE_URL.rstrip('/')}{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET,
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+        allowed_updates=allowed_updates,
+    )
+
+
+async def serve_app(app: web.Application, stop_event: asyncio.Event):
+    """Serves the webhook application until `stop_event` is set."""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=WEBHOOK_HOST, port=WEBHOOK_PORT)
+    await site.start()
+    logger.info("Serving webhook on %s:%s%s", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+
+    try:
+        await stop_event.wait()
+    finally:
+        await runner.cleanup()
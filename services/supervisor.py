@@ -0,0 +1,440 @@
+"""Sharding of updates between worker processes.
+
+The supervisor process receives updates (by polling or webhook) and sends
+each one to the worker which owns its user, so every worker keeps its own
+players in memory and nothing is shared between processes. Updates are
+sent as length-prefixed JSON frames over a Unix socket per worker; one
+connection per worker and one queue per user in the worker keep updates
+of a user in order, while different users are handled concurrently.
+
+`run_sharded` is the entry point of the supervisor and `run_worker` the
+entry point of a worker process.
+
+"""
+
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import struct
+import tempfile
+import time
+import zlib
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Set
+
+from aiogram import Bot, Dispatcher
+from aiogram.fsm.storage.redis import Redis
+from aiohttp import web
+
+from config.config import (
+    METRICS_HOST,
+    METRICS_PORT,
+    REDIS_HOST,
+    REDIS_PORT,
+    RUN_MODE,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WORKERS,
+)
+from services.dispatcher import create_bot, create_dispatcher, used_update_types
+from services.metrics import start_metrics_server
+from services.preparation import connect_database
+from services.server import create_stop_event, serve_app, set_webhook, setup_logging
+
+logger = logging.getLogger(__name__)
+
+
+_FRAME_HEADER = struct.Struct("!I")
+
+
+def shard_of(user_id: int, workers: int) -> int:
+    """Returns the index of the worker owning the user."""
+    return zlib.crc32(str(user_id).encode()) % workers
+
+
+def update_user_id(update: Dict[str, Any]) -> int:
+    """Returns the id of the user who caused a raw update, 0 if there is none."""
+    for name, payload in update.items():
+        if name == "update_id" or not isinstance(payload, dict):
+            continue
+        user = payload.get("from") or payload.get("user") or payload.get("chat")
+        if isinstance(user, dict) and "id" in user:
+            return user["id"]
+    return 0
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Optional[bytes]:
+    """Reads a frame or returns `None` when the connection is closed."""
+    try:
+        header = await reader.readexactly(_FRAME_HEADER.size)
+        return await reader.readexactly(_FRAME_HEADER.unpack(header)[0])
+    except asyncio.IncompleteReadError:
+        return None
+
+
+class ShardRouter:
+    """Sends raw updates to the workers owning their users.
+
+    Properties:
+        socket_paths: Paths of Unix sockets of the workers, by worker index.
+        connect_timeout: Number of seconds to wait for a (restarted) worker.
+
+    """
+
+    socket_paths: List[str]
+    connect_timeout: float
+
+    def __init__(self, socket_paths: List[str], connect_timeout: float = 30.0) -> None:
+        self.socket_paths = socket_paths
+        self.connect_timeout = connect_timeout
+        self._writers: List[Optional[asyncio.StreamWriter]] = [None] * len(socket_paths)
+        self._locks = [asyncio.Lock() for _ in socket_paths]
+
+    async def send(self, payload: bytes, user_id: int) -> None:
+        """Sends an update to its worker, reconnecting once if the worker was restarted."""
+        index = shard_of(user_id, len(self.socket_paths))
+        frame = _FRAME_HEADER.pack(len(payload)) + payload
+
+        async with self._locks[index]:
+            for attempt in range(2):
+                writer = self._writers[index] or await self._connect(index)
+                try:
+                    writer.write(frame)
+                    await writer.drain()
+                    return
+                except (ConnectionError, OSError):
+                    self._writers[index] = None
+                    if attempt:
+                        raise
+
+    async def close(self) -> None:
+        for writer in self._writers:
+            if writer is not None:
+                writer.close()
+                await writer.wait_closed()
+        self._writers = [None] * len(self.socket_paths)
+
+    async def _connect(self, index: int) -> asyncio.StreamWriter:
+        deadline = asyncio.get_running_loop().time() + self.connect_timeout
+        while True:
+            try:
+                _, writer = await asyncio.open_unix_connection(self.socket_paths[index])
+                break
+            except (ConnectionError, FileNotFoundError):
+                if asyncio.get_running_loop().time() > deadline:
+                    raise
+                await asyncio.sleep(0.1)
+
+        self._writers[index] = writer
+        return writer
+
+
+class WorkerServer:
+    """Receives updates from the supervisor and feeds them to a dispatcher.
+
+    Updates of a user are handled one after another in the order they
+    were received; updates of different users are handled concurrently.
+
+    Properties:
+        dp: Dispatcher handling the updates.
+        bot: Bot instance the updates are handled with.
+
+    """
+
+    dp: Dispatcher
+    bot: Bot
+
+    def __init__(self, dp: Dispatcher, bot: Bot) -> None:
+        self.dp = dp
+        self.bot = bot
+        self._queues: Dict[int, Deque[Dict[str, Any]]] = {}
+        self._connections: Set[asyncio.Task] = set()
+        # Keeps references to the tasks handling users, so they are not garbage collected.
+        self._handlers: Set[asyncio.Task] = set()
+        self._drained = asyncio.Event()
+        self._drained.set()
+
+    async def serve(self, socket_path: str, stop_event: asyncio.Event, drain_timeout: float = 30.0) -> None:
+        """Serves the socket until `stop_event` is set and waits for queued updates."""
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = await asyncio.start_unix_server(self._handle_connection, path=socket_path)
+
+        try:
+            await stop_event.wait()
+        finally:
+            server.close()
+            # Updates already received are handled, the ones not read yet are lost.
+            for connection in self._connections:
+                connection.cancel()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+            await server.wait_closed()
+
+        try:
+            await asyncio.wait_for(self._drained.wait(), drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Stopping with %d users having unhandled updates", len(self._queues))
+
+    def submit(self, update: Dict[str, Any]) -> None:
+        user_id = update_user_id(update)
+        queue = self._queues.get(user_id)
+        if queue is not None:
+            queue.append(update)
+            return
+
+        self._queues[user_id] = deque([update])
+        self._drained.clear()
+        task = asyncio.create_task(self._handle_user(user_id))
+        self._handlers.add(task)
+        task.add_done_callback(self._handlers.discard)
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        connection = asyncio.current_task()
+        self._connections.add(connection)
+        try:
+            while (payload := await read_frame(reader)) is not None:
+                self.submit(json.loads(payload))
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._connections.discard(connection)
+            writer.close()
+
+    async def _handle_user(self, user_id: int) -> None:
+        queue = self._queues[user_id]
+        while queue:
+            try:
+                await self.dp.feed_raw_update(self.bot, queue.popleft())
+            except Exception:
+                logger.exception("Failed to handle an update of user %s", user_id)
+
+        del self._queues[user_id]
+        if not self._queues:
+            self._drained.set()
+
+
+class Supervisor:
+    """Starts worker processes and restarts the ones which exit unexpectedly.
+
+    A worker which exits soon after it was started is restarted with
+    exponential backoff; after `max_restarts` such exits in a row the
+    supervisor gives up, since the worker is most likely misconfigured,
+    and calls `on_failure`.
+
+    Properties:
+        worker_target: A picklable function started in every worker with the
+                       worker index and its socket path.
+        socket_paths: Paths of Unix sockets of the workers.
+        on_failure: A function called when a worker can't be kept running.
+        max_restarts: Number of quick exits in a row after which the supervisor gives up.
+        max_delay: Maximal number of seconds between restarts of a worker.
+        stable_after: Number of seconds after which an exit of a worker is
+                      not counted as a failed start.
+
+    """
+
+    worker_target: Callable[[int, str], None]
+    socket_paths: List[str]
+    on_failure: Optional[Callable[[], None]]
+    max_restarts: int
+    max_delay: float
+    stable_after: float
+
+    def __init__(
+        self,
+        worker_target: Callable[[int, str], None],
+        socket_paths: List[str],
+        on_failure: Optional[Callable[[], None]] = None,
+        max_restarts: int = 10,
+        max_delay: float = 60.0,
+        stable_after: float = 300.0,
+    ) -> None:
+        self.worker_target = worker_target
+        self.socket_paths = socket_paths
+        self.on_failure = on_failure
+        self.max_restarts = max_restarts
+        self.max_delay = max_delay
+        self.stable_after = stable_after
+        # Workers are started from scratch, without a copy of the supervisor's state.
+        self._context = multiprocessing.get_context("spawn")
+        self._processes: List[Optional[multiprocessing.Process]] = [None] * len(socket_paths)
+        self._started_at = [0.0] * len(socket_paths)
+        self._failures = [0] * len(socket_paths)
+        # Monotonic time of the next start of an exited worker, `None` while it runs.
+        self._restart_at: List[Optional[float]] = [None] * len(socket_paths)
+        self._stopping = False
+        self._monitor: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        for index in range(len(self.socket_paths)):
+            self._start_worker(index)
+        self._monitor = asyncio.create_task(self._watch())
+
+    async def stop(self, timeout: float = 60.0) -> None:
+        """Asks workers to finish their updates and save players, kills them after `timeout`."""
+        self._stopping = True
+        if self._monitor is not None:
+            self._monitor.cancel()
+
+        for process in self._processes:
+            if process is not None and process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)
+
+        for process in self._processes:
+            if process is None:
+                continue
+            await asyncio.to_thread(process.join, timeout)
+            if process.is_alive():
+                logger.error("Worker %s didn't stop in %s seconds, killing it", process.name, timeout)
+                process.kill()
+
+    def _start_worker(self, index: int) -> None:
+        process = self._context.Process(
+            target=self.worker_target,
+            args=(index, self.socket_paths[index]),
+            name=f"worker-{index}",
+        )
+        process.start()
+        self._processes[index] = process
+        self._started_at[index] = time.monotonic()
+        self._restart_at[index] = None
+        logger.info("Started worker %d (pid %s)", index, process.pid)
+
+    async def _watch(self) -> None:
+        while not self._stopping:
+            await asyncio.sleep(1.0)
+            for index, process in enumerate(self._processes):
+                if process is None or process.is_alive() or self._stopping:
+                    continue
+
+                now = time.monotonic()
+                if self._restart_at[index] is None:
+                    if not self._schedule_restart(index, process.exitcode, now):
+                        return
+                if now >= self._restart_at[index]:
+                    self._start_worker(index)
+
+    def _schedule_restart(self, index: int, exitcode: Optional[int], now: float) -> bool:
+        """Sets when an exited worker is started again.
+
+        Returns:
+            `False` if the worker has failed too many times and the supervisor gave up.
+        """
+        if now - self._started_at[index] >= self.stable_after:
+            self._failures[index] = 0
+        self._failures[index] += 1
+
+        if self._failures[index] > self.max_restarts:
+            logger.critical("Worker %d exited with code %s too many times in a row, giving up", index, exitcode)
+            self._stopping = True
+            if self.on_failure is not None:
+                self.on_failure()
+            return False
+
+        delay = min(2.0 ** (self._failures[index] - 1), self.max_delay)
+        logger.error("Worker %d exited with code %s, restarting it in %s seconds", index, exitcode, delay)
+        self._restart_at[index] = now + delay
+        return True
+
+
+async def poll_to_workers(bot: Bot, shards: ShardRouter, stop_event: asyncio.Event):
+    """Receives updates with long polling and sends them to the workers owning their users."""
+    await bot.delete_webhook(drop_pending_updates=True)
+    allowed_updates = used_update_types()
+    offset: Optional[int] = None
+
+    while not stop_event.is_set():
+        polling = asyncio.create_task(bot.get_updates(offset=offset, timeout=25, allowed_updates=allowed_updates))
+        stopping = asyncio.create_task(stop_event.wait())
+        await asyncio.wait({polling, stopping}, return_when=asyncio.FIRST_COMPLETED)
+        stopping.cancel()
+        if not polling.done():
+            polling.cancel()
+            break
+
+        try:
+            updates = polling.result()
+        except Exception:
+            logger.exception("Failed to get updates, retrying in a second")
+            await asyncio.sleep(1)
+            continue
+
+        for update in updates:
+            payload = update.model_dump(mode="json", exclude_unset=True)
+            await shards.send(json.dumps(payload).encode(), update_user_id(payload))
+            offset = update.update_id + 1
+
+
+async def serve_webhook_to_workers(bot: Bot, shards: ShardRouter, stop_event: asyncio.Event):
+    """Receives updates pushed by Telegram and sends them to the workers owning their users."""
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+            return web.Response(status=401)
+
+        payload = await request.read()
+        await shards.send(payload, update_user_id(json.loads(payload)))
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle_update)
+
+    await set_webhook(bot, used_update_types())
+    await serve_app(app, stop_event)
+
+
+def run_worker(index: int, socket_path: str):
+    """Entry point of a worker process in the sharded mode."""
+    setup_logging()
+    asyncio.run(serve_shard(index, socket_path))
+
+
+async def serve_shard(index: int, socket_path: str):
+    """Handles updates of the users owned by the worker until it's asked to stop."""
+    stop_event = create_stop_event()
+
+    redis = Redis(host=REDIS_HOST, port=REDIS_PORT)
+    bot: Bot = create_bot()
+    dp: Dispatcher = await create_dispatcher(redis, connect_database, bot, index, WORKERS)
+
+    # The supervisor serves METRICS_PORT, workers serve the next ports.
+    metrics_runner = await start_metrics_server(METRICS_HOST, METRICS_PORT + 1 + index) if METRICS_PORT else None
+    await dp.emit_startup(bot=bot, dispatcher=dp, bots=[bot], **dp.workflow_data)
+    try:
+        await WorkerServer(dp, bot).serve(socket_path, stop_event)
+    finally:
+        await dp.emit_shutdown(bot=bot, dispatcher=dp, bots=[bot], **dp.workflow_data)
+        await bot.session.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+
+
+async def run_sharded(bot: Bot):
+    """Runs WORKERS worker processes and sends every update to the worker owning its user.
+
+    Each worker keeps the players of its users in memory, so the game
+    scales across CPU cores of a host without shared in-memory state.
+    """
+    socket_dir = tempfile.mkdtemp(prefix="guess-film-")
+    socket_paths = [os.path.join(socket_dir, f"worker-{index}.sock") for index in range(WORKERS)]
+
+    stop_event = create_stop_event()
+    # The bot stops if a worker can't be kept running.
+    supervisor = Supervisor(run_worker, socket_paths, on_failure=stop_event.set)
+    supervisor.start()
+    shards = ShardRouter(socket_paths)
+
+    try:
+        if RUN_MODE == "webhook":
+            await serve_webhook_to_workers(bot, shards, stop_event)
+        else:
+            await poll_to_workers(bot, shards, stop_event)
+    finally:
+        await shards.close()
+        await supervisor.stop()
+        await bot.session.close()
+        shutil.rmtree(socket_dir, ignore_errors=True)
@@ -0,0 +1,111 @@
+import asyncio
+import inspect
+import logging
+import math
+import time
+from typing import Any, Callable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class Timer:
+    """A callback scheduled by `TimerWheel`, can be cancelled until it fires."""
+
+    __slots__ = ("tick", "callback", "_wheel")
+
+    def __init__(self, tick: int, callback: Callable[[], Any], wheel: "TimerWheel") -> None:
+        self.tick = tick
+        self.callback = callback
+        self._wheel = wheel
+
+    def cancel(self) -> None:
+        self._wheel._buckets[self.tick % len(self._wheel._buckets)].discard(self)
+
+
+class TimerWheel:
+    """Hashed timing wheel which runs callbacks after a delay.
+
+    Timers are put into `slots` buckets by the tick they expire at, and one
+    background task fires the due timers of a bucket every `tick` seconds.
+    Scheduling and cancelling a timer take O(1), and thousands of pending
+    timers cost one task instead of a sleeping task each. Timers fire up
+    to `tick` seconds late.
+
+    Properties:
+        tick: Number of seconds between checks of the timers.
+
+    """
+
+    tick: float
+
+    def __init__(self, tick: float = 1.0, slots: int = 128, clock: Callable[[], float] = time.monotonic) -> None:
+        self.tick = tick
+        self._clock = clock
+        self._buckets: List[Set[Timer]] = [set() for _ in range(slots)]
+        self._started_at = clock()
+        self._current_tick = 0
+        self._task: Optional[asyncio.Task] = None
+        self._running: Set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        """Number of pending timers."""
+        return sum(len(bucket) for bucket in self._buckets)
+
+    def start(self) -> None:
+        """Starts the background task firing timers."""
+        if self._task is None:
+            self._started_at = self._clock() - self._current_tick * self.tick
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stops firing timers; pending ones are dropped and running callbacks are awaited."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+        for bucket in self._buckets:
+            bucket.clear()
+        await asyncio.gather(*self._running, return_exceptions=True)
+
+    def schedule(self, delay: float, callback: Callable[[], Any]) -> Timer:
+        """Runs `callback` in `delay` seconds; a coroutine function runs as a task.
+
+        Returns:
+            The timer, which can be cancelled.
+        """
+        timer = Timer(self._current_tick + max(1, math.ceil(delay / self.tick)), callback, self)
+        self._buckets[timer.tick % len(self._buckets)].add(timer)
+        return timer
+
+    async def _run(self) -> None:
+        while True:
+            next_tick_at = self._started_at + (self._current_tick + 1) * self.tick
+            await asyncio.sleep(max(0.0, next_tick_at - self._clock()))
+
+            # Catches up if the loop was busy for longer than a tick.
+            now_tick = int((self._clock() - self._started_at) / self.tick)
+            while self._current_tick < now_tick:
+                self._current_tick += 1
+                self._fire_due(self._buckets[self._current_tick % len(self._buckets)])
+
+    def _fire_due(self, bucket: Set[Timer]) -> None:
+        # A bucket also keeps timers due in later turns of the wheel.
+        due = [timer for timer in bucket if timer.tick <= self._current_tick]
+        for timer in due:
+            bucket.discard(timer)
+            try:
+                result = timer.callback()
+            except Exception:
+                logger.exception("Timer callback failed")
+                continue
+
+            if inspect.isawaitable(result):
+                task = asyncio.ensure_future(result)
+                self._running.add(task)
+                task.add_done_callback(self._on_done)
+
+    def _on_done(self, task: asyncio.Task) -> None:
+        self._running.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Timer callback failed", exc_info=task.exception())
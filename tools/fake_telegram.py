@@ -0,0 +1,167 @@
+"""Local stand-in for Telegram to try the bot without the real Bot API.
+
+Start a fake Bot API server, which answers every method with a plausible
+result, and point the bot at it:
+
+    python -m tools.fake_telegram api --port 8081
+    TELEGRAM_API_SERVER=http://localhost:8081 RUN_MODE=webhook \\
+        WEBHOOK_BASE_URL=http://localhost:8080 WEBHOOK_SECRET=secret python main.py
+
+Then post fake updates to the bot webhook:
+
+    python -m tools.fake_telegram post --url http://localhost:8080/webhook \\
+        --secret secret --users 100 --text /start /play "Матрица" /surrender
+
+`FakeTelegramSession` answers the same way inside the process, without
+HTTP, e.g. for load tests (see `benchmarks/loadtest.py`).
+
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import time
+from typing import Any, AsyncGenerator, Callable, Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods.base import TelegramMethod
+from aiohttp import ClientSession, web
+
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+_message_ids = itertools.count(1)
+
+
+def make_message(chat_id: int, text: Optional[str] = None) -> Dict[str, Any]:
+    """Builds a private chat message sent by the user with id `chat_id`."""
+    message: Dict[str, Any] = {
+        "message_id": next(_message_ids),
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": f"Player {chat_id}"},
+    }
+    if text is not None:
+        message["text"] = text
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return message
+
+
+def make_update(update_id: int, chat_id: int, text: str) -> Dict[str, Any]:
+    return {"update_id": update_id, "message": make_message(chat_id, text)}
+
+
+def fake_result(method: str, params: Dict[str, Any]) -> Any:
+    """Returns a plausible result of a Bot API method called with `params`."""
+    method = method.lower()
+
+    if method == "getme":
+        return {"id": 1, "is_bot": True, "first_name": "Guess Film Bot", "username": "guess_film_bot"}
+
+    if method.startswith("send"):
+        result = make_message(int(params.get("chat_id") or 0), params.get("text") or params.get("caption"))
+        result["from"] = {"id": 1, "is_bot": True, "first_name": "Guess Film Bot"}
+        if method == "sendphoto":
+            file_id = params["photo"] if isinstance(params.get("photo"), str) else f"photo-{result['message_id']}"
+            result["photo"] = [{"file_id": file_id, "file_unique_id": file_id, "width": 640, "height": 480}]
+        return result
+
+    return True
+
+
+async def handle_api_method(request: web.Request) -> web.Response:
+    """Answers a Bot API method call like Telegram would do it."""
+    result = fake_result(request.match_info["method"], dict(await request.post()))
+    return web.json_response({"ok": True, "result": result})
+
+
+class FakeTelegramSession(BaseSession):
+    """aiogram session which answers Bot API methods in the process like the fake server.
+
+    Properties:
+        latency: Number of seconds every request takes.
+        on_request: Optional callable invoked with every method before it's answered.
+
+    """
+
+    latency: float
+    on_request: Optional[Callable[[TelegramMethod], None]]
+
+    def __init__(self, latency: float = 0.0, on_request: Optional[Callable[[TelegramMethod], None]] = None) -> None:
+        super().__init__()
+        self.latency = latency
+        self.on_request = on_request
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: Optional[int] = None) -> Any:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.on_request is not None:
+            self.on_request(method)
+
+        params = {name: getattr(method, name, None) for name in ("chat_id", "text", "caption", "photo")}
+        content = json.dumps({"ok": True, "result": fake_result(method.__api_method__, params)})
+        return self.check_response(bot=bot, method=method, status_code=200, content=content).result
+
+    async def stream_content(self, *args: Any, **kwargs: Any) -> AsyncGenerator[bytes, None]:
+        yield b""
+
+    async def close(self) -> None:
+        pass
+
+
+def run_api(host: str, port: int) -> None:
+    app = web.Application(client_max_size=32 * 1024 * 1024)
+    app.router.add_post("/bot{token}/{method}", handle_api_method)
+    web.run_app(app, host=host, port=port)
+
+
+async def post_updates(url: str, secret: Optional[str], users: int, texts: List[str], concurrency: int) -> None:
+    """Posts a scenario of messages for each user and reports the throughput."""
+    headers = {SECRET_HEADER: secret} if secret else {}
+    update_ids = itertools.count(1)
+    semaphore = asyncio.Semaphore(concurrency)
+    statuses: Dict[int, int] = {}
+
+    async def play(session: ClientSession, user_id: int) -> None:
+        # Messages of one user are posted in order, like Telegram does.
+        for text in texts:
+            async with semaphore:
+                async with session.post(url, json=make_update(next(update_ids), user_id, text), headers=headers) as response:
+                    statuses[response.status] = statuses.get(response.status, 0) + 1
+
+    start = time.perf_counter()
+    async with ClientSession() as session:
+        await asyncio.gather(*(play(session, user_id) for user_id in range(1, users + 1)))
+    elapsed = time.perf_counter() - start
+
+    total = sum(statuses.values())
+    print(f"Posted {total} updates in {elapsed:.2f}s ({total / elapsed:.0f} updates/s), statuses: {statuses}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    api = commands.add_parser("api", help="run a fake Bot API server")
+    api.add_argument("--host", default="127.0.0.1")
+    api.add_argument("--port", type=int, default=8081)
+
+    post = commands.add_parser("post", help="post fake updates to a webhook")
+    post.add_argument("--url", default="http://127.0.0.1:8080/webhook")
+    post.add_argument("--secret", default=None)
+    post.add_argument("--users", type=int, default=10)
+    post.add_argument("--concurrency", type=int, default=50)
+    post.add_argument("--text", nargs="+", default=["/start", "/play", "/surrender"])
+
+    args = parser.parse_args()
+    if args.command == "api":
+        run_api(args.host, args.port)
+    else:
+        asyncio.run(post_updates(args.url, args.secret, args.users, args.text, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()